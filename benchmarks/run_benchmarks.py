@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from yubihsm import YubiHsm
+from yubihsm.defs import ALGORITHM, COMMAND, OBJECT
+from yubihsm.defs import CAPABILITY as CAP
+from yubihsm.objects import AsymmetricKey
+from yubihsm.utils import password_to_key
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from hsmtools.connection import connect
+from hsmtools.emulator import ConnectorServer, SoftwareHsm
+from hsmtools.signing import KEY_SCHEMES, SCHEMES, benchmark, sign_digest
+
+PASSWORD = 'password'
+KEY_ID = 2000
+
+# Rough figures for a YubiHSM 2 on USB, in milliseconds. Override with -l.
+DEFAULT_LATENCY = {
+    'default': 2,
+    'CREATE_SESSION': 5,
+    'AUTHENTICATE_SESSION': 5,
+    'SIGN_ECDSA': 80,
+    'SIGN_EDDSA': 100,
+    'SIGN_PSS': 150,
+    'GENERATE_ASYMMETRIC_KEY': 150,
+    'EXPORT_WRAPPED': 20,
+    'IMPORT_WRAPPED': 40,
+}
+
+SIZES = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+
+def parse_size(value):
+    if value[-1].upper() in SIZES:
+        return int(value[:-1]) * SIZES[value[-1].upper()]
+    return int(value)
+
+
+def parse_latency(value):
+    name, _, ms = value.partition('=')
+    if name.lower() == 'default':
+        name = 'default'
+    elif name.upper() in COMMAND.__members__:
+        name = name.upper()
+    else:
+        raise argparse.ArgumentTypeError(f'unknown command: {name}')
+    try:
+        return name, float(ms)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected COMMAND=ms, not {value}')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def summarize(latencies):
+    return {
+        'runs': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run(args, env, cwd):
+    """Run a program to completion, returning (seconds, peak RSS in KiB, output)."""
+    with tempfile.TemporaryFile() as out:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + args, env=env, cwd=cwd, stdout=out, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        output = out.read().decode('utf8', 'replace')
+    if proc.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)} failed with {proc.returncode}:\n{output}')
+    return elapsed, usage.ru_maxrss, output
+
+
+def run_repeated(name, args, env, cwd, repeat):
+    latencies = []
+    rss = 0
+    for _ in range(repeat):
+        elapsed, peak, _ = run(args, env, cwd)
+        latencies.append(elapsed)
+        rss = max(rss, peak)
+    result = summarize(latencies)
+    result['peak_rss_kib'] = rss
+    print(f'{name:<32} p50 {result["p50_ms"]:>9.1f} ms  p99 {result["p99_ms"]:>9.1f} ms  rss {rss / 1024:>7.1f} MiB')
+    return result
+
+
+def bench_session_setup(url, repeat):
+    derived = []
+    cached = []
+    key_enc, key_mac = password_to_key(PASSWORD)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hsm = YubiHsm.connect(url)
+        hsm.create_session_derived(1, PASSWORD).close()
+        derived.append(time.perf_counter() - start)
+        hsm.close()
+
+        start = time.perf_counter()
+        hsm = YubiHsm.connect(url)
+        hsm.create_session(1, key_enc, key_mac).close()
+        cached.append(time.perf_counter() - start)
+        hsm.close()
+
+    results = {'derived': summarize(derived), 'cached_keys': summarize(cached)}
+    for name, result in results.items():
+        print(f'{"session setup (" + name + ")":<32} p50 {result["p50_ms"]:>9.1f} ms  p99 {result["p99_ms"]:>9.1f} ms')
+    return results
+
+
+def bench_signatures(url, count):
+    hsm = YubiHsm.connect(url)
+    session = hsm.create_session_derived(1, PASSWORD)
+    key = AsymmetricKey(session, KEY_ID)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        sign_digest(key, i.to_bytes(32, 'big'))
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    session.close()
+    hsm.close()
+
+    result = summarize(latencies)
+    result['signatures_per_second'] = round(count / elapsed, 2)
+    print(f'{"sign_ecdsa (one session)":<32} p50 {result["p50_ms"]:>9.1f} ms  p99 {result["p99_ms"]:>9.1f} ms  '
+          f'{result["signatures_per_second"]:.1f} sig/s')
+    return result
+
+
+def bench_algorithms(url, count):
+    """Signatures per second of every key algorithm, see hsm.py benchmark.
+
+    The latency model is per command, so the curves and key sizes only
+    differ by the software cost here. Run hsm.py benchmark on a device for
+    figures to choose an algorithm by.
+    """
+    hsm = YubiHsm.connect(url)
+    session = hsm.create_session_derived(1, PASSWORD)
+    results = {}
+    for name in KEY_SCHEMES:
+        result = results[name] = benchmark(session, SCHEMES[name], count)
+        print(f'{"sign (" + name + ")":<32} p50 {result["p50_ms"]:>9.1f} ms  p99 {result["p99_ms"]:>9.1f} ms  '
+              f'{result["signatures_per_second"]:.1f} sig/s')
+    session.close()
+    hsm.close()
+    return results
+
+
+def bench_connector(url, count):
+    """Time one command without a session over the connection choices."""
+    def new_connection():
+        hsm = YubiHsm.connect(url)
+        hsm.get_device_info()
+        hsm.close()
+
+    plain = YubiHsm.connect(url)
+    pooled = connect(url)
+    results = {}
+    for name, command in (('new_connection', new_connection),
+                          ('http_backend', plain.get_device_info),
+                          ('pooled', pooled.get_device_info)):
+        command()
+        latencies = []
+        for _ in range(count):
+            t = time.perf_counter()
+            command()
+            latencies.append(time.perf_counter() - t)
+        results[name] = summarize(latencies)
+        print(f'{"get_device_info (" + name + ")":<32} p50 {results[name]["p50_ms"]:>9.1f} ms  p99 {results[name]["p99_ms"]:>9.1f} ms')
+    plain.close()
+    pooled.close()
+    return results
+
+
+def compare(results, baseline):
+    print(f'\nComparison with {baseline}:')
+    with open(baseline, 'r') as fd:
+        old = json.load(fd)['results']
+
+    def walk(new, old, path):
+        for key, value in new.items():
+            if key not in old:
+                continue
+            if isinstance(value, dict):
+                walk(value, old[key], path + [key])
+            elif isinstance(value, (int, float)) and key != 'runs' and old[key]:
+                change = (value - old[key]) / old[key] * 100
+                print(f'  {"/".join(path + [key]):<56} {old[key]:>12} -> {value:<12} {change:+.1f}%')
+
+    walk(results, old, [])
+
+
+parser = argparse.ArgumentParser(
+                    prog='run_benchmarks',
+                    description='Benchmark the HSM tools against a latency modelled software HSM stand-in')
+
+parser.add_argument('-o', '--output', default='benchmark_results.json', help='File to write the results to. (Default: benchmark_results.json)')
+parser.add_argument('--compare', help='Earlier results file to compare against.')
+parser.add_argument('-l', '--latency', action='append', type=parse_latency, default=[], help='Simulated latency as COMMAND=ms, e.g. SIGN_ECDSA=80. Can be repeated.')
+parser.add_argument('-r', '--repeat', default=5, type=int, help='Number of runs of each program. (Default: 5)')
+parser.add_argument('--sizes', default='1K,1M,64M', help='File sizes for sign.py. (Default: 1K,1M,64M)')
+parser.add_argument('--batches', default='10,100,1000', help='Batch sizes for sign_batch.py. (Default: 10,100,1000)')
+parser.add_argument('--objects', default=20, type=int, help='Number of extra keys stored on the stand-in. (Default: 20)')
+
+args = parser.parse_args()
+
+latency_ms = dict(DEFAULT_LATENCY, **dict(args.latency))
+latency = {(k if k == 'default' else COMMAND[k]): v / 1000 for k, v in latency_ms.items()}
+
+server = ConnectorServer(SoftwareHsm(latency=latency), port=0)
+server.start()
+url = server.url
+
+# Populate the stand-in
+hsm = YubiHsm.connect(url)
+session = hsm.create_session_derived(1, PASSWORD)
+AsymmetricKey.generate(session, KEY_ID, 'Benchmark Key', 1, CAP.SIGN_ECDSA | CAP.EXPORTABLE_UNDER_WRAP, ALGORITHM.EC_P384)
+for i in range(args.objects):
+    AsymmetricKey.generate(session, 3000 + i, f'Filler {i}', 1, CAP.SIGN_ECDSA, ALGORITHM.EC_P256)
+session.close()
+hsm.close()
+
+results = {}
+work = tempfile.mkdtemp(prefix='hsm-bench-')
+try:
+    env = dict(os.environ, YUBIHSM_CONNECTOR=url, YUBIHSM_AUTHKEY_CACHE=os.path.join(work, 'authkeys.json'))
+
+    print(f'Software HSM at {url}, latency model (ms): {latency_ms}\n')
+
+    results['connector'] = bench_connector(url, args.repeat * 20)
+    results['session_setup'] = bench_session_setup(url, max(args.repeat, 3))
+    results['sign_ecdsa'] = bench_signatures(url, args.repeat * 20)
+    results['algorithms'] = bench_algorithms(url, args.repeat * 20)
+
+    results['sign'] = {}
+    for size in args.sizes.split(','):
+        filename = os.path.join(work, f'file_{size}')
+        with open(filename, 'wb') as fd:
+            remaining = parse_size(size)
+            while remaining:
+                chunk = os.urandom(min(remaining, 1024 * 1024))
+                fd.write(chunk)
+                remaining -= len(chunk)
+        results['sign'][size] = run_repeated(f'sign.py ({size})', [os.path.join(ROOT, 'sign.py'), str(KEY_ID), filename, PASSWORD], env, work, args.repeat)
+
+    results['sign_batch'] = {}
+    for batch in args.batches.split(','):
+        directory = os.path.join(work, f'batch_{batch}')
+        os.makedirs(directory)
+        for i in range(int(batch)):
+            with open(os.path.join(directory, f'{i}.bin'), 'wb') as fd:
+                fd.write(os.urandom(4096))
+        elapsed, rss, _ = run([os.path.join(ROOT, 'sign_batch.py'), str(KEY_ID), directory, PASSWORD], env, work)
+        results['sign_batch'][batch] = {'seconds': round(elapsed, 3), 'files_per_second': round(int(batch) / elapsed, 2), 'peak_rss_kib': rss}
+        print(f'{"sign_batch.py (" + batch + " files)":<32} {elapsed:>12.2f} s  {int(batch) / elapsed:>9.1f} files/s  rss {rss / 1024:>7.1f} MiB')
+
+    results['get_objects'] = run_repeated('utils/get_objects.py', [os.path.join(ROOT, 'utils', 'get_objects.py'), '-p', PASSWORD], env, work, args.repeat)
+    results['get_pub_keys'] = run_repeated('utils/get_pub_keys.py', [os.path.join(ROOT, 'utils', 'get_pub_keys.py'), '-p', PASSWORD], env, work, args.repeat)
+
+    # Export the key and import it back after deleting it
+    export_times = []
+    import_times = []
+    for _ in range(args.repeat):
+        elapsed, _, output = run([os.path.join(ROOT, 'utils', 'export_asymkey.py'), '-p', PASSWORD, str(KEY_ID)], env, work)
+        export_times.append(elapsed)
+        aes_key = re.search(r'Wrapping AES-256 Key: ([0-9a-f]+)', output).group(1)
+
+        hsm = YubiHsm.connect(url)
+        session = hsm.create_session_derived(1, PASSWORD)
+        session.get_object(KEY_ID, OBJECT.ASYMMETRIC_KEY).delete()
+        session.close()
+        hsm.close()
+
+        elapsed, _, _ = run([os.path.join(ROOT, 'utils', 'import_asymkey.py'), '-p', PASSWORD,
+                             os.path.join(work, f'wrapped_key_{KEY_ID}.bin'), aes_key], env, work)
+        import_times.append(elapsed)
+    results['export_import'] = {'export': summarize(export_times), 'import': summarize(import_times)}
+    for name in ('export', 'import'):
+        result = results['export_import'][name]
+        print(f'{"utils/" + name + "_asymkey.py":<32} p50 {result["p50_ms"]:>9.1f} ms  p99 {result["p99_ms"]:>9.1f} ms')
+finally:
+    server.shutdown()
+    # The test files and keys of the run are not kept
+    shutil.rmtree(work, ignore_errors=True)
+
+report = {
+    'meta': {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency_ms': latency_ms,
+        'repeat': args.repeat,
+    },
+    'results': results,
+}
+
+with open(args.output, 'w') as fd:
+    json.dump(report, fd, indent=2)
+print(f'\nResults written to {args.output}')
+
+if args.compare:
+    compare(results, args.compare)
+
+sys.exit(0)
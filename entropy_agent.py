@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+from yubihsm import exceptions
+
+from hsmtools import connection as hsm_connection
+from hsmtools import entropy
+from hsmtools.agent import request
+from hsmtools.connection import connect
+
+parser = argparse.ArgumentParser(
+                    prog='entropy_agent',
+                    description='Keep a pool of HSM random bytes and serve them over a Unix domain socket')
+
+parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('-s', '--socket', default='./entropy_agent.sock', help='Path of the Unix domain socket. (Default: ./entropy_agent.sock)')
+parser.add_argument('-c', '--capacity', default=entropy.DEFAULT_CAPACITY // 1024, type=int, help=f'Size of the pool in KiB. (Default: {entropy.DEFAULT_CAPACITY // 1024})')
+parser.add_argument('-l', '--low-water', default=entropy.DEFAULT_LOW_WATER // 1024, type=int, help=f'Refill the pool when it holds this many KiB or less. (Default: {entropy.DEFAULT_LOW_WATER // 1024})')
+parser.add_argument('-b', '--block-size', default=entropy.MAX_BLOCK, type=int, help=f'Bytes fetched from the HSM per command. (Default and maximum: {entropy.MAX_BLOCK})')
+parser.add_argument('--report', default=60, type=int, help='Seconds between pool reports, 0 to disable. (Default: 60)')
+parser.add_argument('--status', action='store_true', help='Print the status of a running agent and exit.')
+parser.add_argument('password', nargs='?', help='Authentication key password used to open the session')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+if args.status:
+    try:
+        print(json.dumps(request(args.socket, {'op': 'stats'}), indent=2))
+    except OSError as e:
+        print(f'ERROR: Failed to connect to the agent. [{e}]')
+        sys.exit(-2)
+    sys.exit(0)
+
+if args.password is None:
+    parser.error('the following arguments are required: password')
+
+source = entropy.HsmSource(connect, args.authkey, args.password)
+try:
+    pool = entropy.EntropyPool(source, args.capacity * 1024, args.low_water * 1024, args.block_size)
+except ValueError as e:
+    parser.error(str(e))
+
+try:
+    source.open()
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+
+pool.start()
+
+server = entropy.EntropyServer(args.socket, pool)
+stopped = threading.Event()
+
+
+def report():
+    while not stopped.wait(args.report):
+        print(json.dumps(pool.status()), flush=True)
+
+
+def shutdown(signum, frame):
+    # shutdown() blocks until serve_forever returns, so it must run on another thread.
+    threading.Thread(target=server.shutdown).start()
+
+
+signal.signal(signal.SIGTERM, shutdown)
+signal.signal(signal.SIGINT, shutdown)
+
+if args.report > 0:
+    threading.Thread(target=report, daemon=True).start()
+
+print(f'Entropy agent listening on {args.socket}', flush=True)
+server.serve_forever()
+
+# Clean up, the pool is wiped on close:
+stopped.set()
+server.server_close()
+pool.close()
+source.close()
+os.remove(args.socket)
+
+sys.exit(0)
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+import sys
+
+from hsmtools.cli import main
+
+sys.exit(main())
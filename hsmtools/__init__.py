@@ -0,0 +1 @@
+# Shared helpers used by the example programs in this project.
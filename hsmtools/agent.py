@@ -0,0 +1,274 @@
+"""Resident signing agent.
+
+The agent keeps an authenticated session with the HSM open and serves
+sign requests from local clients over a Unix domain socket. Requests are
+newline delimited JSON:
+
+    {"op": "sign", "key_id": 2000, "digest": "<hex SHA-256 digest>"}
+    {"op": "stats"}
+
+Replies are JSON as well and always carry a "status" of "ok" or "error".
+"""
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import COMMAND, ERROR
+from yubihsm.objects import AsymmetricKey
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+
+from hsmtools.authcache import create_session
+
+DIGEST_HASHES = {32: hashes.SHA256, 48: hashes.SHA384, 64: hashes.SHA512}
+# Longest request line, a sign request is well below this
+MAX_REQUEST = 4096
+
+
+class Request(object):
+    def __init__(self, client, key_id, digest):
+        self.client = client
+        self.key_id = key_id
+        self.digest = digest
+        self.queued = time.perf_counter()
+        self.signature = None
+        self.error = None
+        self.latency = None
+        self.done = threading.Event()
+
+
+class FairQueue(object):
+    """Queue which serves clients round robin so one busy client can not starve the others."""
+
+    def __init__(self):
+        self._queues = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._size = 0
+
+    def put(self, request):
+        with self._cond:
+            self._queues.setdefault(request.client, collections.deque()).append(request)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._size and not self._cond.wait_for(lambda: self._size, timeout):
+                return None
+            # Take the head of the first client's queue and move that client to the back.
+            client, queue = next(iter(self._queues.items()))
+            request = queue.popleft()
+            del self._queues[client]
+            if queue:
+                self._queues[client] = queue
+            self._size -= 1
+            return request
+
+    def __len__(self):
+        return self._size
+
+
+class Stats(object):
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._completed = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    def record(self, request):
+        with self._lock:
+            self.requests += 1
+            if request.error:
+                self.errors += 1
+            self._latencies.append(request.latency)
+            self._completed.append(time.monotonic())
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            completed = list(self._completed)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        # Requests completed over the last 10 seconds, or over the window if
+        # it holds less than 10 seconds worth of requests.
+        now = time.monotonic()
+        recent = [t for t in completed if t >= now - 10]
+        span = 10
+        if len(completed) == self._completed.maxlen and completed[0] >= now - 10:
+            span = max(now - completed[0], 0.001)
+        throughput = len(recent) / span
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'reconnects': self.reconnects,
+            'latency_p50_ms': round(percentile(0.50), 3),
+            'latency_p99_ms': round(percentile(0.99), 3),
+            'throughput_per_s': round(throughput, 2),
+        }
+
+
+class SigningAgent(object):
+    """Owns the HSM session and serializes all sign requests onto it."""
+
+    def __init__(self, connect, authkey_id, password, keepalive=15):
+        self._connect = connect
+        self._authkey_id = authkey_id
+        self._password = password
+        self.keepalive = keepalive
+        self.queue = FairQueue()
+        self.stats = Stats()
+        self._hsm = None
+        self._session = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='hsm-worker', daemon=True)
+
+    def start(self):
+        self._open()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._close()
+
+    def submit(self, client, key_id, digest):
+        request = Request(client, key_id, digest)
+        self.queue.put(request)
+        return request
+
+    def sign(self, client, key_id, digest):
+        request = self.submit(client, key_id, digest)
+        request.done.wait()
+        return request
+
+    def status(self):
+        status = self.stats.snapshot()
+        status['queue_depth'] = len(self.queue)
+        return status
+
+    def _open(self):
+        self._hsm = self._connect()
+        self._session = create_session(self._hsm, self._authkey_id, self._password)
+
+    def _close(self):
+        try:
+            if self._session:
+                self._session.close()
+        except exceptions.YubiHsmError:
+            pass
+        if self._hsm:
+            self._hsm.close()
+        self._session = self._hsm = None
+
+    def _reconnect(self):
+        self._close()
+        self._open()
+        self.stats.reconnects += 1
+
+    def _call(self, func):
+        # A dropped connection or expired session is re-established once before giving up.
+        try:
+            if self._session is None:
+                self._reconnect()
+            return func()
+        except (exceptions.YubiHsmConnectionError, exceptions.YubiHsmInvalidResponseError):
+            self._reconnect()
+        except exceptions.YubiHsmDeviceError as e:
+            if e.code not in (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED):
+                raise
+            self._reconnect()
+        return func()
+
+    def _sign(self, request):
+        algorithm = DIGEST_HASHES.get(len(request.digest))
+        if algorithm is None:
+            raise ValueError('Unsupported digest length.')
+        key = AsymmetricKey(self._session, request.key_id)
+        return key.sign_ecdsa(request.digest, hash=Prehashed(algorithm()))
+
+    def _run(self):
+        while not self._stop.is_set():
+            request = self.queue.get(timeout=self.keepalive)
+            if request is None:
+                # Idle, keep the session from timing out on the device.
+                try:
+                    self._call(lambda: self._session.send_secure_cmd(COMMAND.ECHO, b'\0'))
+                except Exception:
+                    self._close()
+                continue
+
+            try:
+                request.signature = self._call(lambda: self._sign(request))
+            except Exception as e:
+                request.error = str(e) or e.__class__.__name__
+            request.latency = time.perf_counter() - request.queued
+            self.stats.record(request)
+            request.done.set()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        agent = self.server.agent
+        client = id(self)
+        while True:
+            line = self.rfile.readline(MAX_REQUEST + 1)
+            if not line:
+                break
+            if len(line) > MAX_REQUEST:
+                # The rest of the line is never read, so drop the connection
+                reply = {'status': 'error', 'error': f'Request longer than {MAX_REQUEST} bytes.'}
+                self.wfile.write(json.dumps(reply).encode('utf8') + b'\n')
+                break
+            try:
+                msg = json.loads(line)
+                if msg.get('op') == 'stats':
+                    reply = dict(agent.status(), status='ok')
+                elif msg.get('op') == 'sign':
+                    request = agent.sign(client, int(msg['key_id']), bytes.fromhex(msg['digest']))
+                    if request.error:
+                        reply = {'status': 'error', 'error': request.error}
+                    else:
+                        reply = {'status': 'ok', 'signature': request.signature.hex(),
+                                 'latency_ms': round(request.latency * 1000, 3)}
+                else:
+                    reply = {'status': 'error', 'error': 'Unknown op.'}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'status': 'error', 'error': f'Bad request. [{e}]'}
+            self.wfile.write(json.dumps(reply).encode('utf8') + b'\n')
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, agent):
+        if os.path.exists(path):
+            os.remove(path)
+        # Only the owner of the agent may connect to it.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+        self.agent = agent
+
+
+def request(path, msg):
+    """Send a single request to the agent listening on path and return the reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(msg).encode('utf8') + b'\n')
+        with sock.makefile('rb') as fd:
+            return json.loads(fd.readline())
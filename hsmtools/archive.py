@@ -0,0 +1,124 @@
+"""Archive of wrapped keys, written and read as a stream.
+
+The archive is a JSON lines file. The first line is a header, followed by
+one line per key holding the key's metadata and the wrapped key, and a
+trailer with the number of keys, an index of their IDs and labels and the
+SHA-256 digest of everything before it. Every key line also carries the
+digest of its wrapped key, so damage can be pinpointed.
+
+The trailer also holds an HMAC of the digest keyed with the wrapping key.
+The integrity of an archive can be checked without an HSM; with the
+wrapping key it can also be checked that the archive was not replaced.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+FORMAT = 'yubihsm-wrapped-keys'
+VERSION = 1
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveWriter(object):
+    """Write keys to an archive one at a time, so memory use does not
+    grow with the number of keys."""
+
+    def __init__(self, path, **header):
+        self.path = path
+        self._fd = open(path, 'wb')
+        self._digest = hashlib.sha256()
+        self._index = []
+        self._write(dict(header, format=FORMAT, version=VERSION, created=int(time.time())))
+
+    def _write(self, record):
+        line = json.dumps(record, sort_keys=True).encode('utf8') + b'\n'
+        self._digest.update(line)
+        self._fd.write(line)
+
+    def add(self, wrapped, **metadata):
+        self._write(dict(metadata, wrapped=base64.b64encode(wrapped).decode('ascii'),
+                         sha256=hashlib.sha256(wrapped).hexdigest()))
+        self._index.append([metadata.get('id'), metadata.get('label')])
+
+    def close(self, wrap_key):
+        digest = self._digest.hexdigest()
+        self._write({'count': len(self._index), 'index': self._index, 'digest': digest,
+                     'hmac': hmac.new(wrap_key, digest.encode('ascii'), hashlib.sha256).hexdigest()})
+        self._fd.close()
+        return len(self._index)
+
+    def abort(self):
+        self._fd.close()
+
+
+def read(path):
+    """Yield the header, then (metadata, wrapped) for every key.
+
+    Raises ArchiveError as soon as damage is found. The final check of the
+    digest and count happens after the last key, so a caller that stops
+    early has not verified the whole archive.
+    """
+    digest = hashlib.sha256()
+    count = 0
+    header = None
+    with open(path, 'rb') as fd:
+        for number, line in enumerate(fd, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ArchiveError(f'Line {number} is not valid JSON.')
+
+            if header is None:
+                if record.get('format') != FORMAT or record.get('version') != VERSION:
+                    raise ArchiveError('Not a wrapped key archive, or an unsupported version.')
+                header = record
+                digest.update(line)
+                yield header
+                continue
+
+            if 'digest' in record:
+                if record['digest'] != digest.hexdigest():
+                    raise ArchiveError('The archive digest does not match, the archive was modified.')
+                if record['count'] != count:
+                    raise ArchiveError(f'The archive holds {count} keys but the trailer lists {record["count"]}.')
+                if fd.read(1):
+                    raise ArchiveError('Unexpected data after the trailer.')
+                header['trailer'] = record
+                return
+
+            digest.update(line)
+            try:
+                wrapped = base64.b64decode(record.pop('wrapped'), validate=True)
+            except (KeyError, ValueError):
+                raise ArchiveError(f'Line {number} has no valid wrapped key.')
+            if hashlib.sha256(wrapped).hexdigest() != record.pop('sha256', None):
+                raise ArchiveError(f'Key {record.get("id")} on line {number} is damaged.')
+            count += 1
+            yield record, wrapped
+
+    raise ArchiveError('The archive is truncated, the trailer is missing.')
+
+
+def verify(path, wrap_key=None):
+    """Check an archive without an HSM and return its header.
+
+    With the wrapping key the HMAC in the trailer is checked as well.
+    """
+    records = read(path)
+    header = next(records, None)
+    if header is None:
+        raise ArchiveError('The archive is empty.')
+    for _ in records:
+        pass
+
+    trailer = header['trailer']
+    if wrap_key is not None:
+        expected = hmac.new(wrap_key, trailer['digest'].encode('ascii'), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, trailer['hmac']):
+            raise ArchiveError('The archive was not written with this wrapping key.')
+    return header
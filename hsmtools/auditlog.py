@@ -0,0 +1,146 @@
+"""Local store for the audit log of the HSM.
+
+The HSM keeps a small ring of log entries (62 on a YubiHSM 2). With forced
+auditing enabled it refuses every command once the ring is full, so the
+entries must be drained: read, checked and stored here, and then released
+on the HSM with set_log_index.
+
+Each entry carries a truncated SHA-256 over its data and the digest of the
+entry before it. The store is one file per HSM holding the raw 32 byte
+entries back to back, so the last entry, which the next drain is chained
+to, is read with a single seek. An entry is only released on the HSM after
+it was written and synced to the store; if the drainer stops in between
+the entries are read again and the ones already stored are skipped.
+"""
+import os
+import time
+
+from yubihsm.core import LogEntry
+from yubihsm.defs import COMMAND
+
+# Fill level of the HSM log at which a drain is reported as lagging
+LAG_WARNING = 0.75
+
+
+class ChainError(Exception):
+    pass
+
+
+def _after(number, previous):
+    """True if log entry number comes after previous. The numbers wrap at 2^16."""
+    return 0 < (number - previous) & 0xffff < 0x8000
+
+
+def command_name(entry):
+    try:
+        return COMMAND(entry.command).name
+    except ValueError:
+        return f'0x{entry.command:02x}'
+
+
+class LogStore(object):
+
+    def __init__(self, directory, serial):
+        self.path = os.path.join(directory, f'{serial}.log')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def last(self):
+        """Return the last stored entry, or None for an empty store."""
+        try:
+            with open(self.path, 'rb') as fd:
+                size = fd.seek(0, os.SEEK_END)
+                if size % LogEntry.LENGTH:
+                    raise ChainError(f'{self.path} ends with a partial entry.')
+                if not size:
+                    return None
+                fd.seek(size - LogEntry.LENGTH)
+                return LogEntry.parse(fd.read(LogEntry.LENGTH))
+        except FileNotFoundError:
+            return None
+
+    def append(self, entries):
+        with open(self.path, 'ab') as fd:
+            fd.write(b''.join(e.data + e.digest for e in entries))
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    def entries(self):
+        with open(self.path, 'rb') as fd:
+            while True:
+                data = fd.read(LogEntry.LENGTH)
+                if len(data) < LogEntry.LENGTH:
+                    return
+                yield LogEntry.parse(data)
+
+    def verify(self):
+        """Check the hash chain of the store and return (entries, breaks).
+
+        breaks lists the (previous, next) entry numbers where the chain was
+        restarted with resync.
+        """
+        count = 0
+        breaks = []
+        previous = None
+        for entry in self.entries():
+            if previous is not None and not (entry.number == (previous.number + 1) & 0xffff
+                                             and entry.validate(previous)):
+                breaks.append((previous.number, entry.number))
+            previous = entry
+            count += 1
+        return count, breaks
+
+
+class Drainer(object):
+    """Move new log entries from the HSM into a LogStore."""
+
+    def __init__(self, session, store, log_size, resync=False):
+        self.session = session
+        self.store = store
+        self.log_size = log_size
+        self.resync = resync
+        self.drained = 0
+        self.last_drain = None
+
+    def drain(self):
+        """Drain the log once and return a report of what was found."""
+        start = time.perf_counter()
+        info = self.session.get_log_entries()
+        last = self.store.last()
+
+        entries = info.entries
+        if last is not None:
+            # Entries that were stored but not released yet come first
+            old = [e for e in entries if not _after(e.number, last.number)]
+            new = entries[len(old):]
+            if old:
+                chained = old[-1].number == last.number and old[-1].digest == last.digest
+            else:
+                chained = not new or (new[0].number == (last.number + 1) & 0xffff and new[0].validate(last))
+            if chained:
+                entries = new
+            elif self.resync:
+                # Start a new chain, the break stays visible in the store
+                self.resync = False
+            else:
+                raise ChainError(f'The HSM log does not continue the stored log after entry {last.number}. '
+                                 'Entries were lost or the HSM was reset.')
+
+        if entries:
+            self.store.append(entries)
+        if info.entries:
+            self.session.set_log_index(info.entries[-1].number)
+
+        now = time.time()
+        since = round(now - self.last_drain, 3) if self.last_drain else None
+        self.drained += len(entries)
+        self.last_drain = now
+        return {
+            'pending': len(info.entries),
+            'fill': round(len(info.entries) / self.log_size, 3),
+            'seconds_since_last_drain': since,
+            'drained': len(entries),
+            'unlogged_boot': info.n_boot,
+            'unlogged_auth': info.n_auth,
+            'last_number': entries[-1].number if entries else (last.number if last else None),
+            'drain_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
@@ -0,0 +1,178 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+from yubihsm.utils import password_to_key
+from yubihsm.exceptions import YubiHsmAuthenticationError, YubiHsmDeviceError, YubiHsmError
+
+# Session keys derived from a password with PBKDF2 are cached in a file that
+# only the current user can read. Set YUBIHSM_AUTHKEY_CACHE_TTL=0 to disable.
+CACHE_FILE = os.environ.get('YUBIHSM_AUTHKEY_CACHE',
+                            os.path.join(os.path.expanduser('~'), '.cache', 'yubihsm-examples', 'authkeys.json'))
+DEFAULT_TTL = 3600
+# Same cost as the PBKDF2 behind the session keys, so the check is no
+# quicker way to guess the password than the cached keys themselves.
+CHECK_ITERATIONS = 10000
+
+# Sessions are opened from several threads at once, e.g. by the workers of
+# bulk_create_signing_keys.py, so every load, change and save of the cache
+# holds this lock.
+_LOCK = threading.Lock()
+
+
+def _ttl():
+    try:
+        return int(os.environ.get('YUBIHSM_AUTHKEY_CACHE_TTL', DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def _load():
+    try:
+        with open(CACHE_FILE, 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {'entries': {}}
+
+
+def _save(cache):
+    directory = os.path.dirname(CACHE_FILE)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # Write to a private temporary file of its own and rename it over the
+    # cache so readers never see a partial file.
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _check(password, salt):
+    # The password itself is never stored, only a salted PBKDF2 hash used to match it.
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf8'), salt, CHECK_ITERATIONS).hex()
+
+
+class _Check(threading.Thread):
+    """Computes the password check in the background.
+
+    hashlib releases the GIL, so the check runs while the session is
+    opened and costs no time of its own.
+    """
+
+    def __init__(self, password, salt):
+        threading.Thread.__init__(self, daemon=True)
+        self.password = password
+        self.salt = salt
+        self.result = None
+
+    def run(self):
+        self.result = _check(self.password, self.salt)
+
+    def value(self):
+        self.join()
+        return self.result
+
+
+def get_entry(authkey_id):
+    """Return the unexpired cache entry of the authentication key, or None."""
+    if _ttl() <= 0:
+        return None
+
+    entry = _load()['entries'].get(str(authkey_id))
+    if not entry or entry['expires'] < time.time() or 'salt' not in entry:
+        return None
+    return entry
+
+
+def put_keys(authkey_id, salt, check, key_enc, key_mac):
+    ttl = _ttl()
+    if ttl <= 0:
+        return
+
+    with _LOCK:
+        cache = _load()
+        now = time.time()
+        entries = {k: v for k, v in cache.get('entries', {}).items() if v['expires'] >= now and 'salt' in v}
+        entries[str(authkey_id)] = {
+            'salt': salt.hex(),
+            'check': check,
+            'key_enc': key_enc.hex(),
+            'key_mac': key_mac.hex(),
+            'expires': now + ttl,
+        }
+        _save({'entries': entries})
+
+
+def invalidate(authkey_id=None):
+    """Remove the cached keys for an authentication key, or all keys if no ID is given."""
+    if not os.path.exists(CACHE_FILE):
+        return
+
+    with _LOCK:
+        if authkey_id is None:
+            try:
+                os.remove(CACHE_FILE)
+            except FileNotFoundError:
+                pass
+            return
+
+        cache = _load()
+        if cache['entries'].pop(str(authkey_id), None) is not None:
+            _save(cache)
+
+
+def create_session(hsm, authkey_id, password):
+    """Create an authenticated session, reusing cached session keys when possible.
+
+    Works like YubiHsm.create_session_derived but only runs PBKDF2 when the
+    keys for this authentication key are not cached. The password is
+    checked against the cache while the session is opened with the cached
+    keys; a session opened with keys of another password is closed again.
+    """
+    entry = get_entry(authkey_id)
+    if entry:
+        check = _Check(password, bytes.fromhex(entry['salt']))
+        check.start()
+        try:
+            session = hsm.create_session(authkey_id, bytes.fromhex(entry['key_enc']), bytes.fromhex(entry['key_mac']))
+        except (YubiHsmAuthenticationError, YubiHsmDeviceError):
+            if hmac.compare_digest(entry['check'], check.value()):
+                try:
+                    invalidate(authkey_id)
+                except OSError:
+                    pass
+                raise
+            session = None
+        if session is not None:
+            if hmac.compare_digest(entry['check'], check.value()):
+                return session
+            try:
+                session.close()
+            except YubiHsmError:
+                pass
+
+    key_enc, key_mac = password_to_key(password)
+    salt = os.urandom(16)
+    check = _Check(password, salt)
+    check.start()
+    session = hsm.create_session(authkey_id, key_enc, key_mac)
+
+    # Only keys that successfully opened a session are cached. The cache is
+    # only a speed-up, a read-only or full home directory must not fail
+    # the session.
+    try:
+        put_keys(authkey_id, salt, check.value(), key_enc, key_mac)
+    except OSError:
+        pass
+    return session
@@ -0,0 +1,208 @@
+"""Single entry point for the HSM tools, see hsm.py.
+
+Only the standard library is imported here. The yubihsm and cryptography
+packages, which take most of the start up time, are imported with
+hsmtools.commands when a command actually runs, so --help and argument
+errors return right away.
+
+The shell command reads further commands from the terminal and runs them
+all over one authenticated session.
+"""
+import argparse
+import getpass
+import importlib
+import shlex
+
+
+class Context(object):
+    """HSM connection and session shared by the commands of a run or shell.
+
+    The session is only opened when a command first needs it.
+    """
+
+    def __init__(self, authkey, password):
+        self.authkey = authkey
+        self.password = password
+        self.hsm = None
+        self._session = None
+        self._prompted = False
+
+    @property
+    def session(self):
+        if self._session is None:
+            from yubihsm import exceptions
+            from hsmtools.authcache import create_session
+            from hsmtools.connection import connect
+
+            if self.password is None:
+                self.password = getpass.getpass(f'Password for authentication key {self.authkey}: ')
+                self._prompted = True
+            self.hsm = connect()
+            try:
+                self._session = create_session(self.hsm, self.authkey, self.password)
+            except exceptions.YubiHsmError:
+                if self._prompted:
+                    # Ask again next time
+                    self.password = None
+                self.close()
+                raise
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            from yubihsm import exceptions
+            try:
+                self._session.close()
+            except exceptions.YubiHsmError:
+                pass
+            self._session = None
+        if self.hsm is not None:
+            self.hsm.close()
+            self.hsm = None
+
+
+def _command(subparsers, name, func, failure, help):
+    parser = subparsers.add_parser(name, help=help, description=help)
+    parser.set_defaults(func=func, failure=failure)
+    return parser
+
+
+def _filter_arguments(parser, types=True):
+    # Same options as objindex.add_filter_arguments, checked when the command runs
+    if types:
+        parser.add_argument('-t', '--type', metavar='TYPE', help='Only objects of this type, e.g. asymmetric_key.')
+    parser.add_argument('-d', '--domains', type=int, help='Only objects in one or more of these domains (bitmask).')
+    parser.add_argument('-l', '--label', help='Only objects with exactly this label.')
+    parser.add_argument('--algorithm', metavar='NAME', help='Only objects using this algorithm, e.g. ec_p384.')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+                        prog='hsm',
+                        description='Manage keys on the YubiHSM and create signatures.')
+
+    parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+    parser.add_argument('-p', '--password', help='Password of the authentication key. Asked for when needed if not given.')
+    parser.add_argument('--connector', action='append', metavar='URL', help='Connector URL of the HSM, e.g. http://hsm1:12345. Repeat to fail over between connectors. (Default: YUBIHSM_CONNECTOR, the config file or yhusb://)')
+    parser.add_argument('--trace', metavar='FILE', help='Append the command, sizes and round trip of every HSM message to FILE. (Default: YUBIHSM_TRACE)')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    cmd = _command(subparsers, 'sign', 'sign', 'Signing failed.', 'Create a signature of a file.')
+    cmd.add_argument('-c', '--chunk-size', default=4, type=int, help='Size in MiB of the chunks used to hash the file. (Default: 4)')
+    cmd.add_argument('-A', '--algorithm', default='ecdsa-sha256', metavar='NAME', help='Signature algorithm matching the key: ecdsa-sha256, ecp256, ecp384, ecp521, ed25519 or rsa2048/3072/4096-pss. (Default: ecdsa-sha256)')
+    cmd.add_argument('id', type=int, help='ID of signing key to use.')
+    cmd.add_argument('filename', help='File to sign.')
+
+    cmd = _command(subparsers, 'get-objects', 'get_objects', 'Failed to list objects.', 'Print the objects stored in the HSM.')
+    cmd.add_argument('--offline', action='store_true', help='Answer from the local object index without connecting to the HSM.')
+    cmd.add_argument('--serial', type=int, help='Serial number of the HSM to show with --offline. Needed when several HSMs are indexed.')
+    _filter_arguments(cmd)
+
+    cmd = _command(subparsers, 'get-pub-keys', 'get_pub_keys', 'Failed to read public keys.', 'Print the public asymmetric keys stored in the HSM.')
+    cmd.add_argument('-b', '--bundle', help='Also write all keys to this single keyring file.')
+    cmd.add_argument('-f', '--format', default='pem', choices=('pem', 'jwks'), help='Format of the keyring: concatenated PEM or JWKS style JSON. (Default: pem)')
+    cmd.add_argument('--no-files', action='store_true', help='Do not write a public_key_<id>.pem file per key.')
+    _filter_arguments(cmd, types=False)
+
+    cmd = _command(subparsers, 'create-authkey', 'create_authkey', 'Failed to create authentication key.', 'Create a new authentication key.')
+    cmd.add_argument('-a', '--admin', action='store_true', help='Add administrative capabilities.')
+    cmd.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the new authentication key. (Default: 1)')
+    cmd.add_argument('id', type=int, help='ID for the new authentication key.')
+    cmd.add_argument('label', help='Label for the key.')
+    cmd.add_argument('new_password', metavar='password', help='Password to use to unlock the new authentication key.')
+
+    cmd = _command(subparsers, 'create-signing-key', 'create_signing_key', 'Failed to create signing key.', 'Create a new signing key.')
+    cmd.add_argument('-a', '--algorithm', default='ecp384', metavar='NAME', help='Algorithm of the key: ecp256, ecp384, ecp521, ed25519 or rsa2048/3072/4096-pss. (Default: ecp384)')
+    cmd.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the new key. (Default: 1)')
+    cmd.add_argument('--id', type=int, default=0, help='ID for the new asymmetric key. If not specified, an ID will be generated.')
+    cmd.add_argument('label', help='Label for the key.')
+
+    cmd = _command(subparsers, 'export', 'export_asymkey', 'Failed to export asymmetric key.', 'Export an asymmetric key wrapped with AES-256.')
+    cmd.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the wrapping key. (Default: 1)')
+    cmd.add_argument('id', type=int, help='ID of key to export.')
+
+    cmd = _command(subparsers, 'import', 'import_asymkey', 'Failed to import asymmetric key.', 'Import an asymmetric key wrapped with AES-256.')
+    cmd.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the wrapping key. (Default: 1)')
+    cmd.add_argument('filename', help='Filename of the wrapped key to import.')
+    cmd.add_argument('aes_key', help='AES-256 wrapping key as a hex string.')
+
+    for kind, noun in (('asymkey', 'asymmetric key'), ('authkey', 'authentication key'), ('wrapkey', 'wrapping key')):
+        cmd = _command(subparsers, f'delete-{kind}', 'delete', f'Failed to delete {noun}.', f'Delete the {noun} with the given ID.')
+        cmd.set_defaults(kind=kind)
+        cmd.add_argument('id', type=int, help='ID of key to delete.')
+
+    cmd = _command(subparsers, 'change-password', 'change_password', 'Failed to change authentication key password.', 'Change the password of an authentication key.')
+    cmd.add_argument('id', type=int, help='ID of the authentication key.')
+    cmd.add_argument('new_password', metavar='password', help='New password of the authentication key.')
+
+    cmd = _command(subparsers, 'benchmark', 'benchmark', 'Benchmark failed.', 'Measure signatures per second of each algorithm with temporary keys.')
+    cmd.add_argument('-a', '--algorithm', action='append', metavar='NAME', help='Algorithm to measure, as for create-signing-key. Can be repeated. (Default: all; RSA key generation takes minutes on the device)')
+    cmd.add_argument('-n', '--count', default=50, type=int, help='Signatures per algorithm. (Default: 50)')
+    cmd.add_argument('-d', '--domain', default=1, type=int, help='Domain of the temporary keys. (Default: 1)')
+    cmd.add_argument('--size', default=32, type=int, help='Size in bytes of the messages signed with ed25519. (Default: 32)')
+    cmd.add_argument('-o', '--output', help='Also write the results as JSON to this file.')
+
+    _command(subparsers, 'shell', None, None, 'Read commands from the terminal and run them over one session.')
+    return parser
+
+
+def run(ctx, args):
+    # The heavy imports happen here, on the first command that runs
+    commands = importlib.import_module('hsmtools.commands')
+    return commands.run(ctx, args)
+
+
+def shell(ctx, parser):
+    print('Commands run over one HSM session. Type help for the list of commands, exit to leave.')
+    while True:
+        try:
+            line = input('hsm> ')
+        except EOFError:
+            print()
+            return 0
+        except KeyboardInterrupt:
+            print()
+            continue
+
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print(f'ERROR: [{e}]')
+            continue
+        if not words:
+            continue
+        if words[0] in ('exit', 'quit'):
+            return 0
+        if words[0] == 'help':
+            words = ['--help']
+
+        try:
+            args = parser.parse_args(words)
+        except SystemExit:
+            # argparse has printed the usage or the error
+            continue
+        if args.command == 'shell':
+            continue
+
+        try:
+            run(ctx, args)
+        except KeyboardInterrupt:
+            print()
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.connector or args.trace:
+        from hsmtools import connection
+        connection.configure(args)
+
+    ctx = Context(args.authkey, args.password)
+    try:
+        if args.command == 'shell':
+            # Global options are fixed for the whole shell
+            return shell(ctx, parser)
+        return run(ctx, args)
+    finally:
+        ctx.close()
@@ -0,0 +1,205 @@
+"""Commands of hsm.py.
+
+Each command takes the Context of hsmtools.cli, whose session is opened on
+first use and shared by all commands of a shell, and the parsed arguments.
+It returns the exit code. The commands do the same as the programs in
+utils/ and sign.py, through the same functions of hsmtools.keys and
+hsmtools.signing.
+"""
+import binascii as bs
+import json
+
+from yubihsm import exceptions
+from yubihsm.defs import ERROR, OBJECT
+from yubihsm.objects import AsymmetricKey
+
+from hsmtools import keys
+from hsmtools.objindex import ObjectIndex, filters_from_args
+from hsmtools.pubkeys import to_pem, write_bundle
+from hsmtools.signing import EDDSA_MAX_DATA, KEY_SCHEMES, SCHEMES, benchmark as benchmark_scheme, read_message, sign_digest, write_signature
+
+DELETE_TYPES = {
+    'asymkey': (OBJECT.ASYMMETRIC_KEY, 'asymmetric key'),
+    'authkey': (OBJECT.AUTHENTICATION_KEY, 'authentication key'),
+    'wrapkey': (OBJECT.WRAP_KEY, 'wrapping key'),
+}
+
+
+def _filters(args):
+    try:
+        return filters_from_args(args)
+    except KeyError as e:
+        raise ValueError(f'Unknown object type or algorithm {e}.')
+
+
+def _scheme(name, names=SCHEMES):
+    if name not in names:
+        raise ValueError(f'Unknown algorithm {name}, use one of: {", ".join(names)}.')
+    return SCHEMES[name]
+
+
+def _confirm():
+    return input('Warning! Are you sure you wish to delete the key? (y/N)') == 'y'
+
+
+def sign(ctx, args):
+    scheme = _scheme(args.algorithm)
+    file_hash, _ = read_message(args.filename, scheme, args.chunk_size * 1024 * 1024)
+    signature = sign_digest(AsymmetricKey(ctx.session, args.id), file_hash, scheme=scheme)
+    write_signature(args.filename, signature)
+    print(f'Signature written to {args.filename}.sig')
+    return 0
+
+
+def get_objects(ctx, args):
+    filters = _filters(args)
+    index = ObjectIndex()
+
+    if args.offline:
+        serials = [args.serial] if args.serial is not None else index.serials
+        if len(serials) != 1:
+            print('ERROR: Use --serial to choose one of the indexed HSMs: ' + ', '.join(str(s) for s in serials))
+            return -4
+        keys.print_objects(index.query(serials[0], **filters))
+        return 0
+
+    session = ctx.session
+    infos, fetched = index.refresh(session, ctx.hsm.get_device_info().serial, **filters)
+    keys.print_objects(infos)
+    print(f'{len(infos)} objects, {fetched} read from the HSM.')
+    return 0
+
+
+def get_pub_keys(ctx, args):
+    keyring, fetched = keys.public_keys(ctx.session, ctx.hsm.get_device_info().serial, **_filters(args))
+    for info, pub_key in keyring:
+        print('Found asymetric key')
+        print(info)
+        if args.no_files:
+            print(to_pem(pub_key))
+        else:
+            print(keys.write_public_key(info.id, pub_key))
+
+    if args.bundle:
+        skipped = write_bundle(args.bundle, [(info.id, info.label, pub_key) for info, pub_key in keyring], args.format)
+        for key_id, reason in skipped:
+            print(f'WARNING: Key {key_id} left out of the keyring. [{reason}]')
+        print(f'Keyring with {len(keyring) - len(skipped)} keys written to {args.bundle}')
+    print(f'{len(keyring)} public keys, {fetched} read from the HSM.')
+    return 0
+
+
+def create_authkey(ctx, args):
+    if args.admin:
+        print('Setting admin capabilities.')
+    print(f'Creating a new authentication key. [ID: {args.id}, Domain: {args.domain}. Label: {args.label}]')
+    keys.create_authkey(ctx.session, args.id, args.label, args.domain, args.new_password, args.admin)
+    return 0
+
+
+def create_signing_key(ctx, args):
+    scheme = _scheme(args.algorithm, KEY_SCHEMES)
+    print('Key generation can take several minutes to complete. Please be patient.')
+    key = keys.create_signing_key(ctx.session, args.id, args.label, args.domain, scheme)
+    print('Key generation complete.')
+    print(keys.write_public_key(key.id, key.get_public_key()))
+    return 0
+
+
+def export_asymkey(ctx, args):
+    session = ctx.session
+    aes_key = session.get_pseudo_random(32)
+    print(f'Wrapping AES-256 Key: {bs.hexlify(aes_key).decode("ascii")}')
+
+    print(f'Exporting asymmetric key. [ID: {args.id}]')
+    exported_key = keys.export_wrapped(session, args.id, args.domain, aes_key)
+    filename = keys.write_wrapped_key(args.id, exported_key)
+    print(f'Key exported to {filename}.')
+    return 0
+
+
+def import_asymkey(ctx, args):
+    with open(args.filename, 'br') as fd:
+        wrapped_key = fd.read()
+
+    print('Importing asymmetric key.')
+    key = keys.import_wrapped(ctx.session, ctx.authkey, wrapped_key, args.domain, bs.unhexlify(args.aes_key))
+    print(f'Import successful. [ID: {key.id}]')
+    return 0
+
+
+def delete(ctx, args):
+    # Do NOT delete master authentication key
+    if args.kind == 'authkey' and args.id == keys.MASTER_AUTHKEY_ID:
+        print('Cannot delete master authentication key.')
+        return -1
+
+    object_type, noun = DELETE_TYPES[args.kind]
+    print(f'Deleting {noun}. [ID: {args.id}]')
+    key = ctx.session.get_object(args.id, object_type)
+    if not _confirm():
+        return 0
+    key.delete()
+    print('Key deleted.')
+    return 0
+
+
+def change_password(ctx, args):
+    print(f'Changing authentication key password. [ID: {args.id}]')
+    keys.change_password(ctx.session, args.id, args.new_password)
+    if args.id == ctx.authkey:
+        ctx.password = args.new_password
+    return 0
+
+
+def benchmark(ctx, args):
+    schemes = [_scheme(name, KEY_SCHEMES) for name in args.algorithm or KEY_SCHEMES]
+    if args.count < 1 or not 0 < args.size <= EDDSA_MAX_DATA:
+        raise ValueError(f'The count must be positive and the size between 1 and {EDDSA_MAX_DATA}.')
+
+    session = ctx.session
+    results = {}
+    print(f'{"algorithm":<14} {"keygen":>10} {"sig/s":>9} {"p50":>10} {"p99":>10}')
+    for scheme in schemes:
+        result = results[scheme.name] = benchmark_scheme(session, scheme, args.count, args.domain, args.size)
+        print(f'{scheme.name:<14} {result["keygen_ms"]:>7.0f} ms {result["signatures_per_second"]:>9.1f} '
+              f'{result["p50_ms"]:>7.1f} ms {result["p99_ms"]:>7.1f} ms', flush=True)
+
+    if args.output:
+        info = ctx.hsm.get_device_info()
+        with open(args.output, 'w') as fd:
+            json.dump({'serial': info.serial, 'version': '.'.join(str(v) for v in info.version),
+                       'count': args.count, 'results': results}, fd, indent=2)
+        print(f'Results written to {args.output}')
+    return 0
+
+
+def _run(ctx, args):
+    func = globals()[args.func]
+    try:
+        return func(ctx, args)
+    except exceptions.YubiHsmDeviceError as e:
+        # The HSM drops sessions that were idle for 30 seconds, which
+        # happens between the commands of a shell. Open a new one.
+        if e.code not in (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED):
+            raise
+        ctx.close()
+        return func(ctx, args)
+
+
+def run(ctx, args):
+    try:
+        return _run(ctx, args)
+    except exceptions.YubiHsmAuthenticationError as e:
+        print(f'ERROR: Failed to authenticate. [{e}]')
+        return -1
+    except exceptions.YubiHsmConnectionError as e:
+        ctx.close()
+        print(f'ERROR: Failed to connect to HSM. [{e}]')
+        return -2
+    except exceptions.YubiHsmDeviceError as e:
+        print(f'ERROR: {args.failure} [{e}]')
+        return -3
+    except (OSError, ValueError) as e:
+        print(f'ERROR: [{e}]')
+        return -4
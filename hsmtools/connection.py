@@ -0,0 +1,233 @@
+"""Connections to the HSM.
+
+The connector is taken from, in order: the --connector option of a
+program, the YUBIHSM_CONNECTOR environment variable, the [connector]
+section of the config file, and finally the first USB device. The config
+file is ~/.config/yubihsm-examples/config.ini, or the file named by
+YUBIHSM_CONFIG:
+
+    [connector]
+    urls = http://hsm1:12345 http://hsm2:12345
+    timeout = 300
+    max_inflight = 4
+
+Several URLs (space or comma separated) are tried in order; a connector
+that cannot be reached is skipped and tried last for the next 30 seconds.
+Once a connector has answered, a YubiHsm stays on it, since its sessions
+only exist on that HSM.
+
+http(s) connectors are reached through keep-alive connections that are
+shared by every YubiHsm of the process, so opening another session or
+reconnecting does not cost a new TCP (and TLS) handshake. At most
+max_inflight requests are sent to one connector at a time.
+
+With --trace FILE or YUBIHSM_TRACE set, every message is written to a
+trace, see hsmtools/trace.py.
+"""
+import configparser
+import http.client
+import os
+import re
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from yubihsm import YubiHsm
+from yubihsm.exceptions import YubiHsmConnectionError
+
+DEFAULT_CONNECTOR = 'yhusb://'
+CONFIG_FILE = os.environ.get('YUBIHSM_CONFIG') or os.path.join(os.path.expanduser('~'), '.config', 'yubihsm-examples', 'config.ini')
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_INFLIGHT = 4
+# Seconds a connector that could not be reached is tried last
+RETRY_AFTER = 30
+
+_options = {}
+_connectors = {}
+_tracers = {}
+_lock = threading.Lock()
+
+
+def add_arguments(parser):
+    parser.add_argument('--connector', action='append', metavar='URL', help='Connector URL of the HSM, e.g. http://hsm1:12345. Repeat to fail over between connectors. (Default: YUBIHSM_CONNECTOR, the config file or yhusb://)')
+    parser.add_argument('--trace', metavar='FILE', help='Append the command, sizes and round trip of every HSM message to FILE. (Default: YUBIHSM_TRACE)')
+
+
+def configure(args):
+    """Use the connectors given on the command line."""
+    if getattr(args, 'connector', None):
+        _options['urls'] = args.connector
+    if getattr(args, 'trace', None):
+        _options['trace'] = args.trace
+
+
+def _split(value):
+    return [url for url in re.split(r'[\s,]+', value) if url]
+
+
+def settings():
+    """Return (urls, timeout, max_inflight) from the options, environment and config file."""
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    section = config['connector'] if config.has_section('connector') else {}
+
+    urls = _options.get('urls') or _split(os.environ.get('YUBIHSM_CONNECTOR', '')) or _split(section.get('urls', ''))
+    timeout = float(section.get('timeout', DEFAULT_TIMEOUT))
+    max_inflight = int(section.get('max_inflight', DEFAULT_MAX_INFLIGHT))
+    return urls or [DEFAULT_CONNECTOR], timeout, max_inflight
+
+
+class HttpConnector(object):
+    """Pool of keep-alive connections to one yubihsm-connector."""
+
+    def __init__(self, url, timeout, max_inflight):
+        parts = urlsplit(url)
+        self.url = url
+        self._cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._host = parts.netloc
+        self._path = urljoin(parts.path or '/', 'connector/api')
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self.failed_at = 0
+
+    def _post(self, conn, msg):
+        conn.request('POST', self._path, msg, {'Content-Type': 'application/octet-stream'})
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status != 200:
+            raise YubiHsmConnectionError(f'{self.url} returned HTTP {resp.status} {resp.reason}')
+        return data, resp.will_close
+
+    def transceive(self, msg):
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = self._cls(self._host, timeout=self._timeout)
+                    data, close = self._post(conn, msg)
+                else:
+                    try:
+                        data, close = self._post(conn, msg)
+                    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                        # The connector closed the idle connection, the
+                        # request never reached it.
+                        conn.close()
+                        conn = self._cls(self._host, timeout=self._timeout)
+                        data, close = self._post(conn, msg)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self.failed_at = time.monotonic()
+                raise YubiHsmConnectionError(f'{self.url}: {e}')
+            except YubiHsmConnectionError:
+                conn.close()
+                raise
+
+        if close:
+            conn.close()
+        else:
+            with self._lock:
+                self._idle.append(conn)
+        return data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class FailoverBackend(object):
+    """yubihsm backend sending each message to the first connector that answers."""
+
+    def __init__(self, connectors):
+        self._connectors = connectors
+        self._active = None
+
+    def transceive(self, msg):
+        if self._active is not None:
+            return self._active.transceive(msg)
+
+        # Connectors that failed recently are tried last
+        errors = []
+        for connector in sorted(self._connectors, key=lambda c: c.failed_at > time.monotonic() - RETRY_AFTER):
+            try:
+                data = connector.transceive(msg)
+            except YubiHsmConnectionError as e:
+                errors.append(str(e))
+                continue
+            self._active = connector
+            return data
+        raise YubiHsmConnectionError('No connector could be reached. [' + '; '.join(errors) + ']')
+
+    def close(self):
+        # The connections stay open for the next YubiHsm of this process
+        self._active = None
+
+    def __repr__(self):
+        return f'FailoverBackend({", ".join(c.url for c in self._connectors)})'
+
+
+def _connector(url, timeout, max_inflight):
+    with _lock:
+        connector = _connectors.get(url)
+        if connector is None:
+            connector = _connectors[url] = HttpConnector(url, timeout, max_inflight)
+        return connector
+
+
+def _traced(hsm):
+    path = _options.get('trace') or os.environ.get('YUBIHSM_TRACE')
+    if not path:
+        return hsm
+    from hsmtools import trace
+    with _lock:
+        tracer = _tracers.get(path)
+        if tracer is None:
+            tracer = _tracers[path] = trace.Tracer(path)
+    return trace.instrument(hsm, tracer)
+
+
+def connect(url=None):
+    """Connect to the HSM at url.
+
+    If no url is given the connectors are taken from the --connector
+    option, the YUBIHSM_CONNECTOR environment variable or the config file,
+    falling back to the first USB device. The url emulator:// creates an
+    in-process software stand-in, see hsmtools/emulator.py.
+    """
+    return _traced(_connect(url))
+
+
+def _connect(url):
+    urls, timeout, max_inflight = settings()
+    if url:
+        urls = [url]
+
+    if urls[0].startswith('emulator:'):
+        from hsmtools.emulator import SoftwareHsm
+        return YubiHsm(SoftwareHsm())
+
+    if all(u.startswith(('http://', 'https://')) for u in urls):
+        return YubiHsm(FailoverBackend([_connector(u, timeout, max_inflight) for u in urls]))
+
+    # USB devices are opened right away, so failing over is a matter of
+    # trying the next one.
+    errors = []
+    for u in urls:
+        try:
+            return YubiHsm.connect(u)
+        except YubiHsmConnectionError as e:
+            errors.append(f'{u}: {e}')
+    raise YubiHsmConnectionError('No connector could be reached. [' + '; '.join(errors) + ']')
+
+
+def discover_usb():
+    """Return a yhusb:// url for every YubiHSM attached over USB."""
+    import usb.core
+    from yubihsm.backends.usb import YUBIHSM_VID, YUBIHSM_PID
+
+    devices = usb.core.find(find_all=True, idVendor=YUBIHSM_VID, idProduct=YUBIHSM_PID)
+    return [f'yhusb://serial={int(d.serial_number)}' for d in devices]
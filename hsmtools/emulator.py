@@ -0,0 +1,678 @@
+"""A software stand-in for a YubiHSM 2.
+
+SoftwareHsm speaks the same wire protocol as the device, including the
+SCP03 style secure session, so the yubihsm library can drive it exactly
+like real hardware:
+
+    hsm = YubiHsm(SoftwareHsm())
+
+It keeps all objects in memory and implements the commands used by the
+programs in this project. Capabilities and domains are stored and reported
+but mostly not enforced: the only checks are that an exported object has
+EXPORTABLE_UNDER_WRAP, that the wrap key of an export or import delegates
+every capability of the object, and that a session only changes the
+password of its own authentication key. Wrapped objects use a format of
+its own, so it is meant for testing and benchmarking only.
+
+A latency model can be given to make the stand-in behave like a device:
+a mapping from COMMAND to seconds, plus an optional 'default' entry. For
+commands sent over a secure session the latency of the inner command is
+used. Commands are executed one at a time, as on the device.
+
+ConnectorServer exposes a SoftwareHsm over HTTP using the same API as
+yubihsm-connector, so programs can reach it with an http:// connector URL.
+"""
+import hashlib
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import cmac, hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESCCM
+
+from yubihsm.defs import ALGORITHM, CAPABILITY, COMMAND, ERROR, LIST_FILTER, OBJECT, OPTION, ORIGIN
+from yubihsm.objects import LABEL_LENGTH, ObjectInfo
+from yubihsm.utils import password_to_key
+
+DEFAULT_AUTHKEY_PASSWORD = 'password'
+MAX_SESSIONS = 16
+LOG_SIZE = 62
+
+_EC_ALGORITHMS = {
+    ALGORITHM.EC_P224: ec.SECP224R1,
+    ALGORITHM.EC_P256: ec.SECP256R1,
+    ALGORITHM.EC_P384: ec.SECP384R1,
+    ALGORITHM.EC_P521: ec.SECP521R1,
+    ALGORITHM.EC_K256: ec.SECP256K1,
+    ALGORITHM.EC_BP256: ec.BrainpoolP256R1,
+    ALGORITHM.EC_BP384: ec.BrainpoolP384R1,
+    ALGORITHM.EC_BP512: ec.BrainpoolP512R1,
+}
+
+_RSA_ALGORITHMS = {
+    ALGORITHM.RSA_2048: 2048,
+    ALGORITHM.RSA_3072: 3072,
+    ALGORITHM.RSA_4096: 4096,
+}
+
+_WRAP_KEY_LENGTHS = {
+    ALGORITHM.AES128_CCM_WRAP: 16,
+    ALGORITHM.AES192_CCM_WRAP: 24,
+    ALGORITHM.AES256_CCM_WRAP: 32,
+}
+
+_MGF_HASHES = {
+    ALGORITHM.RSA_MGF1_SHA1: hashes.SHA1,
+    ALGORITHM.RSA_MGF1_SHA256: hashes.SHA256,
+    ALGORITHM.RSA_MGF1_SHA384: hashes.SHA384,
+    ALGORITHM.RSA_MGF1_SHA512: hashes.SHA512,
+}
+
+# The device picks the hash from the length of the digest it is given.
+_DIGEST_HASHES = {20: hashes.SHA1, 32: hashes.SHA256, 48: hashes.SHA384, 64: hashes.SHA512}
+
+
+class HsmError(Exception):
+    def __init__(self, code):
+        super(HsmError, self).__init__(code)
+        self.code = code
+
+
+def _derive(key, t, context, L=0x80):
+    i = b'\0' * 11 + struct.pack('!BBHB', t, 0, L, 1) + context
+    c = cmac.CMAC(algorithms.AES(key))
+    c.update(i)
+    return c.finalize()[: L // 8]
+
+
+def _calculate_iv(key, counter):
+    encryptor = Cipher(algorithms.AES(key), modes.ECB()).encryptor()  # nosec ECB
+    return encryptor.update(counter.to_bytes(16, 'big')) + encryptor.finalize()
+
+
+def _calculate_mac(key, chain, message):
+    c = cmac.CMAC(algorithms.AES(key))
+    c.update(chain)
+    c.update(message)
+    chain = c.finalize()
+    return chain, chain[:8]
+
+
+def _response(cmd, data=b''):
+    return struct.pack('!BH', cmd | 0x80, len(data)) + data
+
+
+def _error(code):
+    return struct.pack('!BHB', COMMAND.ERROR, 1, code)
+
+
+def _label(packed):
+    return packed.split(b'\0', 1)[0].decode('utf8', 'replace')
+
+
+def _pad_label(label):
+    return label.encode('utf8').ljust(LABEL_LENGTH, b'\0')
+
+
+class HsmObject(object):
+    def __init__(self, object_id, object_type, algorithm, label, domains, capabilities,
+                 delegated_capabilities=0, origin=ORIGIN.GENERATED, key=None, size=0):
+        self.id = object_id
+        self.object_type = object_type
+        self.algorithm = algorithm
+        self.label = label
+        self.domains = domains
+        self.capabilities = capabilities
+        self.delegated_capabilities = delegated_capabilities
+        self.origin = origin
+        self.key = key
+        self.size = size
+        self.sequence = 0
+
+    def info(self):
+        return struct.pack(ObjectInfo.FORMAT, self.capabilities, self.id, self.size, self.domains,
+                           self.object_type, self.algorithm, self.sequence, self.origin,
+                           _pad_label(self.label), self.delegated_capabilities)
+
+    def serialize_key(self):
+        if self.object_type == OBJECT.ASYMMETRIC_KEY:
+            return self.key.private_bytes(serialization.Encoding.DER,
+                                          serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption())
+        if self.object_type == OBJECT.AUTHENTICATION_KEY:
+            return self.key[0] + self.key[1]
+        return self.key
+
+    def load_key(self, data):
+        if self.object_type == OBJECT.ASYMMETRIC_KEY:
+            self.key = serialization.load_der_private_key(data, None)
+        elif self.object_type == OBJECT.AUTHENTICATION_KEY:
+            self.key = (data[:16], data[16:])
+        else:
+            self.key = data
+
+
+class Session(object):
+    def __init__(self, sid, authkey, host_challenge):
+        self.sid = sid
+        self.authkey = authkey
+        self.card_challenge = os.urandom(8)
+        context = host_challenge + self.card_challenge
+        key_enc, key_mac = authkey.key
+        self.key_enc = _derive(key_enc, 0x04, context)
+        self.key_mac = _derive(key_mac, 0x06, context)
+        self.key_rmac = _derive(key_mac, 0x07, context)
+        self.card_cryptogram = _derive(self.key_mac, 0x00, context, 0x40)
+        self.host_cryptogram = _derive(self.key_mac, 0x01, context, 0x40)
+        self.authenticated = False
+        self.counter = 1
+        self.mac_chain = None
+        self.last_used = time.monotonic()
+
+
+class SoftwareHsm(object):
+    """In-memory YubiHSM 2, usable anywhere a yubihsm backend is expected."""
+
+    def __init__(self, serial=1000000, session_timeout=30, latency=None):
+        self.serial = serial
+        self.session_timeout = session_timeout
+        self.latency = latency or {}
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._sequences = {}
+        self._sessions = {}
+        self._options = {OPTION.FORCE_AUDIT: b'\0'}
+        self._log = []
+        self._log_number = 0
+        self._last_digest = b'\0' * 16
+        self._tick = 0
+        self._unlogged_auth = 0
+
+        key = password_to_key(DEFAULT_AUTHKEY_PASSWORD)
+        self._store(HsmObject(1, OBJECT.AUTHENTICATION_KEY, ALGORITHM.AES128_YUBICO_AUTHENTICATION,
+                              'DEFAULT AUTHKEY CHANGE THIS ASAP', 0xffff, CAPABILITY.ALL,
+                              CAPABILITY.ALL, ORIGIN.IMPORTED, key, 40))
+
+    # Backend interface used by yubihsm.YubiHsm
+
+    def transceive(self, msg):
+        with self._lock:
+            return self._process(bytes(msg))
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(serial={self.serial})'
+
+    # Helpers for tests
+
+    def drop_sessions(self):
+        """Forget all open sessions, as if the device had been replugged."""
+        with self._lock:
+            self._sessions.clear()
+
+    # Outer protocol
+
+    def _process(self, msg):
+        if len(msg) < 3:
+            return _error(ERROR.WRONG_LENGTH)
+        cmd, length = struct.unpack('!BH', msg[:3])
+        data = msg[3:]
+        if len(data) != length:
+            return _error(ERROR.WRONG_LENGTH)
+
+        self._expire_sessions()
+
+        if cmd != COMMAND.SESSION_MESSAGE:
+            self._delay(cmd)
+
+        try:
+            if cmd == COMMAND.ECHO:
+                return _response(cmd, data)
+            if cmd == COMMAND.DEVICE_INFO:
+                return _response(cmd, self._device_info())
+            if cmd == COMMAND.CREATE_SESSION:
+                return _response(cmd, self._create_session(data))
+            if cmd == COMMAND.AUTHENTICATE_SESSION:
+                return _response(cmd, self._authenticate_session(msg))
+            if cmd == COMMAND.SESSION_MESSAGE:
+                return self._session_message(msg)
+            return _error(ERROR.INVALID_COMMAND)
+        except HsmError as e:
+            return _error(e.code)
+        except (struct.error, ValueError, IndexError):
+            return _error(ERROR.INVALID_DATA)
+
+    def _delay(self, cmd):
+        seconds = self.latency.get(cmd, self.latency.get('default', 0))
+        if seconds:
+            time.sleep(seconds)
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        for sid in [s.sid for s in self._sessions.values() if now - s.last_used > self.session_timeout]:
+            del self._sessions[sid]
+
+    def _device_info(self):
+        algos = bytes(sorted(a for a in ALGORITHM))
+        return struct.pack('!BBBIBB', 2, 3, 1, self.serial, LOG_SIZE, len(self._log)) + algos
+
+    def _create_session(self, data):
+        authkey_id, host_challenge = struct.unpack('!H8s', data)
+        authkey = self._objects.get((OBJECT.AUTHENTICATION_KEY, authkey_id))
+        if authkey is None:
+            raise HsmError(ERROR.OBJECT_NOT_FOUND)
+        free = [sid for sid in range(MAX_SESSIONS) if sid not in self._sessions]
+        if not free:
+            raise HsmError(ERROR.SESSIONS_FULL)
+        session = Session(free[0], authkey, host_challenge)
+        self._sessions[session.sid] = session
+        return struct.pack('!B', session.sid) + session.card_challenge + session.card_cryptogram
+
+    def _authenticate_session(self, msg):
+        sid = msg[3]
+        session = self._sessions.get(sid)
+        if session is None or session.authenticated:
+            raise HsmError(ERROR.INVALID_SESSION)
+        host_cryptogram, mac = msg[4:12], msg[12:20]
+        chain, expected = _calculate_mac(session.key_mac, b'\0' * 16, msg[:-8])
+        if host_cryptogram != session.host_cryptogram or mac != expected:
+            del self._sessions[sid]
+            self._audit(COMMAND.AUTHENTICATE_SESSION, len(msg), session.authkey.id, 0, 0, COMMAND.ERROR)
+            raise HsmError(ERROR.AUTHENTICATION_FAILED)
+        session.authenticated = True
+        session.mac_chain = chain
+        self._audit(COMMAND.AUTHENTICATE_SESSION, len(msg), session.authkey.id, 0, 0, COMMAND.AUTHENTICATE_SESSION | 0x80)
+        return b''
+
+    def _session_message(self, msg):
+        sid = msg[3]
+        session = self._sessions.get(sid)
+        if session is None or not session.authenticated:
+            raise HsmError(ERROR.INVALID_SESSION)
+
+        next_chain, mac = _calculate_mac(session.key_mac, session.mac_chain, msg[:-8])
+        if mac != msg[-8:]:
+            del self._sessions[sid]
+            raise HsmError(ERROR.AUTHENTICATION_FAILED)
+
+        cipher = Cipher(algorithms.AES(session.key_enc), modes.CBC(_calculate_iv(session.key_enc, session.counter)))
+        decryptor = cipher.decryptor()
+        plain = decryptor.update(msg[4:-8]) + decryptor.finalize()
+        plain = plain[:plain.rindex(b'\x80')]
+
+        inner_cmd, inner_len = struct.unpack('!BH', plain[:3])
+        self._delay(inner_cmd)
+        inner = self._secure_command(session, inner_cmd, plain[3:3 + inner_len])
+
+        padded = inner + b'\x80'
+        padded = padded.ljust((len(padded) + 15) // 16 * 16, b'\0')
+        encryptor = cipher.encryptor()
+        body = struct.pack('!B', sid) + encryptor.update(padded) + encryptor.finalize()
+        resp = struct.pack('!BH', COMMAND.SESSION_MESSAGE | 0x80, len(body) + 8) + body
+        resp += _calculate_mac(session.key_rmac, next_chain, resp)[1]
+
+        session.counter += 1
+        session.mac_chain = next_chain
+        session.last_used = time.monotonic()
+        if inner_cmd == COMMAND.CLOSE_SESSION:
+            self._sessions.pop(sid, None)
+        return resp
+
+    # Audit log
+
+    def _audit(self, cmd, length, session_key, target_key, second_key, result):
+        if len(self._log) >= LOG_SIZE:
+            if self._options[OPTION.FORCE_AUDIT] != b'\0':
+                # The log is full and may not be overwritten, only count the event.
+                self._unlogged_auth += 1
+                return
+            self._log.pop(0)
+        self._tick += 1
+        self._log_number = (self._log_number + 1) & 0xffff
+        data = struct.pack('!HBHHHHBL', self._log_number, cmd, length, session_key,
+                           target_key, second_key, result & 0xff, self._tick)
+        digest = hashlib.sha256(data + self._last_digest).digest()[:16]
+        self._last_digest = digest
+        self._log.append(data + digest)
+
+    # Commands sent over a secure session
+
+    def _secure_command(self, session, cmd, data):
+        handler = self._handlers.get(cmd)
+        if handler is None:
+            return _error(ERROR.INVALID_COMMAND)
+
+        target = struct.unpack('!H', data[:2])[0] if len(data) >= 2 and cmd != COMMAND.GET_PSEUDO_RANDOM else 0
+        if self._options[OPTION.FORCE_AUDIT] != b'\0' and len(self._log) >= LOG_SIZE \
+                and cmd not in (COMMAND.GET_LOG_ENTRIES, COMMAND.SET_LOG_INDEX, COMMAND.CLOSE_SESSION):
+            return _error(ERROR.LOG_FULL)
+
+        try:
+            resp = _response(cmd, handler(self, session, data))
+            result = cmd | 0x80
+        except HsmError as e:
+            resp = _error(e.code)
+            result = COMMAND.ERROR
+        except (struct.error, ValueError, IndexError):
+            resp = _error(ERROR.INVALID_DATA)
+            result = COMMAND.ERROR
+
+        if cmd not in (COMMAND.GET_LOG_ENTRIES, COMMAND.SET_LOG_INDEX):
+            self._audit(cmd, len(data), session.authkey.id, target, 0, result)
+        return resp
+
+    def _get(self, object_type, object_id):
+        obj = self._objects.get((object_type, object_id))
+        if obj is None:
+            raise HsmError(ERROR.OBJECT_NOT_FOUND)
+        return obj
+
+    def _store(self, obj, replace=False):
+        key = (obj.object_type, obj.id)
+        if obj.id == 0:
+            used = {i for (t, i) in self._objects if t == obj.object_type}
+            obj.id = next(i for i in range(1, 0x10000) if i not in used)
+            key = (obj.object_type, obj.id)
+        elif key in self._objects and not replace:
+            raise HsmError(ERROR.OBJECT_EXISTS)
+        # The sequence number is bumped every time an ID is reused.
+        obj.sequence = self._sequences.get(key, -1) + 1 & 0xff
+        self._sequences[key] = obj.sequence
+        self._objects[key] = obj
+        return struct.pack('!H', obj.id)
+
+    def _header(self, data, delegated=False):
+        fmt = '!H%dsHQBQ' % LABEL_LENGTH if delegated else '!H%dsHQB' % LABEL_LENGTH
+        size = struct.calcsize(fmt)
+        fields = struct.unpack(fmt, data[:size]) + ((0,) if not delegated else ())
+        object_id, label, domains, caps, algo, dcaps = fields
+        return object_id, _label(label), domains, caps, ALGORITHM(algo), dcaps, data[size:]
+
+    def _echo(self, session, data):
+        return data
+
+    def _close_session(self, session, data):
+        return b''
+
+    def _list_objects(self, session, data):
+        filters = {}
+        i = 0
+        while i < len(data):
+            tag = data[i]
+            fmt = {LIST_FILTER.ID: '!H', LIST_FILTER.TYPE: '!B', LIST_FILTER.DOMAINS: '!H',
+                   LIST_FILTER.CAPABILITIES: '!Q', LIST_FILTER.ALGORITHM: '!B',
+                   LIST_FILTER.LABEL: '!%ds' % LABEL_LENGTH}[tag]
+            size = struct.calcsize(fmt)
+            filters[tag] = struct.unpack(fmt, data[i + 1:i + 1 + size])[0]
+            i += 1 + size
+
+        resp = b''
+        for (object_type, object_id), obj in sorted(self._objects.items()):
+            if LIST_FILTER.ID in filters and object_id != filters[LIST_FILTER.ID]:
+                continue
+            if LIST_FILTER.TYPE in filters and object_type != filters[LIST_FILTER.TYPE]:
+                continue
+            if LIST_FILTER.DOMAINS in filters and not obj.domains & filters[LIST_FILTER.DOMAINS]:
+                continue
+            if LIST_FILTER.CAPABILITIES in filters and not obj.capabilities & filters[LIST_FILTER.CAPABILITIES]:
+                continue
+            if LIST_FILTER.ALGORITHM in filters and obj.algorithm != filters[LIST_FILTER.ALGORITHM]:
+                continue
+            if LIST_FILTER.LABEL in filters and obj.label != _label(filters[LIST_FILTER.LABEL]):
+                continue
+            resp += struct.pack('!HBB', object_id, object_type, obj.sequence)
+        return resp
+
+    def _get_object_info(self, session, data):
+        object_id, object_type = struct.unpack('!HB', data)
+        return self._get(object_type, object_id).info()
+
+    def _delete_object(self, session, data):
+        object_id, object_type = struct.unpack('!HB', data)
+        self._get(object_type, object_id)
+        del self._objects[(object_type, object_id)]
+        return b''
+
+    def _get_pseudo_random(self, session, data):
+        return os.urandom(struct.unpack('!H', data)[0])
+
+    def _put_authentication_key(self, session, data):
+        object_id, label, domains, caps, algo, dcaps, rest = self._header(data, True)
+        if len(rest) != 32:
+            raise HsmError(ERROR.WRONG_LENGTH)
+        return self._store(HsmObject(object_id, OBJECT.AUTHENTICATION_KEY, algo, label, domains, caps,
+                                     dcaps, ORIGIN.IMPORTED, (rest[:16], rest[16:]), 40))
+
+    def _change_authentication_key(self, session, data):
+        object_id, algo = struct.unpack('!HB', data[:3])
+        # Only the key that opened the session can be changed
+        if object_id != session.authkey.id:
+            raise HsmError(ERROR.INVALID_ID)
+        obj = self._get(OBJECT.AUTHENTICATION_KEY, object_id)
+        obj.key = (data[3:19], data[19:35])
+        return struct.pack('!H', object_id)
+
+    def _new_asymmetric(self, object_id, label, domains, caps, algo, key, origin):
+        size = key.key_size // 8 if hasattr(key, 'key_size') else 32
+        return self._store(HsmObject(object_id, OBJECT.ASYMMETRIC_KEY, algo, label, domains, caps,
+                                     0, origin, key, size))
+
+    def _generate_asymmetric_key(self, session, data):
+        object_id, label, domains, caps, algo, _, _ = self._header(data)
+        if algo in _EC_ALGORITHMS:
+            key = ec.generate_private_key(_EC_ALGORITHMS[algo]())
+        elif algo in _RSA_ALGORITHMS:
+            key = rsa.generate_private_key(0x10001, _RSA_ALGORITHMS[algo])
+        elif algo == ALGORITHM.EC_ED25519:
+            key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            raise HsmError(ERROR.INVALID_DATA)
+        return self._new_asymmetric(object_id, label, domains, caps, algo, key, ORIGIN.GENERATED)
+
+    def _put_asymmetric_key(self, session, data):
+        object_id, label, domains, caps, algo, _, rest = self._header(data)
+        if algo in _EC_ALGORITHMS:
+            key = ec.derive_private_key(int.from_bytes(rest, 'big'), _EC_ALGORITHMS[algo]())
+        elif algo in _RSA_ALGORITHMS:
+            half = len(rest) // 2
+            p, q = int.from_bytes(rest[:half], 'big'), int.from_bytes(rest[half:], 'big')
+            e = 0x10001
+            d = pow(e, -1, (p - 1) * (q - 1))
+            key = rsa.RSAPrivateNumbers(p, q, d, rsa.rsa_crt_dmp1(d, p), rsa.rsa_crt_dmq1(d, q),
+                                        rsa.rsa_crt_iqmp(p, q), rsa.RSAPublicNumbers(e, p * q)).private_key()
+        elif algo == ALGORITHM.EC_ED25519:
+            key = ed25519.Ed25519PrivateKey.from_private_bytes(rest)
+        else:
+            raise HsmError(ERROR.INVALID_DATA)
+        return self._new_asymmetric(object_id, label, domains, caps, algo, key, ORIGIN.IMPORTED)
+
+    def _get_public_key(self, session, data):
+        obj = self._get(OBJECT.ASYMMETRIC_KEY, struct.unpack('!H', data)[0])
+        pub = obj.key.public_key()
+        if obj.algorithm in _EC_ALGORITHMS:
+            raw = pub.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)[1:]
+        elif obj.algorithm in _RSA_ALGORITHMS:
+            raw = pub.public_numbers().n.to_bytes(obj.size, 'big')
+        else:
+            raw = pub.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        return struct.pack('!B', obj.algorithm) + raw
+
+    def _signing_key(self, data, algorithms):
+        obj = self._get(OBJECT.ASYMMETRIC_KEY, struct.unpack('!H', data[:2])[0])
+        if obj.algorithm not in algorithms:
+            raise HsmError(ERROR.INVALID_DATA)
+        return obj.key
+
+    def _digest_hash(self, digest):
+        if len(digest) not in _DIGEST_HASHES:
+            raise HsmError(ERROR.WRONG_LENGTH)
+        return Prehashed(_DIGEST_HASHES[len(digest)]())
+
+    def _sign_ecdsa(self, session, data):
+        key = self._signing_key(data, _EC_ALGORITHMS)
+        return key.sign(data[2:], ec.ECDSA(self._digest_hash(data[2:])))
+
+    def _sign_eddsa(self, session, data):
+        return self._signing_key(data, (ALGORITHM.EC_ED25519,)).sign(data[2:])
+
+    def _sign_pkcs1(self, session, data):
+        key = self._signing_key(data, _RSA_ALGORITHMS)
+        return key.sign(data[2:], padding.PKCS1v15(), self._digest_hash(data[2:]))
+
+    def _sign_pss(self, session, data):
+        key = self._signing_key(data, _RSA_ALGORITHMS)
+        mgf, salt_len = struct.unpack('!BH', data[2:5])
+        digest = data[5:]
+        pss = padding.PSS(padding.MGF1(_MGF_HASHES[ALGORITHM(mgf)]()), salt_len)
+        return key.sign(digest, pss, self._digest_hash(digest))
+
+    def _put_wrap_key(self, session, data):
+        object_id, label, domains, caps, algo, dcaps, rest = self._header(data, True)
+        if _WRAP_KEY_LENGTHS.get(algo) != len(rest):
+            raise HsmError(ERROR.INVALID_DATA)
+        return self._store(HsmObject(object_id, OBJECT.WRAP_KEY, algo, label, domains, caps,
+                                     dcaps, ORIGIN.IMPORTED, rest, len(rest)))
+
+    def _generate_wrap_key(self, session, data):
+        object_id, label, domains, caps, algo, dcaps, _ = self._header(data, True)
+        if algo not in _WRAP_KEY_LENGTHS:
+            raise HsmError(ERROR.INVALID_DATA)
+        key = os.urandom(_WRAP_KEY_LENGTHS[algo])
+        return self._store(HsmObject(object_id, OBJECT.WRAP_KEY, algo, label, domains, caps,
+                                     dcaps, ORIGIN.GENERATED, key, len(key)))
+
+    def _export_wrapped(self, session, data):
+        wrap_id, object_type, object_id = struct.unpack('!HBH', data)
+        wrap_key = self._get(OBJECT.WRAP_KEY, wrap_id)
+        obj = self._get(object_type, object_id)
+        # The wrap key must delegate every capability of the object
+        if not obj.capabilities & CAPABILITY.EXPORTABLE_UNDER_WRAP or obj.capabilities & ~wrap_key.delegated_capabilities:
+            raise HsmError(ERROR.INSUFFICIENT_PERMISSIONS)
+        nonce = os.urandom(13)
+        plain = obj.info() + obj.serialize_key()
+        return nonce + AESCCM(wrap_key.key).encrypt(nonce, plain, None)
+
+    def _import_wrapped(self, session, data):
+        wrap_key = self._get(OBJECT.WRAP_KEY, struct.unpack('!H', data[:2])[0])
+        nonce, blob = data[2:15], data[15:]
+        try:
+            plain = AESCCM(wrap_key.key).decrypt(nonce, blob, None)
+        except Exception:
+            raise HsmError(ERROR.INVALID_DATA)
+        info = ObjectInfo.parse(plain[:ObjectInfo.LENGTH])
+        if info.capabilities & ~wrap_key.delegated_capabilities:
+            raise HsmError(ERROR.INSUFFICIENT_PERMISSIONS)
+        obj = HsmObject(info.id, info.object_type, info.algorithm, info.label, info.domains,
+                        info.capabilities, info.delegated_capabilities,
+                        info.origin | ORIGIN.IMPORTED_WRAPPED, None, info.size)
+        obj.load_key(plain[ObjectInfo.LENGTH:])
+        self._store(obj)
+        return struct.pack('!BH', obj.object_type, obj.id)
+
+    def _get_log_entries(self, session, data):
+        return struct.pack('!HHB', 0, self._unlogged_auth, len(self._log)) + b''.join(self._log)
+
+    def _set_log_index(self, session, data):
+        index = struct.unpack('!H', data)[0]
+        self._log = [e for e in self._log if 0 < (struct.unpack('!H', e[:2])[0] - index) & 0xffff < 0x8000]
+        self._unlogged_auth = 0
+        return b''
+
+    def _set_option(self, session, data):
+        option, length = struct.unpack('!BH', data[:3])
+        self._options[option] = data[3:3 + length]
+        return b''
+
+    def _get_option(self, session, data):
+        option = struct.unpack('!B', data)[0]
+        if option not in self._options:
+            raise HsmError(ERROR.INVALID_DATA)
+        return self._options[option]
+
+    _handlers = {
+        COMMAND.ECHO: _echo,
+        COMMAND.CLOSE_SESSION: _close_session,
+        COMMAND.LIST_OBJECTS: _list_objects,
+        COMMAND.GET_OBJECT_INFO: _get_object_info,
+        COMMAND.DELETE_OBJECT: _delete_object,
+        COMMAND.GET_PSEUDO_RANDOM: _get_pseudo_random,
+        COMMAND.PUT_AUTHENTICATION_KEY: _put_authentication_key,
+        COMMAND.CHANGE_AUTHENTICATION_KEY: _change_authentication_key,
+        COMMAND.GENERATE_ASYMMETRIC_KEY: _generate_asymmetric_key,
+        COMMAND.PUT_ASYMMETRIC_KEY: _put_asymmetric_key,
+        COMMAND.GET_PUBLIC_KEY: _get_public_key,
+        COMMAND.SIGN_ECDSA: _sign_ecdsa,
+        COMMAND.SIGN_EDDSA: _sign_eddsa,
+        COMMAND.SIGN_PKCS1: _sign_pkcs1,
+        COMMAND.SIGN_PSS: _sign_pss,
+        COMMAND.PUT_WRAP_KEY: _put_wrap_key,
+        COMMAND.GENERATE_WRAP_KEY: _generate_wrap_key,
+        COMMAND.EXPORT_WRAPPED: _export_wrapped,
+        COMMAND.IMPORT_WRAPPED: _import_wrapped,
+        COMMAND.GET_LOG_ENTRIES: _get_log_entries,
+        COMMAND.SET_LOG_INDEX: _set_log_index,
+        COMMAND.SET_OPTION: _set_option,
+        COMMAND.GET_OPTION: _get_option,
+    }
+
+
+class _ConnectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this every reply waits
+    # for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path != '/connector/status':
+            self.send_error(404)
+            return
+        hsm = self.server.hsm
+        host, port = self.server.server_address[:2]
+        body = (f'status=OK\nserial={hsm.serial}\nversion=3.0.0\npid={os.getpid()}\n'
+                f'address={host}\nport={port}\n').encode('ascii')
+        self._reply(body, 'text/plain')
+
+    def do_POST(self):
+        if self.path != '/connector/api':
+            self.send_error(404)
+            return
+        msg = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply(self.server.hsm.transceive(msg), 'application/octet-stream')
+
+    def _reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ConnectorServer(ThreadingHTTPServer):
+    """HTTP server speaking the yubihsm-connector API in front of a SoftwareHsm."""
+
+    daemon_threads = True
+
+    def __init__(self, hsm, host='127.0.0.1', port=12345):
+        ThreadingHTTPServer.__init__(self, (host, port), _ConnectorHandler)
+        self.hsm = hsm
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve requests on a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,292 @@
+"""Buffered pool of random bytes from the HSM.
+
+Each GET_PSEUDO_RANDOM is a round trip to the device, which is slow for
+the many small reads of tokens and nonces. EntropyPool keeps a buffer of
+HSM random bytes that a background thread fetches in large blocks and
+tops up whenever the level drops to the low-water mark, so reads are
+served from memory. Bytes are handed out once: the part of the buffer a
+read consumed is overwritten with zeros right away, and the whole buffer
+on close. The blocks returned by the yubihsm library are immutable bytes
+and can not be wiped; they are dropped as soon as they are copied in.
+
+EntropyServer serves the pool to local clients over a Unix domain socket
+with the same newline delimited JSON as the signing agent:
+
+    {"op": "random", "length": 32}
+    {"op": "stats"}
+
+The reply to random carries the bytes as hex in "data".
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import ERROR
+
+from hsmtools.authcache import create_session
+
+# Largest GET_PSEUDO_RANDOM answer that fits in one message of the device
+MAX_BLOCK = 2028
+DEFAULT_CAPACITY = 64 * 1024
+DEFAULT_LOW_WATER = 16 * 1024
+# Largest single read served over the socket
+MAX_READ = 64 * 1024
+
+
+class EntropyError(Exception):
+    pass
+
+
+class HsmSource(object):
+    """Fetches random bytes over its own session, reconnecting once on failure."""
+
+    def __init__(self, connect, authkey_id, password):
+        self._connect = connect
+        self._authkey_id = authkey_id
+        self._password = password
+        self._hsm = None
+        self._session = None
+        self.reconnects = 0
+
+    def open(self):
+        self._hsm = self._connect()
+        self._session = create_session(self._hsm, self._authkey_id, self._password)
+
+    def close(self):
+        try:
+            if self._session:
+                self._session.close()
+        except exceptions.YubiHsmError:
+            pass
+        if self._hsm:
+            self._hsm.close()
+        self._session = self._hsm = None
+
+    def _reconnect(self):
+        self.close()
+        self.open()
+        self.reconnects += 1
+
+    def __call__(self, length):
+        # The session times out while the pool is full and nothing is read
+        try:
+            if self._session is None:
+                self._reconnect()
+            return self._session.get_pseudo_random(length)
+        except (exceptions.YubiHsmConnectionError, exceptions.YubiHsmInvalidResponseError):
+            self._reconnect()
+        except exceptions.YubiHsmDeviceError as e:
+            if e.code not in (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED):
+                raise
+            self._reconnect()
+        return self._session.get_pseudo_random(length)
+
+
+class EntropyPool(object):
+    """Ring buffer of random bytes, refilled from fetch(length) by a thread."""
+
+    def __init__(self, fetch, capacity=DEFAULT_CAPACITY, low_water=DEFAULT_LOW_WATER, block_size=MAX_BLOCK):
+        if not 0 <= low_water < capacity or not 0 < block_size <= MAX_BLOCK:
+            raise ValueError(f'Need 0 <= low water < capacity and a block size of 1 to {MAX_BLOCK} bytes.')
+        self._fetch = fetch
+        self.capacity = capacity
+        self.low_water = low_water
+        self.block_size = block_size
+        self._buf = bytearray(capacity)
+        self._head = 0
+        self._level = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='entropy-refill', daemon=True)
+
+        self.reads = 0
+        self.bytes_served = 0
+        self.starvations = 0
+        self.starved_seconds = 0.0
+        self.fetches = 0
+        self.bytes_fetched = 0
+        self.fetch_seconds = 0.0
+        self.fetch_errors = 0
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            self._buf[:] = bytes(self.capacity)
+            self._level = 0
+
+    def read(self, length, timeout=None):
+        """Return length random bytes, waiting for a refill if the pool runs short."""
+        out = bytearray(length)
+        view = memoryview(out)
+        done = 0
+        with self._cond:
+            self.reads += 1
+            while done < length:
+                if not self._level:
+                    self._wait(timeout)
+                    continue
+                done += self._take(view[done:])
+            self.bytes_served += length
+            if self._level <= self.low_water:
+                self._cond.notify_all()
+        return bytes(out)
+
+    def _wait(self, timeout):
+        self.starvations += 1
+        self._waiting += 1
+        self._cond.notify_all()
+        start = time.perf_counter()
+        try:
+            if not self._cond.wait_for(lambda: self._level or self.error or self._stop, timeout):
+                raise EntropyError('Timed out waiting for random bytes from the HSM.')
+        finally:
+            self._waiting -= 1
+            self.starved_seconds += time.perf_counter() - start
+        if not self._level:
+            raise EntropyError(f'The pool is empty. [{self.error or "closed"}]')
+
+    def _take(self, view):
+        # Copy out of the ring, at most up to its end, and wipe what was taken
+        n = min(len(view), self._level, self.capacity - self._head)
+        view[:n] = self._buf[self._head:self._head + n]
+        self._buf[self._head:self._head + n] = bytes(n)
+        self._head = (self._head + n) % self.capacity
+        self._level -= n
+        return n
+
+    def _put(self, data):
+        tail = (self._head + self._level) % self.capacity
+        first = min(len(data), self.capacity - tail)
+        self._buf[tail:tail + first] = data[:first]
+        self._buf[:len(data) - first] = data[first:]
+        self._level += len(data)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Once full, sleep until the low-water mark or a starving
+                # reader, then fetch blocks until full again.
+                if self._level == self.capacity:
+                    self._cond.wait_for(lambda: self._stop or self._level <= self.low_water or self._waiting)
+                if self._stop:
+                    return
+                length = min(self.block_size, self.capacity - self._level)
+
+            start = time.perf_counter()
+            try:
+                data = self._fetch(length)
+            except Exception as e:
+                with self._cond:
+                    self.fetch_errors += 1
+                    self.error = str(e) or e.__class__.__name__
+                    self._cond.notify_all()
+                    # Readers that run dry fail until the next try in a second
+                    self._cond.wait_for(lambda: self._stop, 1)
+                    self.error = None
+                continue
+
+            with self._cond:
+                self.fetches += 1
+                self.bytes_fetched += len(data)
+                self.fetch_seconds += time.perf_counter() - start
+                self._put(data[:self.capacity - self._level])
+                self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {
+                'level': self._level,
+                'capacity': self.capacity,
+                'low_water': self.low_water,
+                'reads': self.reads,
+                'bytes_served': self.bytes_served,
+                'starvations': self.starvations,
+                'starved_ms': round(self.starved_seconds * 1000, 3),
+                'fetches': self.fetches,
+                'bytes_fetched': self.bytes_fetched,
+                'refill_bytes_per_s': round(self.bytes_fetched / self.fetch_seconds, 1) if self.fetch_seconds else 0.0,
+                'fetch_errors': self.fetch_errors,
+            }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        pool = self.server.pool
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                if msg.get('op') == 'stats':
+                    reply = dict(pool.status(), status='ok')
+                elif msg.get('op') == 'random':
+                    length = int(msg['length'])
+                    if not 0 < length <= MAX_READ:
+                        raise ValueError(f'length must be 1 to {MAX_READ}')
+                    reply = {'status': 'ok', 'data': pool.read(length, self.server.read_timeout).hex()}
+                else:
+                    reply = {'status': 'error', 'error': 'Unknown op.'}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'status': 'error', 'error': f'Bad request. [{e}]'}
+            except EntropyError as e:
+                reply = {'status': 'error', 'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+
+class EntropyServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool, read_timeout=10):
+        if os.path.exists(path):
+            os.remove(path)
+        # Only the owner of the pool may connect to it.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+        self.pool = pool
+        self.read_timeout = read_timeout
+
+
+class EntropyClient(object):
+    """Reads random bytes from an EntropyServer over one kept open connection."""
+
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._fd = self._sock.makefile('rb')
+
+    def _request(self, msg):
+        self._sock.sendall(json.dumps(msg).encode('utf8') + b'\n')
+        reply = json.loads(self._fd.readline())
+        if reply['status'] != 'ok':
+            raise EntropyError(reply['error'])
+        return reply
+
+    def read(self, length):
+        return bytes.fromhex(self._request({'op': 'random', 'length': length})['data'])
+
+    def stats(self):
+        return self._request({'op': 'stats'})
+
+    def close(self):
+        self._fd.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
@@ -0,0 +1,125 @@
+"""Key operations shared by the programs in utils/ and the commands of hsm.py.
+
+Each function works over an open session and leaves printing and exit
+codes to the caller.
+"""
+from yubihsm.defs import ALGORITHM, OBJECT
+from yubihsm.defs import CAPABILITY as CAP
+from yubihsm.objects import AsymmetricKey, AuthenticationKey, WrapKey
+
+from hsmtools.authcache import invalidate
+from hsmtools.objindex import ObjectIndex
+from hsmtools.pubkeys import PublicKeyCache, to_pem
+from hsmtools.signing import SIGNING_CAPABILITIES
+
+# The master authentication key, which is never deleted
+MASTER_AUTHKEY_ID = 1
+
+# Every scheme of hsmtools.signing, so the key can sign with and create
+# ECDSA, ed25519 and RSA-PSS keys
+AUTHKEY_CAPS = SIGNING_CAPABILITIES
+AUTHKEY_DELEGATED_CAPS = SIGNING_CAPABILITIES
+ADMIN_CAPS = CAP.GENERATE_ASYMMETRIC_KEY | CAP.EXPORT_WRAPPED | CAP.GET_PSEUDO_RANDOM | CAP.PUT_WRAP_KEY | CAP.IMPORT_WRAPPED | CAP.DELETE_ASYMMETRIC_KEY | CAP.DELETE_WRAP_KEY | CAP.DELETE_AUTHENTICATION_KEY
+ADMIN_DELEGATED_CAPS = CAP.EXPORTABLE_UNDER_WRAP | CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED
+
+# ID of the temporary wrapping key of a single export or import
+WRAP_KEY_ID = 100
+
+
+def print_objects(infos):
+    for info in infos:
+        print(f'id: {info.id} type: {info.object_type}')
+        print(info)
+        print("")  # Newline
+
+
+def write_public_key(key_id, public_key):
+    """Write public_key to ./public_key_<key_id>.pem and return the PEM text."""
+    pem = to_pem(public_key)
+    with open(f'./public_key_{key_id}.pem', 'w') as fd:
+        fd.write(pem)
+    return pem
+
+
+def public_keys(session, serial, **filters):
+    """Return ([(info, public key)], number read from the HSM) for the asymmetric keys matching filters.
+
+    Object info comes from the local index and public keys from the local
+    cache, only new or replaced keys are read from the HSM.
+    """
+    infos, _ = ObjectIndex().refresh(session, serial, object_type=OBJECT.ASYMMETRIC_KEY, **filters)
+    cache = PublicKeyCache()
+    keys = []
+    fetched = 0
+    for info in infos:
+        public_key, read = cache.get(AsymmetricKey(session, info.id), serial, info)
+        fetched += read
+        keys.append((info, public_key))
+    cache.save()
+    return keys, fetched
+
+
+def create_authkey(session, key_id, label, domains, password, admin=False):
+    caps = AUTHKEY_CAPS
+    delegated_caps = AUTHKEY_DELEGATED_CAPS
+    if admin:
+        caps |= ADMIN_CAPS
+        delegated_caps |= ADMIN_DELEGATED_CAPS
+    return AuthenticationKey.put_derived(session, key_id, label, domains, caps, delegated_caps, password)
+
+
+def create_signing_key(session, key_id, label, domains, scheme):
+    """Generate a key for scheme, one of hsmtools.signing.SCHEMES. key_id 0 lets the HSM choose the ID."""
+    return AsymmetricKey.generate(session, key_id, label, domains,
+                                  scheme.capability | CAP.EXPORTABLE_UNDER_WRAP, scheme.key_algorithm)
+
+
+def write_wrapped_key(key_id, wrapped):
+    """Write a key exported by export_wrapped to ./wrapped_key_<key_id>.bin and return the filename."""
+    filename = f'./wrapped_key_{key_id}.bin'
+    with open(filename, 'bw') as fd:
+        fd.write(wrapped)
+    return filename
+
+
+def _put_wrap_key(session, domains, delegated, aes_key):
+    return WrapKey.put(session, WRAP_KEY_ID, "Wrapping Key", domains, CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED,
+                       ALGORITHM.AES256_CCM_WRAP, delegated, aes_key)
+
+
+def export_wrapped(session, key_id, domains, aes_key):
+    """Export an asymmetric key wrapped with the AES-256 aes_key.
+
+    The wrap key only exists on the HSM for the export and must delegate
+    every capability of the key.
+    """
+    key = session.get_object(key_id, OBJECT.ASYMMETRIC_KEY)
+    delegated = key.get_info().capabilities | CAP.EXPORTABLE_UNDER_WRAP
+    wrap_key = _put_wrap_key(session, domains, delegated, aes_key)
+    try:
+        return wrap_key.export_wrapped(key)
+    finally:
+        wrap_key.delete()
+
+
+def import_wrapped(session, authkey_id, wrapped, domains, aes_key):
+    """Import a key written by export_wrapped and return it.
+
+    authkey_id is the key of the session. The key is not known before it
+    is imported, so the wrap key delegates every signing capability the
+    session's key may hand on.
+    """
+    authkey = session.get_object(authkey_id, OBJECT.AUTHENTICATION_KEY).get_info()
+    delegated = (SIGNING_CAPABILITIES | CAP.EXPORTABLE_UNDER_WRAP) & authkey.delegated_capabilities
+    wrap_key = _put_wrap_key(session, domains, delegated, aes_key)
+    try:
+        return wrap_key.import_wrapped(wrapped)
+    finally:
+        wrap_key.delete()
+
+
+def change_password(session, key_id, password):
+    session.get_object(key_id, OBJECT.AUTHENTICATION_KEY).change_password(password)
+
+    # Drop any cached session keys derived from the old password.
+    invalidate(key_id)
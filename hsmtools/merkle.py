@@ -0,0 +1,109 @@
+"""Merkle tree over file digests.
+
+Leaves bind the file's path to its SHA-256 digest and inner nodes hash
+their two children, with distinct prefixes so a leaf can never be passed
+off as a node. A node without a sibling is carried up to the next level
+unchanged. Only the root is signed on the HSM; each file gets a proof with
+the sibling hashes needed to recompute the root from that file alone.
+"""
+import hashlib
+import json
+import struct
+
+LEAF = b'\x00'
+NODE = b'\x01'
+
+
+def leaf_hash(path, digest):
+    name = path.encode('utf8')
+    return hashlib.sha256(LEAF + struct.pack('!H', len(name)) + name + digest).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE + left + right).digest()
+
+
+def build(leaves):
+    """Return the root and an inclusion proof for every leaf.
+
+    A proof is a list of (side, hash) pairs from the leaf up to the root,
+    where side is 'L' if the sibling is on the left.
+    """
+    if not leaves:
+        raise ValueError('Cannot build a tree without leaves.')
+
+    proofs = [[] for _ in leaves]
+    # Indices of the leaves below each node of the current level
+    members = [[i] for i in range(len(leaves))]
+    level = list(leaves)
+
+    while len(level) > 1:
+        next_level = []
+        next_members = []
+        for i in range(0, len(level), 2):
+            if i + 1 == len(level):
+                next_level.append(level[i])
+                next_members.append(members[i])
+                continue
+            left, right = level[i], level[i + 1]
+            for leaf in members[i]:
+                proofs[leaf].append(('R', right))
+            for leaf in members[i + 1]:
+                proofs[leaf].append(('L', left))
+            next_level.append(node_hash(left, right))
+            next_members.append(members[i] + members[i + 1])
+        level = next_level
+        members = next_members
+
+    return level[0], proofs
+
+
+def root_from_proof(leaf, proof):
+    node = leaf
+    for side, sibling in proof:
+        node = node_hash(sibling, node) if side == 'L' else node_hash(node, sibling)
+    return node
+
+
+def _hex(value, name, size=None):
+    try:
+        data = bytes.fromhex(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'"{name}" is not a hex string')
+    if size is not None and len(data) != size:
+        raise ValueError(f'"{name}" is not {size} bytes long')
+    return data
+
+
+def load_proof(filename):
+    """Read a proof file written by sign_merkle.py.
+
+    Returns a dict with the key ID, path, and the digest, root, signature
+    and sibling hashes as bytes. Raises ValueError if the file is not a
+    complete proof.
+    """
+    with open(filename, 'r') as fd:
+        proof = json.load(fd)
+    if not isinstance(proof, dict):
+        raise ValueError('not a proof object')
+    if not isinstance(proof.get('path'), str):
+        raise ValueError('"path" is missing')
+    if not isinstance(proof.get('key_id'), int):
+        raise ValueError('"key_id" is missing')
+    if not isinstance(proof.get('proof'), list):
+        raise ValueError('"proof" is missing')
+
+    siblings = []
+    for step in proof['proof']:
+        if not isinstance(step, list) or len(step) != 2 or step[0] not in ('L', 'R'):
+            raise ValueError(f'invalid step {step!r} in "proof"')
+        siblings.append((step[0], _hex(step[1], 'sibling', 32)))
+
+    return {
+        'key_id': proof['key_id'],
+        'path': proof['path'],
+        'digest': _hex(proof.get('digest'), 'digest', 32),
+        'root': _hex(proof.get('root'), 'root', 32),
+        'signature': _hex(proof.get('signature'), 'signature'),
+        'proof': siblings,
+    }
@@ -0,0 +1,180 @@
+"""Per-phase timings and HSM command counts for the command line tools.
+
+A tool creates a Metrics object from its arguments, wraps the steps it
+wants to time in metrics.phase(name) and passes its YubiHsm through
+metrics.instrument(). When the tool exits the collected numbers are
+appended to a JSON lines file or written as a Prometheus textfile. When
+--metrics is not given phase() returns a shared no-op context and nothing
+is wrapped, so the tools run as before.
+"""
+import atexit
+import contextlib
+import json
+import os
+import time
+
+from yubihsm.defs import COMMAND
+from yubihsm.exceptions import YubiHsmError
+
+FORMATS = ('json', 'prom')
+
+_NOOP = contextlib.nullcontext()
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', metavar='FILE', help='Record per-phase timings and HSM command counts to FILE.')
+    parser.add_argument('--metrics-format', default='json', choices=FORMATS,
+                        help='json appends one JSON line per run, prom writes a Prometheus textfile. (Default: json)')
+
+
+def from_args(tool, args):
+    metrics = Metrics(tool, args.metrics, args.metrics_format)
+    if metrics.enabled:
+        atexit.register(metrics.write)
+    return metrics
+
+
+def _command_name(cmd):
+    try:
+        return COMMAND(cmd).name
+    except ValueError:
+        return f'0x{cmd:02x}'
+
+
+class _Phase(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, typ, value, traceback):
+        self.metrics.add(self.name, time.perf_counter() - self.start, error=typ is not None)
+
+
+class Metrics(object):
+
+    def __init__(self, tool, path=None, format='json'):
+        self.tool = tool
+        self.path = path
+        self.format = format
+        self.enabled = path is not None
+        self.started = time.time()
+        self._start = time.perf_counter()
+        # name -> [seconds, count, errors]
+        self.phases = {}
+        self.commands = {}
+
+    def phase(self, name):
+        """Context manager timing one phase. Repeated phases are summed."""
+        if not self.enabled:
+            return _NOOP
+        return _Phase(self, name)
+
+    def add(self, name, seconds, error=False):
+        entry = self.phases.setdefault(name, [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+        entry[2] += error
+
+    def _count(self, cmd, seconds, error):
+        entry = self.commands.setdefault(_command_name(cmd), [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+        entry[2] += error
+
+    def _timed(self, send):
+        def wrapper(cmd, data=b''):
+            start = time.perf_counter()
+            try:
+                resp = send(cmd, data)
+            except YubiHsmError:
+                self._count(cmd, time.perf_counter() - start, True)
+                raise
+            self._count(cmd, time.perf_counter() - start, False)
+            return resp
+        return wrapper
+
+    def instrument(self, hsm):
+        """Count and time every command sent to hsm, including commands sent
+        over the sessions it creates. Returns hsm."""
+        if not self.enabled:
+            return hsm
+
+        transceive = hsm._transceive
+        create_session = hsm.create_session
+
+        def instrumented_transceive(msg):
+            # Session messages are counted by their decrypted inner command.
+            if msg[0] == COMMAND.SESSION_MESSAGE:
+                return transceive(msg)
+            start = time.perf_counter()
+            try:
+                resp = transceive(msg)
+            except YubiHsmError:
+                self._count(msg[0], time.perf_counter() - start, True)
+                raise
+            self._count(msg[0], time.perf_counter() - start, resp[0] == COMMAND.ERROR)
+            return resp
+
+        def instrumented_session(*args, **kwargs):
+            session = create_session(*args, **kwargs)
+            session.send_secure_cmd = self._timed(session.send_secure_cmd)
+            return session
+
+        hsm._transceive = instrumented_transceive
+        hsm.create_session = instrumented_session
+        return hsm
+
+    def report(self):
+        return {
+            'tool': self.tool,
+            'timestamp': round(self.started, 3),
+            'total_seconds': round(time.perf_counter() - self._start, 6),
+            'phases': {name: {'seconds': round(s, 6), 'count': n, 'errors': e}
+                       for name, (s, n, e) in self.phases.items()},
+            'commands': {name: {'seconds': round(s, 6), 'count': n, 'errors': e}
+                         for name, (s, n, e) in self.commands.items()},
+        }
+
+    def write(self):
+        report = self.report()
+        if self.format == 'prom':
+            self._write_prometheus(report)
+        else:
+            with open(self.path, 'a') as fd:
+                fd.write(json.dumps(report) + '\n')
+
+    def _write_prometheus(self, report):
+        tool = report['tool']
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP yubihsm_tool_{name} {help}')
+            lines.append(f'# TYPE yubihsm_tool_{name} {kind}')
+            for labels, value in samples:
+                label = ','.join(f'{k}="{v}"' for k, v in [('tool', tool)] + labels)
+                lines.append(f'yubihsm_tool_{name}{{{label}}} {value}')
+
+        phases = report['phases'].items()
+        commands = report['commands'].items()
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.', [([], report['timestamp'])])
+        metric('run_seconds', 'gauge', 'Wall time of the last run.', [([], report['total_seconds'])])
+        metric('phase_seconds', 'gauge', 'Time spent in each phase of the last run.',
+               [([('phase', p)], v['seconds']) for p, v in phases])
+        metric('phase_errors', 'gauge', 'Phases of the last run that raised an error.',
+               [([('phase', p)], v['errors']) for p, v in phases])
+        metric('hsm_commands', 'gauge', 'HSM commands sent in the last run.',
+               [([('command', c)], v['count']) for c, v in commands])
+        metric('hsm_command_seconds', 'gauge', 'Time spent waiting for each HSM command in the last run.',
+               [([('command', c)], v['seconds']) for c, v in commands])
+        metric('hsm_command_errors', 'gauge', 'HSM commands that failed in the last run.',
+               [([('command', c)], v['errors']) for c, v in commands])
+
+        # The textfile collector may read at any time, so replace the file atomically.
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fd:
+            fd.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.path)
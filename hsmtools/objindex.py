@@ -0,0 +1,144 @@
+"""Local index of the metadata of the objects stored on an HSM.
+
+Reading the info of every object costs one HSM round trip per object. The
+index keeps the info of each object keyed by device serial, object type
+and ID, together with the object's sequence number. Object metadata never
+changes in place on the device; an ID that is reused gets a new sequence
+number. A refresh therefore lists the objects once and only fetches the
+info of objects that are new or whose sequence changed, and drops objects
+that are gone. Queries after that are answered from the index.
+"""
+import json
+import os
+
+from yubihsm.defs import ALGORITHM, OBJECT, ORIGIN
+from yubihsm.objects import ObjectInfo
+
+INDEX_FILE = os.environ.get('YUBIHSM_OBJECT_INDEX',
+                            os.path.join(os.path.expanduser('~'), '.cache', 'yubihsm-examples', 'objects.json'))
+
+
+def _key(object_type, object_id):
+    return f'{int(object_type)}:{object_id}'
+
+
+def _to_entry(info):
+    return {
+        'id': info.id,
+        'type': int(info.object_type),
+        'sequence': info.sequence,
+        'capabilities': int(info.capabilities),
+        'size': info.size,
+        'domains': info.domains,
+        'algorithm': int(info.algorithm),
+        'origin': int(info.origin),
+        'label': info.label if isinstance(info.label, str) else info.label.hex(),
+        'delegated_capabilities': int(info.delegated_capabilities),
+    }
+
+
+def _to_info(entry):
+    return ObjectInfo(entry['capabilities'], entry['id'], entry['size'], entry['domains'],
+                      OBJECT(entry['type']), ALGORITHM(entry['algorithm']), entry['sequence'],
+                      ORIGIN(entry['origin']), entry['label'], entry['delegated_capabilities'])
+
+
+def _matches(entry, object_id=None, object_type=None, domains=None, capabilities=None, algorithm=None, label=None):
+    # Same semantics as the LIST_OBJECTS filters on the device.
+    return ((object_id is None or entry['id'] == object_id)
+            and (object_type is None or entry['type'] == object_type)
+            and (domains is None or entry['domains'] & domains)
+            and (capabilities is None or entry['capabilities'] & capabilities)
+            and (algorithm is None or entry['algorithm'] == algorithm)
+            and (label is None or entry['label'] == label))
+
+
+class ObjectIndex(object):
+
+    def __init__(self, path=None):
+        self.path = path or INDEX_FILE
+        try:
+            with open(self.path, 'r') as fd:
+                self.devices = json.load(fd)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    @property
+    def serials(self):
+        return [int(s) for s in self.devices]
+
+    def refresh(self, session, serial, **filters):
+        """Bring the index of the device up to date and return (infos, fetched).
+
+        filters are passed on to list_objects, so only matching objects are
+        listed and checked. infos are the matching objects and fetched is the
+        number of get_info round trips that were needed.
+        """
+        objects = self.devices.setdefault(str(serial), {})
+
+        listed = {}
+        fetched = 0
+        for obj in session.list_objects(**filters):
+            key = _key(obj.object_type, obj.id)
+            listed[key] = obj
+            entry = objects.get(key)
+            if entry is None or entry['sequence'] != obj._seq:
+                objects[key] = _to_entry(obj.get_info())
+                fetched += 1
+
+        # Indexed objects that match the filters but were not listed are gone.
+        for key in [k for k, e in objects.items() if k not in listed and _matches(e, **filters)]:
+            del objects[key]
+
+        self.save()
+        return self.query(serial, **filters), fetched
+
+    def query(self, serial, **filters):
+        """Return the ObjectInfo of the indexed objects matching filters.
+
+        Takes the same filters as list_objects and does not touch the HSM.
+        """
+        objects = self.devices.get(str(serial), {})
+        entries = [e for e in objects.values() if _matches(e, **filters)]
+        return [_to_info(e) for e in sorted(entries, key=lambda e: (e['id'], e['type']))]
+
+    def forget(self, serial=None):
+        """Drop the index of one device, or of all devices if no serial is given."""
+        if serial is None:
+            self.devices = {}
+        else:
+            self.devices.pop(str(serial), None)
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # Replace the index atomically so concurrent readers never see a partial file.
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.devices, f)
+        os.replace(tmp, self.path)
+
+
+def add_filter_arguments(parser, types=True):
+    if types:
+        parser.add_argument('-t', '--type', choices=[o.name.lower() for o in OBJECT], metavar='TYPE', help='Only objects of this type, e.g. asymmetric_key.')
+    parser.add_argument('-d', '--domains', type=int, help='Only objects in one or more of these domains (bitmask).')
+    parser.add_argument('-l', '--label', help='Only objects with exactly this label.')
+    parser.add_argument('--algorithm', choices=[a.name.lower() for a in ALGORITHM], metavar='NAME', help='Only objects using this algorithm, e.g. ec_p384.')
+
+
+def filters_from_args(args):
+    filters = {}
+    if getattr(args, 'type', None):
+        filters['object_type'] = OBJECT[args.type.upper()]
+    if args.domains is not None:
+        filters['domains'] = args.domains
+    if args.label is not None:
+        filters['label'] = args.label
+    if args.algorithm:
+        filters['algorithm'] = ALGORITHM[args.algorithm.upper()]
+    return filters
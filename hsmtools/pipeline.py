@@ -0,0 +1,166 @@
+"""Three stage signing pipeline.
+
+Files are hashed by a pool of threads, the digests are signed by a second
+pool talking to the HSM(s), and the signatures are written by a single
+writer thread. The stages are connected by bounded queues, so a slow stage
+holds back the ones before it and memory use stays bounded.
+
+An error in one file is recorded in failures and the pipeline goes on
+with the next. When it is aborted, because no HSM is left or a worker died,
+blocked stages give up on their queues instead of waiting forever.
+"""
+import queue
+import threading
+import time
+
+from yubihsm import exceptions
+
+_DONE = object()
+# How often a stage blocked on a queue checks whether the pipeline was aborted
+_POLL = 0.1
+
+
+class Stage(object):
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.busy += time.perf_counter() - start
+                self.items += 1
+
+    def utilization(self, elapsed):
+        """Fraction of the stage's worker time spent working."""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (elapsed * self.workers)
+
+
+class Pipeline(object):
+    def __init__(self, hash_func, sign_func, write_func, hash_workers=4, sign_workers=2, depth=64):
+        self._hash = hash_func
+        self._sign = sign_func
+        self._write = write_func
+        self.stages = [Stage('hash', hash_workers), Stage('sign', sign_workers), Stage('write', 1)]
+        self._depth = depth
+        self.signed = 0
+        self.failures = []
+        self.fatal = None
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+
+    def _fail(self, filename, error):
+        with self._lock:
+            self.failures.append((filename, error))
+
+    def _put(self, q, item):
+        # Drop the item once aborted, the stage after may be gone
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        # Once aborted an empty queue ends the stage, its _DONE may never come
+        while True:
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                if self._abort.is_set():
+                    return _DONE
+
+    def _guard(self, worker, *args):
+        try:
+            worker(*args)
+        except BaseException as e:
+            self.fatal = self.fatal or e
+            self._abort.set()
+            raise
+
+    def _hash_worker(self, files, digests):
+        stage = self.stages[0]
+        while not self._abort.is_set():
+            try:
+                filename = files.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                digest = stage.run(self._hash, filename)
+            except Exception as e:
+                self._fail(filename, e)
+                continue
+            self._put(digests, (filename, digest))
+
+    def _sign_worker(self, digests, signatures):
+        stage = self.stages[1]
+        while True:
+            item = self._get(digests)
+            if item is _DONE:
+                return
+            filename, digest = item
+            if self._abort.is_set():
+                continue
+            try:
+                signature = stage.run(self._sign, digest)
+            except exceptions.YubiHsmConnectionError as e:
+                # No HSM left to sign with, stop feeding the pipeline.
+                self.fatal = e
+                self._abort.set()
+                continue
+            except Exception as e:
+                self._fail(filename, e)
+                continue
+            self._put(signatures, (filename, signature))
+
+    def _write_worker(self, signatures):
+        stage = self.stages[2]
+        while True:
+            item = self._get(signatures)
+            if item is _DONE:
+                return
+            filename, signature = item
+            try:
+                stage.run(self._write, filename, signature)
+                self.signed += 1
+            except Exception as e:
+                self._fail(filename, e)
+
+    def run(self, filenames):
+        files = queue.Queue()
+        for filename in filenames:
+            files.put(filename)
+        digests = queue.Queue(self._depth)
+        signatures = queue.Queue(self._depth)
+
+        hash_stage, sign_stage, _ = self.stages
+        start = time.perf_counter()
+
+        hashers = [threading.Thread(target=self._guard, args=(self._hash_worker, files, digests)) for _ in range(hash_stage.workers)]
+        signers = [threading.Thread(target=self._guard, args=(self._sign_worker, digests, signatures)) for _ in range(sign_stage.workers)]
+        writer = threading.Thread(target=self._guard, args=(self._write_worker, signatures))
+        for thread in hashers + signers + [writer]:
+            thread.start()
+
+        # Shut the stages down in order once the one before has drained.
+        for thread in hashers:
+            thread.join()
+        for _ in signers:
+            self._put(digests, _DONE)
+        for thread in signers:
+            thread.join()
+        self._put(signatures, _DONE)
+        writer.join()
+
+        self.elapsed = time.perf_counter() - start
+        return self.signed
@@ -0,0 +1,123 @@
+"""Pool of HSMs holding the same (replicated) keys.
+
+Each device gets its own authenticated session. Sign calls go to the
+healthy device with the fewest outstanding requests, and a device that
+fails is taken out of rotation and retried after a cool down period.
+"""
+import threading
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import ERROR
+from yubihsm.objects import AsymmetricKey
+
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.signing import sign_digest
+
+
+class Device(object):
+    def __init__(self, url):
+        self.url = url
+        self.hsm = None
+        self.session = None
+        self.outstanding = 0
+        self.healthy = False
+        self.retry_at = 0
+        self.signatures = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Device({self.url})'
+
+
+class DevicePool(object):
+    def __init__(self, urls, authkey_id, password, cooldown=30):
+        self.devices = [Device(url) for url in urls]
+        self._authkey_id = authkey_id
+        self._password = password
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def open(self):
+        for device in self.devices:
+            try:
+                self._open(device)
+            except exceptions.YubiHsmError as e:
+                self._fail(device, e)
+        if not self.healthy():
+            raise exceptions.YubiHsmConnectionError('No HSM in the pool could be opened.')
+
+    def close(self):
+        for device in self.devices:
+            self._close(device)
+
+    def healthy(self):
+        return [d for d in self.devices if d.healthy]
+
+    def _open(self, device):
+        device.hsm = connect(device.url)
+        device.session = create_session(device.hsm, self._authkey_id, self._password)
+        device.healthy = True
+
+    def _close(self, device):
+        try:
+            if device.session:
+                device.session.close()
+        except exceptions.YubiHsmError:
+            pass
+        if device.hsm:
+            device.hsm.close()
+        device.session = device.hsm = None
+        device.healthy = False
+
+    def _fail(self, device, error):
+        print(f'WARNING: Removing {device.url} from the pool. [{error}]')
+        self._close(device)
+        device.failures += 1
+        device.retry_at = time.monotonic() + self._cooldown
+
+    def _acquire(self, exclude):
+        # Least outstanding requests first. Devices past their cool down get another chance.
+        with self._lock:
+            now = time.monotonic()
+            candidates = [d for d in self.devices if d not in exclude and (d.healthy or d.retry_at <= now)]
+            if not candidates:
+                return None
+            device = min(candidates, key=lambda d: (not d.healthy, d.outstanding))
+            device.outstanding += 1
+            return device
+
+    def sign(self, key_id, digest):
+        """Sign a digest with key_id on the least busy device, failing over to the others."""
+        tried = []
+        error = None
+        while True:
+            device = self._acquire(tried)
+            if device is None:
+                raise error or exceptions.YubiHsmConnectionError('No healthy HSM left in the pool.')
+            tried.append(device)
+            try:
+                with device.lock:
+                    if not device.healthy:
+                        self._open(device)
+                    signature = sign_digest(AsymmetricKey(device.session, key_id), digest)
+                    device.signatures += 1
+                    return signature
+            except (exceptions.YubiHsmConnectionError, exceptions.YubiHsmInvalidResponseError,
+                    exceptions.YubiHsmAuthenticationError) as e:
+                error = error or e
+                with device.lock:
+                    self._fail(device, e)
+            except exceptions.YubiHsmDeviceError as e:
+                error = e
+                if e.code in (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED):
+                    with device.lock:
+                        self._fail(device, e)
+                elif e.code != ERROR.OBJECT_NOT_FOUND:
+                    # Errors about the request itself are not the device's fault.
+                    raise
+            finally:
+                with self._lock:
+                    device.outstanding -= 1
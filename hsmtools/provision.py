@@ -0,0 +1,208 @@
+"""Provisioning of an HSM from a spec of the objects it should hold.
+
+The spec is a JSON file listing authentication keys and signing keys:
+
+    {
+      "authkeys": [
+        {"id": 2, "label": "Signer", "domains": [1],
+         "capabilities": ["sign_ecdsa", "get_pseudo_random"],
+         "delegated_capabilities": ["sign_ecdsa"],
+         "password_env": "SIGNER_PASSWORD"}
+      ],
+      "signing_keys": [
+        {"id": 2000, "label": "Release Key", "domains": [1], "algorithm": "ecp384"}
+      ]
+    }
+
+Domains are a list of domain numbers (1-16) or a bitmask, capabilities are
+CAPABILITY names in any case, or "all". Signing keys get the capability
+of their algorithm (see hsmtools.signing.KEY_SCHEMES) and, unless
+"exportable" is false, EXPORTABLE_UNDER_WRAP, plus any "capabilities"
+given. The password of an authentication key is given directly or, better,
+read from the environment variable named by "password_env".
+
+plan compares the spec with the object info of the device, as returned by
+ObjectIndex.refresh, so reading the state of a device costs one listing
+plus one round trip per object that changed since the last run. Objects
+can not be changed in place on the HSM: one that differs from the spec is
+deleted and created again, which for a signing key means a new private
+key, so that is only done when asked for. A session can only change the
+password of its own key, so another authentication key whose password
+differs is also deleted and put again. Objects on the device that are not
+in the spec are left alone.
+"""
+import json
+import os
+from collections import namedtuple
+
+from yubihsm.defs import ALGORITHM, CAPABILITY, OBJECT
+from yubihsm.exceptions import YubiHsmAuthenticationError
+from yubihsm.objects import AsymmetricKey, AuthenticationKey
+
+from hsmtools.authcache import create_session, invalidate
+from hsmtools.signing import KEY_SCHEMES, SCHEMES
+
+Desired = namedtuple('Desired', ['object_type', 'id', 'label', 'domains', 'capabilities',
+                                 'delegated_capabilities', 'algorithm', 'password'])
+
+# kind is one of ok, create, replace, conflict (differs but may not be
+# replaced) and password (only the password of an authentication key differs)
+Action = namedtuple('Action', ['kind', 'desired', 'changes'])
+
+
+def _domains(value):
+    if isinstance(value, int):
+        mask = value
+    else:
+        if not all(isinstance(d, int) and 1 <= d <= 16 for d in value):
+            raise ValueError(f'domains must be numbers from 1 to 16: {value}')
+        mask = sum(1 << (d - 1) for d in set(value))
+    if not 0 < mask <= 0xffff:
+        raise ValueError(f'invalid domains: {value}')
+    return mask
+
+
+def _capabilities(names):
+    caps = CAPABILITY.NONE
+    for name in names:
+        key = name.upper().replace('-', '_')
+        if key == 'ALL':
+            caps |= CAPABILITY.ALL
+            continue
+        if key not in CAPABILITY.__members__:
+            raise ValueError(f'unknown capability: {name}')
+        caps |= CAPABILITY[key]
+    return caps
+
+
+def _object(entry, object_type):
+    object_id = entry.get('id')
+    if not isinstance(object_id, int) or not 0 < object_id <= 0xffff:
+        raise ValueError(f'every object needs an "id" from 1 to 65535: {entry}')
+    if not isinstance(entry.get('label'), str) or len(entry['label'].encode('utf8')) > 40:
+        raise ValueError(f'object {object_id} needs a "label" of at most 40 bytes')
+    domains = _domains(entry.get('domains', 1))
+
+    if object_type == OBJECT.AUTHENTICATION_KEY:
+        password = entry.get('password')
+        if 'password_env' in entry:
+            password = os.environ.get(entry['password_env'])
+            if password is None:
+                raise ValueError(f'authentication key {object_id}: {entry["password_env"]} is not set')
+        return Desired(object_type, object_id, entry['label'], domains,
+                       _capabilities(entry.get('capabilities', [])),
+                       _capabilities(entry.get('delegated_capabilities', [])),
+                       ALGORITHM.AES128_YUBICO_AUTHENTICATION, password)
+
+    name = entry.get('algorithm', 'ecp384')
+    if name not in KEY_SCHEMES:
+        raise ValueError(f'signing key {object_id}: algorithm must be one of {", ".join(KEY_SCHEMES)}')
+    scheme = SCHEMES[name]
+    caps = scheme.capability | _capabilities(entry.get('capabilities', []))
+    if entry.get('exportable', True):
+        caps |= CAPABILITY.EXPORTABLE_UNDER_WRAP
+    return Desired(object_type, object_id, entry['label'], domains, caps, CAPABILITY.NONE, scheme.key_algorithm, None)
+
+
+def load_spec(path):
+    """Read a spec file and return the Desired objects, authentication keys first."""
+    with open(path, 'r') as fd:
+        spec = json.load(fd)
+    if not isinstance(spec, dict) or set(spec) - {'authkeys', 'signing_keys'}:
+        raise ValueError('the spec must be an object with "authkeys" and "signing_keys" lists')
+
+    wanted = [_object(e, OBJECT.AUTHENTICATION_KEY) for e in spec.get('authkeys', [])]
+    wanted += [_object(e, OBJECT.ASYMMETRIC_KEY) for e in spec.get('signing_keys', [])]
+
+    seen = set()
+    for w in wanted:
+        if (w.object_type, w.id) in seen:
+            raise ValueError(f'{w.object_type.name.lower()} {w.id} is listed twice')
+        seen.add((w.object_type, w.id))
+    return wanted
+
+
+def _diff(desired, info):
+    # Names of the attributes that differ, with the value on the device and the one wanted
+    changes = []
+    for name in ('label', 'domains', 'capabilities', 'delegated_capabilities', 'algorithm'):
+        have, want = getattr(info, name), getattr(desired, name)
+        if name in ('capabilities', 'delegated_capabilities'):
+            have, want = int(have), int(want)
+        if have != want:
+            changes.append((name, have, want))
+    return changes
+
+
+def plan(wanted, infos, replace=False, protected=()):
+    """Return one Action per Desired object, comparing it with the device's infos.
+
+    Objects that differ are replaced only with replace, and never the
+    authentication keys in protected, e.g. the key of the session itself.
+    """
+    existing = {(info.object_type, info.id): info for info in infos}
+    actions = []
+    for desired in wanted:
+        info = existing.get((desired.object_type, desired.id))
+        if info is None:
+            kind, changes = 'create', []
+        else:
+            changes = _diff(desired, info)
+            if not changes:
+                kind = 'ok'
+            elif replace and not (desired.object_type == OBJECT.AUTHENTICATION_KEY and desired.id in protected):
+                kind = 'replace'
+            else:
+                kind = 'conflict'
+        if kind in ('create', 'replace') and desired.object_type == OBJECT.AUTHENTICATION_KEY and not desired.password:
+            raise ValueError(f'authentication key {desired.id} needs a password to be created')
+        actions.append(Action(kind, desired, changes))
+    return actions
+
+
+def check_passwords(hsm, actions):
+    """Mark the up to date authentication keys whose password differs from the spec.
+
+    Opens a session with each key, which is quick for keys with cached
+    session keys; see hsmtools.authcache.
+    """
+    checked = []
+    for action in actions:
+        desired = action.desired
+        if action.kind == 'ok' and desired.object_type == OBJECT.AUTHENTICATION_KEY and desired.password:
+            try:
+                create_session(hsm, desired.id, desired.password).close()
+            except YubiHsmAuthenticationError:
+                action = action._replace(kind='password')
+        checked.append(action)
+    return checked
+
+
+def _create(session, desired):
+    if desired.object_type == OBJECT.AUTHENTICATION_KEY:
+        return AuthenticationKey.put_derived(session, desired.id, desired.label, desired.domains, desired.capabilities,
+                                             desired.delegated_capabilities, desired.password)
+    return AsymmetricKey.generate(session, desired.id, desired.label, desired.domains, desired.capabilities,
+                                  desired.algorithm)
+
+
+def apply(session, action, authkey_id):
+    """Carry out one create, replace or password action over session.
+
+    authkey_id is the key that opened session. The HSM only lets a session
+    change the password of its own key, any other key is deleted and put
+    again with the same attributes and the new password.
+    """
+    desired = action.desired
+    if action.kind == 'create':
+        _create(session, desired)
+    elif action.kind == 'replace' or (action.kind == 'password' and desired.id != authkey_id):
+        session.get_object(desired.id, desired.object_type).delete()
+        _create(session, desired)
+    elif action.kind == 'password':
+        session.get_object(desired.id, OBJECT.AUTHENTICATION_KEY).change_password(desired.password)
+    else:
+        return
+    if desired.object_type == OBJECT.AUTHENTICATION_KEY:
+        # Drop any cached session keys derived from the old password.
+        invalidate(desired.id)
@@ -0,0 +1,184 @@
+"""Public key cache and keyring bundles.
+
+Public keys are stored by content under their SHA-256 fingerprint (the
+hash of the DER SubjectPublicKeyInfo). A small reference file maps device
+serial, key ID and a hash of the object info (which includes the sequence
+number) to a fingerprint, so a key is only read from the HSM again when
+the object was re-created. Bundles put all keys in one file, either as
+concatenated PEM or as a JWKS style JSON document, so verifiers load every
+key with a single read.
+"""
+import base64
+import hashlib
+import json
+import os
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+CACHE_DIR = os.environ.get('YUBIHSM_PUBKEY_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'yubihsm-examples', 'pubkeys'))
+
+BUNDLE_FORMATS = ('pem', 'jwks')
+
+_CURVES = {
+    'secp256r1': ('P-256', 'ES256', 32),
+    'secp384r1': ('P-384', 'ES384', 48),
+    'secp521r1': ('P-521', 'ES512', 66),
+    'secp256k1': ('secp256k1', 'ES256K', 32),
+}
+
+
+def _der(public_key):
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def fingerprint(public_key):
+    return hashlib.sha256(_der(public_key)).hexdigest()
+
+
+def to_pem(public_key):
+    return public_key.public_bytes(serialization.Encoding.PEM,
+                                   serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+
+
+class PublicKeyCache(object):
+
+    def __init__(self, directory=None):
+        self.directory = directory or CACHE_DIR
+        self._refs_file = os.path.join(self.directory, 'refs.json')
+        try:
+            with open(self._refs_file, 'r') as fd:
+                self.refs = json.load(fd)
+        except (OSError, ValueError):
+            self.refs = {}
+        self._dirty = False
+
+    def _path(self, fp):
+        return os.path.join(self.directory, fp + '.der')
+
+    def get(self, key, serial, info):
+        """Return (public key, read from HSM) for key.
+
+        The key is read from the HSM only if no key with the same serial, ID
+        and object info has been cached.
+        """
+        ref = f'{serial}:{key.id}:' + hashlib.sha256(repr(tuple(info)).encode('utf8')).hexdigest()[:16]
+        fp = self.refs.get(ref)
+        if fp:
+            try:
+                with open(self._path(fp), 'rb') as fd:
+                    data = fd.read()
+                if hashlib.sha256(data).hexdigest() == fp:
+                    return serialization.load_der_public_key(data), False
+            except (OSError, ValueError):
+                pass
+
+        public_key = key.get_public_key()
+        data = _der(public_key)
+        fp = hashlib.sha256(data).hexdigest()
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        tmp = f'{self._path(fp)}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp, self._path(fp))
+
+        # Earlier versions of the same key are stale
+        prefix = f'{serial}:{key.id}:'
+        for old in [r for r in self.refs if r.startswith(prefix)]:
+            del self.refs[old]
+        self.refs[ref] = fp
+        self._dirty = True
+        return public_key, True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        tmp = f'{self._refs_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(self.refs, fd)
+        os.replace(tmp, self._refs_file)
+        self._dirty = False
+
+
+def _jwk(public_key):
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        if public_key.curve.name not in _CURVES:
+            # P-224 and the brainpool curves have no JWK name
+            raise ValueError(f'No JWK form for curve {public_key.curve.name}')
+        crv, alg, size = _CURVES[public_key.curve.name]
+        numbers = public_key.public_numbers()
+        return {'kty': 'EC', 'crv': crv, 'alg': alg,
+                'x': _b64(numbers.x.to_bytes(size, 'big')), 'y': _b64(numbers.y.to_bytes(size, 'big'))}
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        return {'kty': 'RSA', 'n': _b64(numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, 'big')),
+                'e': _b64(numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, 'big'))}
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        return {'kty': 'OKP', 'crv': 'Ed25519', 'alg': 'EdDSA', 'x': _b64(raw)}
+    raise ValueError(f'Unsupported key type {type(public_key).__name__}')
+
+
+def write_bundle(path, keys, format='pem'):
+    """Write keys, a list of (key ID, label, public key), to a single file.
+
+    Returns a list of (key ID, reason) for the keys left out of a JWKS
+    bundle because they have no JWK form.
+    """
+    skipped = []
+    if format == 'jwks':
+        entries = []
+        for key_id, label, public_key in keys:
+            try:
+                jwk = _jwk(public_key)
+            except ValueError as e:
+                skipped.append((key_id, str(e)))
+                continue
+            jwk.update({'kid': str(key_id), 'label': label, 'fingerprint': 'sha256:' + fingerprint(public_key),
+                        'spki': base64.b64encode(_der(public_key)).decode('ascii')})
+            entries.append(jwk)
+        content = json.dumps({'keys': entries}, indent=2) + '\n'
+    else:
+        # Text outside the BEGIN/END lines is ignored by PEM parsers.
+        content = ''.join(f'# kid: {key_id}\n# label: {label}\n# fingerprint: sha256:{fingerprint(public_key)}\n'
+                          f'{to_pem(public_key)}\n' for key_id, label, public_key in keys)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fd:
+        fd.write(content)
+    os.replace(tmp, path)
+    return skipped
+
+
+def load_bundle(path):
+    """Return {key ID: public key} from a bundle written by write_bundle."""
+    with open(path, 'r') as fd:
+        content = fd.read()
+
+    keys = {}
+    if content.lstrip().startswith('{'):
+        for entry in json.loads(content)['keys']:
+            keys[int(entry['kid'])] = serialization.load_der_public_key(base64.b64decode(entry['spki']))
+        return keys
+
+    kid = None
+    block = []
+    for line in content.splitlines():
+        if line.startswith('# kid:'):
+            kid = int(line.split(':', 1)[1])
+        elif line.startswith('-----BEGIN'):
+            block = [line]
+        elif line.startswith('-----END'):
+            block.append(line)
+            keys[kid] = serialization.load_pem_public_key('\n'.join(block).encode('ascii'))
+            block = []
+        elif block:
+            block.append(line)
+    return keys
@@ -0,0 +1,192 @@
+"""HTTP signing service for prehashed digests.
+
+Clients send the digest of an artifact instead of the artifact itself:
+
+    POST /sign  {"key_id": 2000, "digest": "<hex>", "hash": "sha256"}
+
+and get back {"signature": "<hex DER>", "latency_ms": ...}. The hash is
+sha256, sha384 or sha512 and must match the length of the digest. GET /metrics
+returns counters and latency in the Prometheus text format and GET
+/healthz reports whether the service can take requests.
+
+Requests are run on the HSM by a SigningAgent, one at a time over its
+session. The number of queued requests is bounded; when the queue is full
+the request is rejected with 503 so clients back off instead of piling up.
+Identical requests (same key and digest) that arrive while one is queued
+or being signed are coalesced and all get the same signature.
+"""
+import hmac
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HASHES = {'sha256': 32, 'sha384': 48, 'sha512': 64}
+# A sign request is well below this, larger bodies are rejected unread
+MAX_BODY = 4096
+
+
+class QueueFull(Exception):
+    pass
+
+
+class SigningService(object):
+
+    def __init__(self, agent, max_queue=256):
+        self.agent = agent
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.coalesced = 0
+        self.rejected = 0
+
+    def sign(self, client, key_id, digest):
+        """Sign digest with key_id and return (request, coalesced)."""
+        key = (key_id, digest)
+        with self._lock:
+            request = self._inflight.get(key)
+            coalesced = request is not None
+            if coalesced:
+                self.coalesced += 1
+            else:
+                if len(self.agent.queue) >= self.max_queue:
+                    self.rejected += 1
+                    raise QueueFull()
+                request = self.agent.submit(client, key_id, digest)
+                self._inflight[key] = request
+
+        request.done.wait()
+
+        with self._lock:
+            if self._inflight.get(key) is request:
+                del self._inflight[key]
+        return request, coalesced
+
+    def metrics(self):
+        status = self.agent.status()
+        lines = []
+
+        def metric(name, kind, help, value):
+            lines.append(f'# HELP yubihsm_signer_{name} {help}')
+            lines.append(f'# TYPE yubihsm_signer_{name} {kind}')
+            lines.append(f'yubihsm_signer_{name} {value}')
+
+        metric('requests_total', 'counter', 'Sign requests run on the HSM.', status['requests'])
+        metric('errors_total', 'counter', 'Sign requests that failed.', status['errors'])
+        metric('coalesced_total', 'counter', 'Requests answered by an identical request in flight.', self.coalesced)
+        metric('rejected_total', 'counter', 'Requests rejected because the queue was full.', self.rejected)
+        metric('reconnects_total', 'counter', 'Times the HSM session was re-established.', status['reconnects'])
+        metric('queue_depth', 'gauge', 'Requests waiting for the HSM.', status['queue_depth'])
+        metric('throughput_per_second', 'gauge', 'Signatures per second over the last 10 seconds.', status['throughput_per_s'])
+        metric('latency_p50_seconds', 'gauge', 'Median time from request to signature.', status['latency_p50_ms'] / 1000)
+        metric('latency_p99_seconds', 'gauge', '99th percentile time from request to signature.', status['latency_p99_ms'] / 1000)
+        return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code, body, content_type='application/json'):
+        data = body.encode('utf8') if isinstance(body, str) else json.dumps(body).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token is None:
+            return True
+        given = self.headers.get('Authorization', '')
+        return hmac.compare_digest(given.encode('utf8'), f'Bearer {token}'.encode('utf8'))
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, self.server.service.metrics(), 'text/plain; version=0.0.4')
+        elif self.path == '/healthz':
+            status = self.server.service.agent.status()
+            self._reply(200, {'status': 'ok', 'queue_depth': status['queue_depth']})
+        else:
+            self._reply(404, {'error': 'Not found.'})
+
+    def _reject(self, code, error):
+        # The body is left unread, so the connection can not be reused
+        self.close_connection = True
+        self._reply(code, {'error': error})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self._reject(400, 'Bad request. [Content-Length is missing or not a number.]')
+            return
+        if length < 0:
+            self._reject(400, 'Bad request. [Content-Length is negative.]')
+            return
+        if length > MAX_BODY:
+            self._reject(413, f'Request larger than {MAX_BODY} bytes.')
+            return
+        body = self.rfile.read(length)
+
+        if self.path != '/sign':
+            self._reply(404, {'error': 'Not found.'})
+            return
+        if not self._authorized():
+            self._reply(401, {'error': 'Missing or wrong token.'})
+            return
+
+        try:
+            msg = json.loads(body)
+            key_id = int(msg['key_id'])
+            digest = bytes.fromhex(msg['digest'])
+            hash_name = msg.get('hash', 'sha256')
+            if HASHES.get(hash_name) != len(digest):
+                raise ValueError(f'A {hash_name} digest must be {HASHES.get(hash_name)} bytes.')
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': f'Bad request. [{e}]'})
+            return
+
+        try:
+            request, coalesced = self.server.service.sign(self.client_address[0], key_id, digest)
+        except QueueFull:
+            self._reply(503, {'error': 'Signing queue is full, retry later.'})
+            return
+
+        if request.error:
+            self._reply(502, {'error': request.error})
+        else:
+            self._reply(200, {'signature': request.signature.hex(), 'key_id': key_id, 'hash': hash_name,
+                              'latency_ms': round(request.latency * 1000, 3), 'coalesced': coalesced})
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many build workers may connect at once
+    request_queue_size = 128
+
+    def __init__(self, service, host='127.0.0.1', port=8080, token=None):
+        ThreadingHTTPServer.__init__(self, (host, port), _Handler)
+        self.service = service
+        self.token = token
+
+
+def request(url, key_id, digest, hash_name='sha256', token=None, timeout=60):
+    """Ask the signing service at url to sign digest and return the reply."""
+    data = json.dumps({'key_id': key_id, 'digest': digest.hex(), 'hash': hash_name}).encode('utf8')
+    req = urllib.request.Request(url.rstrip('/') + '/sign', data=data, headers={'Content-Type': 'application/json'})
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        try:
+            return json.loads(e.read())
+        except ValueError:
+            return {'error': str(e)}
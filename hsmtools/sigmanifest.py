@@ -0,0 +1,150 @@
+"""Manifest of signed files for incremental signing.
+
+The manifest records, for every signed file, the size and modification
+time it had when it was hashed, its SHA-256 digest, the ID of the signing
+key and the signature. On the next run a file whose size and modification
+time are unchanged is not read again, and a file whose digest is unchanged
+is not sent to the HSM again.
+
+The manifest is a tab separated text file with one line per file:
+
+    path  size  mtime_ns  key_id  digest  signature
+
+Tabs, newlines and backslashes in a path are escaped with a backslash.
+Only the path is split off when loading; the rest of the line is kept as
+is and only parsed for the files that changed, so a million entries load
+and diff in about a second.
+"""
+import os
+import re
+import tempfile
+import time
+from collections import namedtuple
+
+HEADER = '# yubihsm-signature-manifest 1\n'
+
+Entry = namedtuple('Entry', 'size mtime key_id digest signature')
+
+_ESCAPES = {'t': '\t', 'n': '\n'}
+
+
+class ManifestError(Exception):
+    pass
+
+
+def _quote(path):
+    if '\\' in path or '\t' in path or '\n' in path:
+        return path.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+    return path
+
+
+def _unquote(path):
+    return re.sub(r'\\(.)', lambda m: _ESCAPES.get(m.group(1), m.group(1)), path)
+
+
+class SignatureManifest(object):
+
+    def __init__(self, path):
+        self.path = path
+        # path -> 'size\tmtime_ns\tkey_id\tdigest\tsignature\n'
+        self.entries = {}
+        # A file modified in the second the run started could change again
+        # after it was hashed without its mtime changing, so its stat data
+        # is not trusted next time.
+        started = time.time_ns()
+        self.racy = started - started % 10**9
+
+    def load(self):
+        """Read the manifest. A missing manifest is an empty one."""
+        try:
+            fd = open(self.path, 'r', encoding='utf8', errors='surrogateescape', newline='\n')
+        except FileNotFoundError:
+            self.entries = {}
+            return self
+        with fd:
+            if fd.readline() != HEADER:
+                raise ManifestError(f'{self.path} is not a signature manifest.')
+            try:
+                entries = dict(line.split('\t', 1) for line in fd)
+            except ValueError:
+                raise ManifestError(f'{self.path} is damaged.')
+
+        for path in [p for p in entries if '\\' in p]:
+            entries[_unquote(path)] = entries.pop(path)
+        self.entries = entries
+        return self
+
+    def get(self, path):
+        """Return the Entry recorded for path, or None."""
+        line = self.entries.get(path)
+        if line is None:
+            return None
+        try:
+            size, mtime, key_id, digest, signature = line.split('\t')
+            return Entry(int(size), int(mtime), int(key_id), bytes.fromhex(digest), bytes.fromhex(signature))
+        except ValueError:
+            raise ManifestError(f'The entry of {path} in {self.path} is damaged.')
+
+    def diff(self, files, key_id):
+        """Sort files into (unchanged, missing, stale).
+
+        unchanged files have the same stat data and key as recorded and
+        still have their .sig file. missing files are unchanged but their
+        .sig file is gone, so it can be rewritten from the manifest. stale
+        files are new or changed and must be hashed.
+        """
+        unchanged = []
+        missing = []
+        stale = []
+        entries = self.entries
+        for filename in files:
+            line = entries.get(filename)
+            if line is None:
+                stale.append(filename)
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                stale.append(filename)
+                continue
+            # Compared as text, the entry is not parsed
+            if not line.startswith(f'{st.st_size}\t{st.st_mtime_ns}\t{key_id}\t'):
+                stale.append(filename)
+            elif os.path.exists(filename + '.sig'):
+                unchanged.append(filename)
+            else:
+                missing.append(filename)
+        return unchanged, missing, stale
+
+    def signatures(self, paths, key_id):
+        """Map the recorded digests of paths to their signatures by key_id."""
+        known = {}
+        for path in paths:
+            entry = self.get(path)
+            if entry is not None and entry.key_id == key_id:
+                known[entry.digest] = entry.signature
+        return known
+
+    def record(self, filename, st, key_id, digest, signature):
+        """Record a signed file with the stat data taken before hashing."""
+        mtime = st.st_mtime_ns
+        if mtime >= self.racy:
+            mtime = 0
+        self.entries[filename] = f'{st.st_size}\t{mtime}\t{key_id}\t{digest.hex()}\t{signature.hex()}\n'
+
+    def retain(self, files):
+        """Drop the entries of files that are no longer signed."""
+        keep = set(files)
+        self.entries = {path: line for path, line in self.entries.items() if path in keep}
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.manifest-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8', errors='surrogateescape', newline='\n') as out:
+                out.write(HEADER)
+                out.writelines(f'{_quote(path)}\t{line}' for path, line in self.entries.items())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
@@ -0,0 +1,206 @@
+import fnmatch
+import functools
+import glob
+import hashlib
+import operator
+import os
+import time
+from collections import namedtuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+
+from yubihsm.defs import ALGORITHM, CAPABILITY
+from yubihsm.objects import AsymmetricKey
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+Scheme = namedtuple('Scheme', ['name', 'key_algorithm', 'capability', 'hash'])
+
+# Signature schemes by name. The EC curves are paired with the hash of the
+# same strength. ecdsa-sha256 is what sign.py always did: ECDSA over a
+# SHA-256 digest with a key on any curve. Ed25519 signs the data itself, so
+# it only takes files that fit in one HSM message.
+SCHEMES = {s.name: s for s in (
+    Scheme('ecdsa-sha256', None, CAPABILITY.SIGN_ECDSA, hashes.SHA256),
+    Scheme('ecp256', ALGORITHM.EC_P256, CAPABILITY.SIGN_ECDSA, hashes.SHA256),
+    Scheme('ecp384', ALGORITHM.EC_P384, CAPABILITY.SIGN_ECDSA, hashes.SHA384),
+    Scheme('ecp521', ALGORITHM.EC_P521, CAPABILITY.SIGN_ECDSA, hashes.SHA512),
+    Scheme('ed25519', ALGORITHM.EC_ED25519, CAPABILITY.SIGN_EDDSA, None),
+    Scheme('rsa2048-pss', ALGORITHM.RSA_2048, CAPABILITY.SIGN_PSS, hashes.SHA256),
+    Scheme('rsa3072-pss', ALGORITHM.RSA_3072, CAPABILITY.SIGN_PSS, hashes.SHA384),
+    Scheme('rsa4096-pss', ALGORITHM.RSA_4096, CAPABILITY.SIGN_PSS, hashes.SHA512),
+)}
+DEFAULT_SCHEME = 'ecdsa-sha256'
+KEY_SCHEMES = [name for name, s in SCHEMES.items() if s.key_algorithm is not None]
+# Every signing capability used by the schemes. A wrap key must delegate
+# these for keys of any scheme to keep their capability on import.
+SIGNING_CAPABILITIES = functools.reduce(operator.or_, {s.capability for s in SCHEMES.values()})
+
+_KEY_SIZES = {
+    ALGORITHM.EC_P256: 256, ALGORITHM.EC_P384: 384, ALGORITHM.EC_P521: 521,
+    ALGORITHM.RSA_2048: 2048, ALGORITHM.RSA_3072: 3072, ALGORITHM.RSA_4096: 4096,
+}
+# Largest message for ed25519: a command is at most 2047 bytes, less the
+# session header, MAC, padding and the key ID.
+EDDSA_MAX_DATA = 2026
+
+
+def hash_file(filename, chunk_size=DEFAULT_CHUNK_SIZE, algorithm=None, metrics=None):
+    """Hash a file in fixed size chunks.
+
+    Memory use is bounded by chunk_size no matter how large the file is.
+    hashlib releases the GIL while hashing, so several files can be hashed
+    in parallel from threads. Returns a tuple of (digest, size in bytes).
+    With enabled metrics the time spent reading and hashing is recorded as
+    the read and hash phases.
+    """
+    # An empty buffer would read nothing and return the digest of no data
+    if chunk_size <= 0:
+        raise ValueError(f'The chunk size must be positive, not {chunk_size}.')
+    digest = hashlib.new((algorithm or hashes.SHA256()).name)
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    size = 0
+    if metrics is not None and metrics.enabled:
+        return _hash_file_timed(filename, digest, buf, view, metrics)
+    with open(filename, 'rb', buffering=0) as fd:
+        while True:
+            n = fd.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+            size += n
+    return digest.digest(), size
+
+
+def _hash_file_timed(filename, digest, buf, view, metrics):
+    read = hashing = 0.0
+    size = 0
+    clock = time.perf_counter
+    with open(filename, 'rb', buffering=0) as fd:
+        while True:
+            t0 = clock()
+            n = fd.readinto(buf)
+            t1 = clock()
+            read += t1 - t0
+            if not n:
+                break
+            digest.update(view[:n])
+            hashing += clock() - t1
+            size += n
+    metrics.add('read', read)
+    metrics.add('hash', hashing)
+    return digest.digest(), size
+
+
+def read_message(filename, scheme, chunk_size=DEFAULT_CHUNK_SIZE, metrics=None):
+    """Return (message, size) to sign filename with scheme.
+
+    The message is the digest from hash_file, or for ed25519 the content of
+    the file, which must not be larger than EDDSA_MAX_DATA.
+    """
+    if scheme.hash is not None:
+        return hash_file(filename, chunk_size, scheme.hash(), metrics)
+    with open(filename, 'rb') as fd:
+        data = fd.read(EDDSA_MAX_DATA + 1)
+    if len(data) > EDDSA_MAX_DATA:
+        raise ValueError(f'{filename} is larger than the {EDDSA_MAX_DATA} bytes ed25519 can sign.')
+    return data, len(data)
+
+
+def sign_digest(key, digest, algorithm=None, scheme=None):
+    # Only the digest is sent to the HSM, the data never leaves the host.
+    if scheme is None or scheme.capability == CAPABILITY.SIGN_ECDSA:
+        return key.sign_ecdsa(digest, hash=Prehashed(algorithm or (scheme.hash() if scheme else hashes.SHA256())))
+    if scheme.capability == CAPABILITY.SIGN_EDDSA:
+        return key.sign_eddsa(digest)
+    return key.sign_pss(digest, scheme.hash.digest_size, hash=Prehashed(scheme.hash()), mgf_hash=scheme.hash())
+
+
+def public_key_matches(public_key, scheme):
+    """True if public_key can check signatures made with scheme."""
+    if scheme.capability == CAPABILITY.SIGN_EDDSA:
+        return isinstance(public_key, ed25519.Ed25519PublicKey)
+    if scheme.capability == CAPABILITY.SIGN_PSS:
+        return isinstance(public_key, rsa.RSAPublicKey) and public_key.key_size == _KEY_SIZES[scheme.key_algorithm]
+    if not isinstance(public_key, ec.EllipticCurvePublicKey):
+        return False
+    return scheme.key_algorithm is None or public_key.curve.key_size == _KEY_SIZES[scheme.key_algorithm]
+
+
+def verify_message(public_key, scheme, signature, message):
+    """Check signature over a message from read_message, raises InvalidSignature."""
+    if scheme.capability == CAPABILITY.SIGN_EDDSA:
+        public_key.verify(signature, message)
+    elif scheme.capability == CAPABILITY.SIGN_PSS:
+        public_key.verify(signature, message, padding.PSS(padding.MGF1(scheme.hash()), scheme.hash.digest_size),
+                          Prehashed(scheme.hash()))
+    else:
+        public_key.verify(signature, message, ec.ECDSA(Prehashed(scheme.hash())))
+
+
+def write_signature(filename, signature):
+    with open(filename + '.sig', 'wb') as fd:
+        fd.write(signature)
+
+
+def collect_files(source, manifest=False):
+    """Return the list of files to sign.
+
+    source is either a manifest file (one path per line relative to the
+    manifest, blank lines and lines starting with # are ignored), a
+    directory which is walked
+    recursively, or a glob pattern. Existing .sig files are skipped.
+    """
+    if manifest:
+        base = os.path.dirname(source)
+        with open(source, 'r') as fd:
+            lines = [line.strip() for line in fd]
+        files = [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+    elif os.path.isdir(source):
+        files = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                files.append(os.path.join(root, name))
+    else:
+        files = [f for f in sorted(glob.glob(source, recursive=True)) if os.path.isfile(f)]
+
+    return [f for f in files if not fnmatch.fnmatch(f, '*.sig')]
+
+
+def benchmark(session, scheme, count, domains=1, message_size=32):
+    """Measure signatures per second of scheme with a temporary key.
+
+    A key is generated, used for count signatures of random digests (or
+    random messages of message_size bytes for ed25519) and deleted again.
+    Returns a dict with the key generation time, the signing rate and the
+    p50 and p99 latency of one signature.
+    """
+    start = time.perf_counter()
+    key = AsymmetricKey.generate(session, 0, f'benchmark {scheme.name}', domains, scheme.capability, scheme.key_algorithm)
+    generated = time.perf_counter() - start
+    try:
+        size = scheme.hash.digest_size if scheme.hash is not None else message_size
+        messages = [os.urandom(size) for _ in range(count + 1)]
+        # The first signature is not counted
+        sign_digest(key, messages.pop(), scheme=scheme)
+        latencies = []
+        start = time.perf_counter()
+        for message in messages:
+            t = time.perf_counter()
+            sign_digest(key, message, scheme=scheme)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    finally:
+        key.delete()
+
+    latencies.sort()
+    return {
+        'keygen_ms': round(generated * 1000, 1),
+        'signatures_per_second': round(count / elapsed, 2),
+        'p50_ms': round(latencies[count // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3),
+    }
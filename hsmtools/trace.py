@@ -0,0 +1,200 @@
+"""Trace of the messages sent to the HSM.
+
+With --trace FILE or the YUBIHSM_TRACE environment variable set, every
+connection made by hsmtools.connection.connect writes one JSON line per
+message to FILE:
+
+    {"t": 0.0123, "cmd": "SESSION_MESSAGE", "inner": "SIGN_ECDSA",
+     "request_bytes": 83, "response_bytes": 131,
+     "inner_request_bytes": 50, "inner_response_bytes": 104, "ms": 81.2}
+
+t is the time since the trace started and ms the round trip of the
+message. Commands inside a secure session are named by their inner
+command, and errors the HSM returned by their ERROR name in "error". Only
+command names, sizes and times are written, never the content of a
+message, so keys, passwords, session challenges and the data being signed
+do not end up in the trace. Several processes may append to the same
+file; each starts with a header line naming the program.
+
+A trace can be replayed: ReplayLatency gives the software stand-in the
+recorded round trip of every command, see utils/hsm_emulator.py --replay,
+so a workload run against the stand-in spends the same time waiting for
+the HSM as the original did and only the host side differs.
+"""
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from yubihsm.defs import COMMAND, ERROR
+from yubihsm.exceptions import YubiHsmDeviceError
+
+_local = threading.local()
+
+
+def _name(enum, value):
+    try:
+        return enum(value).name
+    except ValueError:
+        return f'0x{value:02x}'
+
+
+class Tracer(object):
+    """Appends message records to a trace file, shared by all threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._fd = open(path, 'a')
+        self._write({'trace': 1, 'tool': os.path.basename(sys.argv[0]) or 'python',
+                     'pid': os.getpid(), 'started': round(time.time(), 3)})
+        atexit.register(self.close)
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._fd is not None:
+                self._fd.write(line)
+
+    def record(self, record, start):
+        record['t'] = round(start - self._start, 6)
+        self._write(record)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+
+class TracingBackend(object):
+    """yubihsm backend that traces each message before passing it on."""
+
+    def __init__(self, backend, tracer):
+        self._backend = backend
+        self._tracer = tracer
+
+    def transceive(self, msg):
+        start = time.perf_counter()
+        try:
+            resp = self._backend.transceive(msg)
+        except Exception as e:
+            self._done(msg, start, None, e.__class__.__name__)
+            raise
+        error = _name(ERROR, resp[3]) if resp[0] == COMMAND.ERROR and len(resp) > 3 else None
+        self._done(msg, start, resp, error)
+        return resp
+
+    def _done(self, msg, start, resp, error):
+        record = {
+            'cmd': _name(COMMAND, msg[0]),
+            'request_bytes': len(msg),
+            'response_bytes': len(resp) if resp is not None else 0,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+        if error:
+            record['error'] = error
+        pending = getattr(_local, 'pending', None)
+        if msg[0] == COMMAND.SESSION_MESSAGE and pending is not None:
+            # Written by the session once the inner response is known
+            pending['message'] = (record, start)
+        else:
+            self._tracer.record(record, start)
+
+    def close(self):
+        self._backend.close()
+
+    def __repr__(self):
+        return repr(self._backend)
+
+
+def instrument(hsm, tracer):
+    """Trace every message sent to hsm and name the commands its sessions send. Returns hsm."""
+    hsm._backend = TracingBackend(hsm._backend, tracer)
+    create_session = hsm.create_session
+
+    def traced_session(*args, **kwargs):
+        session = create_session(*args, **kwargs)
+        send_secure_cmd = session.send_secure_cmd
+
+        def traced_send(cmd, data=b''):
+            pending = _local.pending = {'inner': _name(COMMAND, cmd), 'inner_request_bytes': len(data)}
+            try:
+                resp = send_secure_cmd(cmd, data)
+                pending['inner_response_bytes'] = len(resp)
+                return resp
+            except YubiHsmDeviceError as e:
+                pending['error'] = e.code.name if isinstance(e.code, ERROR) else str(e.code)
+                raise
+            finally:
+                _local.pending = None
+                if 'message' in pending:
+                    record, start = pending.pop('message')
+                    record.update(pending)
+                    tracer.record(record, start)
+
+        session.send_secure_cmd = traced_send
+        return session
+
+    hsm.create_session = traced_session
+    return hsm
+
+
+def load_runs(path):
+    """Return a list of (header, records) for each program that wrote to the trace."""
+    runs = []
+    with open(path, 'r') as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'cmd' not in record:
+                runs.append((record, []))
+            elif runs:
+                runs[-1][1].append(record)
+    return runs
+
+
+def load(path):
+    """Return the message records of a trace file, without the header lines."""
+    return [r for _, records in load_runs(path) for r in records]
+
+
+def command_of(record):
+    """The command a record is replayed as: the inner command of session messages."""
+    return record.get('inner') or record['cmd']
+
+
+class ReplayLatency(object):
+    """Latency model for SoftwareHsm that repeats the round trips of a trace.
+
+    Each command gets the latencies recorded for it, in the recorded order,
+    starting over when they run out. Commands missing from the trace get
+    the 'default' of overrides, and overrides replace the trace for the
+    commands they name.
+    """
+
+    def __init__(self, records, overrides=None):
+        recorded = collections.defaultdict(list)
+        for record in records:
+            if 'error' not in record:
+                recorded[command_of(record)].append(record['ms'] / 1000)
+        self._recorded = {COMMAND[name]: times for name, times in recorded.items() if name in COMMAND.__members__}
+        self._next = collections.Counter()
+        self._overrides = dict(overrides or {})
+        self._lock = threading.Lock()
+
+    def get(self, cmd, default=None):
+        if cmd in self._overrides:
+            return self._overrides[cmd]
+        times = self._recorded.get(cmd)
+        if not times:
+            return default
+        with self._lock:
+            i = self._next[cmd]
+            self._next[cmd] = i + 1
+        return times[i % len(times)]
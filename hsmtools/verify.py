@@ -0,0 +1,48 @@
+"""Offline verification of .sig files, run in worker processes.
+
+Each worker loads the public keys once and then hashes and verifies whole
+files, so both the hashing and the signature checks spread over all cores.
+"""
+from cryptography.exceptions import InvalidSignature
+
+from hsmtools.pubkeys import load_bundle
+from hsmtools.signing import DEFAULT_SCHEME, SCHEMES, public_key_matches, read_message, verify_message
+
+_keys = None
+_chunk_size = None
+_scheme = None
+
+
+def init_worker(public_key_path, key_id, chunk_size, scheme=DEFAULT_SCHEME):
+    global _keys, _chunk_size, _scheme
+    _scheme = SCHEMES[scheme]
+    keys = load_bundle(public_key_path)
+    if key_id is not None:
+        keys = {key_id: keys[key_id]}
+    _keys = [(kid, key) for kid, key in keys.items() if public_key_matches(key, _scheme)]
+    _chunk_size = chunk_size
+
+
+def verify_file(filename):
+    """Return (filename, ok, detail) where detail is the ID of the key that
+    made the signature, or the reason the file failed."""
+    try:
+        with open(filename + '.sig', 'rb') as fd:
+            signature = fd.read()
+    except OSError:
+        return filename, False, 'no signature'
+
+    try:
+        message, _ = read_message(filename, _scheme, _chunk_size)
+    except OSError as e:
+        return filename, False, f'read error [{e}]'
+    except ValueError as e:
+        return filename, False, str(e)
+
+    for kid, key in _keys:
+        try:
+            verify_message(key, _scheme, signature, message)
+            return filename, True, kid
+        except InvalidSignature:
+            continue
+    return filename, False, 'bad signature'
@@ -2,53 +2,126 @@
 import argparse
 import sys 
 import os
+import time
 
-from yubihsm import YubiHsm
+from yubihsm.defs import CAPABILITY
 from yubihsm.objects import AsymmetricKey
 from yubihsm import exceptions
 
+from hsmtools import agent, connection as hsm_connection, metrics as hsm_metrics, service
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.signing import DEFAULT_SCHEME, SCHEMES, read_message, sign_digest, write_signature
+
 parser = argparse.ArgumentParser(
                     prog='sign',
                     description='Create a signature of a file')
 
 parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('-c', '--chunk-size', default=4, type=int, help='Size in MiB of the chunks used to hash the file. (Default: 4)')
+parser.add_argument('-A', '--algorithm', default=DEFAULT_SCHEME, choices=SCHEMES, help=f'Signature algorithm, must match the key: ecdsa-sha256 with any EC key, ecp256/ecp384/ecp521 with the matching hash, ed25519 for files up to 2026 bytes, or rsa<bits>-pss. (Default: {DEFAULT_SCHEME})')
+parser.add_argument('-a', '--agent', help='Path of a running sign_agent.py socket. The agent is used instead of opening a new HSM session.')
+parser.add_argument('-S', '--service', help='URL of a running sign_service.py. Only the digest is sent to the service.')
+parser.add_argument('--token-file', help='File holding the token for --service.')
 parser.add_argument('id', type=int, help='ID of signing key to use.')
 parser.add_argument('filename', help='File to sign.')
-parser.add_argument('password', help='Authentication key password used to unlock the signing key on the HSM')
+parser.add_argument('password', nargs='?', help='Authentication key password used to unlock the signing key on the HSM. Not needed with --agent or --service.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+
+if args.password is None and args.agent is None and args.service is None:
+    parser.error('the following arguments are required: password')
+if args.chunk_size < 1:
+    parser.error('argument -c/--chunk-size: must be at least 1')
+
+scheme = SCHEMES[args.algorithm]
+if (args.agent or args.service) and scheme.capability != CAPABILITY.SIGN_ECDSA:
+    parser.error(f'--agent and --service only create ECDSA signatures, not {args.algorithm}')
 
+metrics = hsm_metrics.from_args('sign', args)
 
 if not os.path.isfile(args.filename):
     print('Error: File not found.')
     sys.exit(-1)
     
-# Read in the file
-with open(args.filename, 'rb') as fd:
-    data = fd.read()
+# Hash the file in fixed size chunks so memory use does not grow with the file size.
+# Only the digest is sent to the HSM, except for ed25519 which signs the data itself.
+start = time.perf_counter()
+try:
+    file_hash, size = read_message(args.filename, scheme, args.chunk_size * 1024 * 1024, metrics=metrics)
+except ValueError as e:
+    print(f'ERROR: [{e}]')
+    sys.exit(-1)
+elapsed = time.perf_counter() - start
+
+mib = size / (1024 * 1024)
+print(f'Hashed {mib:.1f} MiB in {elapsed:.2f}s ({mib / elapsed if elapsed > 0 else 0:.1f} MiB/s)')
+
+# Ask the signing agent, which already holds an open session
+if args.agent:
+    try:
+        with metrics.phase('agent'):
+            reply = agent.request(args.agent, {'op': 'sign', 'key_id': args.id, 'digest': file_hash.hex()})
+    except OSError as e:
+        print(f'ERROR: Failed to connect to the signing agent. [{e}]')
+        sys.exit(-2)
+    if reply['status'] != 'ok':
+        print(f'ERROR: Signing failed. [{reply["error"]}]')
+        sys.exit(-3)
+
+    with metrics.phase('write'):
+        write_signature(args.filename, bytes.fromhex(reply['signature']))
+    sys.exit(0)
+
+# Ask the signing service, the file never leaves this host
+if args.service:
+    token = None
+    try:
+        if args.token_file:
+            with open(args.token_file, 'r') as fd:
+                token = fd.read().strip()
+        with metrics.phase('service'):
+            reply = service.request(args.service, args.id, file_hash, scheme.hash.name, token=token)
+    except OSError as e:
+        print(f'ERROR: Failed to connect to the signing service. [{e}]')
+        sys.exit(-2)
+    if 'signature' not in reply:
+        print(f'ERROR: Signing failed. [{reply["error"]}]')
+        sys.exit(-3)
+
+    with metrics.phase('write'):
+        write_signature(args.filename, bytes.fromhex(reply['signature']))
+    sys.exit(0)
 
-# Connect to the HSM via the USB connector
+# Connect to the HSM (USB unless YUBIHSM_CONNECTOR says otherwise)
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey, args.password)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey, args.password)
 
     key = AsymmetricKey(session, args.id)
 
-    # Create signature of the data
-    signature = key.sign_ecdsa(data)
+    # Create signature of the digest of the data
+    with metrics.phase('sign'):
+        signature = sign_digest(key, file_hash, scheme=scheme)
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Signing failed. [{e}]')
     sys.exit(-3)
 
 # Write the signature to a file
-with open(args.filename + '.sig', 'wb') as fd:
-    fd.write(signature)
+with metrics.phase('write'):
+    write_signature(args.filename, signature)
 
 sys.exit(0)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+from yubihsm import exceptions
+
+from hsmtools import agent
+from hsmtools import connection as hsm_connection
+from hsmtools.connection import connect
+
+parser = argparse.ArgumentParser(
+                    prog='sign_agent',
+                    description='Keep an HSM session open and serve sign requests over a Unix domain socket')
+
+parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('-s', '--socket', default='./sign_agent.sock', help='Path of the Unix domain socket. (Default: ./sign_agent.sock)')
+parser.add_argument('--keepalive', default=15, type=int, help='Seconds of idle time before a keepalive is sent to the HSM. (Default: 15)')
+parser.add_argument('--report', default=60, type=int, help='Seconds between queue and latency reports, 0 to disable. (Default: 60)')
+parser.add_argument('--status', action='store_true', help='Print the status of a running agent and exit.')
+parser.add_argument('password', nargs='?', help='Authentication key password used to unlock the signing keys on the HSM')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+if args.status:
+    try:
+        print(json.dumps(agent.request(args.socket, {'op': 'stats'}), indent=2))
+    except OSError as e:
+        print(f'ERROR: Failed to connect to the agent. [{e}]')
+        sys.exit(-2)
+    sys.exit(0)
+
+if args.password is None:
+    parser.error('the following arguments are required: password')
+
+signer = agent.SigningAgent(connect, args.authkey, args.password, args.keepalive)
+
+try:
+    signer.start()
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+
+server = agent.AgentServer(args.socket, signer)
+stopped = threading.Event()
+
+
+def report():
+    while not stopped.wait(args.report):
+        print(json.dumps(signer.status()), flush=True)
+
+
+def shutdown(signum, frame):
+    # shutdown() blocks until serve_forever returns, so it must run on another thread.
+    threading.Thread(target=server.shutdown).start()
+
+
+signal.signal(signal.SIGTERM, shutdown)
+signal.signal(signal.SIGINT, shutdown)
+
+if args.report > 0:
+    threading.Thread(target=report, daemon=True).start()
+
+print(f'Signing agent listening on {args.socket}', flush=True)
+server.serve_forever()
+
+# Clean up:
+stopped.set()
+server.server_close()
+signer.stop()
+os.remove(args.socket)
+
+sys.exit(0)
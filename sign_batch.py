@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+from yubihsm import exceptions
+
+from hsmtools import connection as hsm_connection
+from hsmtools.connection import discover_usb
+from hsmtools.pipeline import Pipeline
+from hsmtools.pool import DevicePool
+from hsmtools.sigmanifest import ManifestError, SignatureManifest
+from hsmtools.signing import collect_files, hash_file, write_signature
+
+parser = argparse.ArgumentParser(
+                    prog='sign_batch',
+                    description='Create signatures for many files over a single HSM session')
+
+parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('-c', '--chunk-size', default=4, type=int, help='Size in MiB of the chunks used to hash each file. (Default: 4)')
+parser.add_argument('-m', '--manifest', action='store_true', help='Treat source as a manifest file listing one file per line.')
+parser.add_argument('-D', '--device', action='append', help='Connector URL of an HSM to use, e.g. yhusb://serial=123. Repeat to spread the signing over several HSMs holding the same key.')
+parser.add_argument('--hash-workers', default=os.cpu_count() or 1, type=int, help='Number of threads hashing files. (Default: number of CPUs)')
+parser.add_argument('--queue-depth', default=64, type=int, help='Maximum number of digests and signatures waiting between stages. (Default: 64)')
+parser.add_argument('-i', '--incremental', metavar='FILE', help='Keep a manifest of signed files in FILE and only sign files that changed since the last run.')
+parser.add_argument('--discover', action='store_true', help='Use every YubiHSM attached over USB.')
+parser.add_argument('id', type=int, help='ID of signing key to use.')
+parser.add_argument('source', help='Directory, glob pattern (quote it) or manifest file of the files to sign.')
+parser.add_argument('password', help='Authentication key password used to unlock the signing key on the HSM')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+if args.chunk_size < 1:
+    parser.error('argument -c/--chunk-size: must be at least 1')
+
+try:
+    files = collect_files(args.source, args.manifest)
+except OSError as e:
+    print(f'ERROR: Failed to read manifest. [{e}]')
+    sys.exit(-1)
+
+if not files:
+    print('Error: No files found.')
+    sys.exit(-1)
+
+total = len(files)
+manifest = None
+known = {}
+if args.incremental:
+    try:
+        manifest = SignatureManifest(args.incremental).load()
+    except (OSError, ManifestError) as e:
+        print(f'ERROR: Failed to read signature manifest. [{e}]')
+        sys.exit(-1)
+
+    unchanged, missing, files = manifest.diff(files, args.id)
+    # A changed file whose content is the same as before, or a file that
+    # was moved, gets its old signature back without asking the HSM.
+    known = manifest.signatures(set(manifest.entries).difference(unchanged, missing), args.id)
+    manifest.retain(unchanged + missing + files)
+    for filename in missing:
+        write_signature(filename, manifest.get(filename).signature)
+    print(f'{len(unchanged)} files unchanged, {len(missing)} signatures restored from the manifest.')
+
+    if not files:
+        manifest.save()
+        print(f'Nothing to sign, all {total} files are up to date.')
+        sys.exit(0)
+
+print(f'Signing {len(files)} files.')
+
+devices = args.device or [None]
+if args.discover:
+    devices = discover_usb()
+    print(f'Found {len(devices)} HSMs.')
+
+chunk_size = args.chunk_size * 1024 * 1024
+hashed = {}
+reused = []
+
+
+def hash_stat(filename):
+    # The stat data is taken before hashing, so a file changed while it is
+    # read is hashed again on the next run.
+    st = os.stat(filename)
+    digest = hash_file(filename, chunk_size)[0]
+    if manifest is not None:
+        hashed[filename] = (st, digest)
+    return digest
+
+
+def sign(digest):
+    signature = known.get(digest)
+    if signature is not None:
+        reused.append(digest)
+        return signature
+    return pool.sign(args.id, digest)
+
+
+def write(filename, signature):
+    write_signature(filename, signature)
+    if manifest is not None:
+        st, digest = hashed.pop(filename)
+        manifest.record(filename, st, args.id, digest, signature)
+
+
+# Open one session per HSM
+pipeline = None
+try:
+    pool = DevicePool(devices, args.authkey, args.password)
+    pool.open()
+
+    # Hashing, signing and writing run as separate stages so the HSM is kept
+    # busy while the host hashes the next files. Two signing requests are
+    # kept in flight per HSM so no device waits on the host.
+    pipeline = Pipeline(hash_stat,
+                        sign,
+                        write,
+                        hash_workers=args.hash_workers,
+                        sign_workers=len(devices) * 2,
+                        depth=args.queue_depth)
+    signed = pipeline.run(files)
+
+    # A bad file is reported and skipped, it does not abort the run.
+    failures = pipeline.failures
+    for filename, error in failures:
+        print(f'FAILED: {filename} [{error}]')
+
+    if pipeline.fatal:
+        raise pipeline.fatal
+
+    if len(devices) > 1:
+        for device in pool.devices:
+            print(f'{device.url}: {device.signatures} signatures, {device.failures} failures')
+
+    # Clean up:
+    pool.close()
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Signing failed. [{e}]')
+    sys.exit(-3)
+finally:
+    # Keep what was signed even if the run did not finish
+    if manifest is not None:
+        for filename, _ in (pipeline.failures if pipeline else ()):
+            manifest.entries.pop(filename, None)
+        manifest.save()
+
+elapsed = pipeline.elapsed
+rate = signed / elapsed if elapsed > 0 else 0
+
+print(f'Signed {signed} of {len(files)} files in {elapsed:.2f}s ({rate:.1f} files/s). Failures: {len(failures)}')
+if manifest is not None:
+    print(f'{len(reused)} signatures reused for unchanged content, {signed - len(reused)} made by the HSM. {total} files in the manifest.')
+
+# The stage closest to 100% is the bottleneck.
+for stage in pipeline.stages:
+    print(f'  {stage.name:<6} {stage.workers:>3} workers {stage.utilization(elapsed):>6.1%} busy')
+
+if failures:
+    sys.exit(-5)
+
+sys.exit(0)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from yubihsm import exceptions
+from yubihsm.objects import AsymmetricKey
+
+from hsmtools import connection as hsm_connection
+from hsmtools import merkle
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.signing import collect_files, hash_file, sign_digest
+
+parser = argparse.ArgumentParser(
+                    prog='sign_merkle',
+                    description='Sign many files with a single HSM operation by signing the root of a Merkle tree over their digests')
+
+parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('-c', '--chunk-size', default=4, type=int, help='Size in MiB of the chunks used to hash each file. (Default: 4)')
+parser.add_argument('-m', '--manifest', action='store_true', help='Treat source as a manifest file listing one file per line.')
+parser.add_argument('-o', '--output', default='./merkle_root.json', help='File to write the signed root to. (Default: ./merkle_root.json)')
+parser.add_argument('--hash-workers', default=os.cpu_count() or 1, type=int, help='Number of threads hashing files. (Default: number of CPUs)')
+parser.add_argument('id', type=int, help='ID of signing key to use.')
+parser.add_argument('source', help='Directory, glob pattern (quote it) or manifest file of the files to sign.')
+parser.add_argument('password', help='Authentication key password used to unlock the signing key on the HSM')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+try:
+    files = collect_files(args.source, args.manifest)
+except OSError as e:
+    print(f'ERROR: Failed to read manifest. [{e}]')
+    sys.exit(-1)
+
+files = [f for f in files if not f.endswith('.proof')]
+if not files:
+    print('Error: No files found.')
+    sys.exit(-1)
+
+# Paths in the tree are relative to the directory or manifest they came from.
+if args.manifest:
+    base = os.path.dirname(args.source)
+elif os.path.isdir(args.source):
+    base = args.source
+else:
+    base = '.'
+paths = [os.path.relpath(f, base).replace(os.sep, '/') for f in files]
+
+start = time.perf_counter()
+try:
+    with ThreadPoolExecutor(max_workers=args.hash_workers) as executor:
+        digests = list(executor.map(lambda f: hash_file(f, args.chunk_size * 1024 * 1024)[0], files))
+except OSError as e:
+    print(f'ERROR: Failed to hash file. [{e}]')
+    sys.exit(-1)
+
+root, proofs = merkle.build([merkle.leaf_hash(p, d) for p, d in zip(paths, digests)])
+print(f'Hashed {len(files)} files in {time.perf_counter() - start:.2f}s. Root: {root.hex()}')
+
+# Connect to the HSM and sign only the root
+try:
+    hsm = connect()
+    session = create_session(hsm, args.authkey, args.password)
+
+    key = AsymmetricKey(session, args.id)
+
+    signature = sign_digest(key, root)
+
+    # Clean up:
+    session.close()
+    hsm.close()
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Signing failed. [{e}]')
+    sys.exit(-3)
+
+signed_root = {
+    'version': 1,
+    'hash': 'sha256',
+    'key_id': args.id,
+    'root': root.hex(),
+    'signature': signature.hex(),
+}
+
+with open(args.output, 'w') as fd:
+    json.dump(dict(signed_root, files=len(files)), fd, indent=2)
+
+# Each proof carries the signed root, so a single file can be verified on its own.
+for filename, path, digest, proof in zip(files, paths, digests, proofs):
+    with open(filename + '.proof', 'w') as fd:
+        json.dump(dict(signed_root, path=path, digest=digest.hex(),
+                       proof=[[side, sibling.hex()] for side, sibling in proof]), fd)
+
+print(f'Signed root written to {args.output}, {len(files)} proofs written in {time.perf_counter() - start:.2f}s.')
+
+sys.exit(0)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import argparse
+import json
+import signal
+import sys
+import threading
+
+from yubihsm import exceptions
+
+from hsmtools import agent
+from hsmtools import connection as hsm_connection
+from hsmtools.connection import connect
+from hsmtools.service import ServiceServer, SigningService
+
+parser = argparse.ArgumentParser(
+                    prog='sign_service',
+                    description='Serve signatures of prehashed SHA-256 or SHA-384 digests over HTTP')
+
+parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. (Default: 1)')
+parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. (Default: 127.0.0.1)')
+parser.add_argument('--port', default=8080, type=int, help='Port to listen on. (Default: 8080)')
+parser.add_argument('--max-queue', default=256, type=int, help='Requests that may wait for the HSM before new ones are rejected. (Default: 256)')
+parser.add_argument('--token-file', help='File holding a token clients must send as "Authorization: Bearer <token>".')
+parser.add_argument('--keepalive', default=15, type=int, help='Seconds of idle time before a keepalive is sent to the HSM. (Default: 15)')
+parser.add_argument('--report', default=60, type=int, help='Seconds between throughput and latency reports, 0 to disable. (Default: 60)')
+parser.add_argument('password', help='Authentication key password used to unlock the signing keys on the HSM')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+token = None
+if args.token_file:
+    try:
+        with open(args.token_file, 'r') as fd:
+            token = fd.read().strip()
+    except OSError as e:
+        print(f'ERROR: Failed to read token file. [{e}]')
+        sys.exit(-1)
+
+signer = agent.SigningAgent(connect, args.authkey, args.password, args.keepalive)
+
+try:
+    signer.start()
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+
+service = SigningService(signer, args.max_queue)
+server = ServiceServer(service, args.host, args.port, token)
+stopped = threading.Event()
+
+
+def report():
+    while not stopped.wait(args.report):
+        print(json.dumps(dict(signer.status(), coalesced=service.coalesced, rejected=service.rejected)), flush=True)
+
+
+def shutdown(signum, frame):
+    # shutdown() blocks until serve_forever returns, so it must run on another thread.
+    threading.Thread(target=server.shutdown).start()
+
+
+signal.signal(signal.SIGTERM, shutdown)
+signal.signal(signal.SIGINT, shutdown)
+
+if args.report > 0:
+    threading.Thread(target=report, daemon=True).start()
+
+host, port = server.server_address[:2]
+print(f'Signing service listening on http://{host}:{port}', flush=True)
+server.serve_forever()
+
+# Clean up:
+stopped.set()
+server.server_close()
+signer.stop()
+
+sys.exit(0)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import CAPABILITY, ALGORITHM, OBJECT
+from yubihsm.objects import AsymmetricKey
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect, discover_usb
+from hsmtools.objindex import ObjectIndex
+from hsmtools.pubkeys import fingerprint, to_pem
+
+parser = argparse.ArgumentParser(
+                    prog='bulk_create_signing_keys',
+                    description='Create many ecp384 signing keys, spread over one or more HSMs.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
+parser.add_argument('-n', '--count', type=int, help='Number of keys to create, labelled <prefix><n>.')
+parser.add_argument('--prefix', default='key-', help='Label prefix used with --count. (Default: key-)')
+parser.add_argument('-s', '--spec', help='File with one key per line as: label[,domains[,id]]. Lines starting with # are ignored.')
+parser.add_argument('-d', '--domain', default=1, type=int, help='Domains of keys that do not set their own. (Default: 1)')
+parser.add_argument('-o', '--output', default='./keys', help='Directory for the public keys and index.json. (Default: ./keys)')
+parser.add_argument('-D', '--device', action='append', help='Connector URL of an HSM to use, e.g. yhusb://serial=123. Repeat to spread the keys over several HSMs.')
+parser.add_argument('--discover', action='store_true', help='Use every YubiHSM attached over USB.')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+if (args.count is None) == (args.spec is None):
+    parser.error('give either --count or --spec')
+
+
+def read_spec(path):
+    specs = []
+    with open(path, 'r') as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [f.strip() for f in line.split(',')]
+            specs.append({
+                'label': fields[0],
+                'domains': int(fields[1]) if len(fields) > 1 and fields[1] else args.domain,
+                'id': int(fields[2], 0) if len(fields) > 2 and fields[2] else 0,
+            })
+    return specs
+
+
+try:
+    if args.spec:
+        specs = read_spec(args.spec)
+    else:
+        specs = [{'label': f'{args.prefix}{i}', 'domains': args.domain, 'id': 0} for i in range(1, args.count + 1)]
+except (OSError, ValueError) as e:
+    print(f'ERROR: Failed to read spec. [{e}]')
+    sys.exit(-1)
+
+# The index is rewritten after every key, so an interrupted run resumes
+# where it stopped. Labels identify keys across runs.
+os.makedirs(args.output, exist_ok=True)
+index_file = os.path.join(args.output, 'index.json')
+try:
+    with open(index_file, 'r') as fd:
+        index = json.load(fd)
+except OSError:
+    index = {'keys': []}
+except ValueError as e:
+    print(f'ERROR: {index_file} is damaged. [{e}]')
+    sys.exit(-1)
+
+done = {entry['label'] for entry in index['keys']}
+pending = [spec for spec in specs if spec['label'] not in done]
+print(f'{len(specs)} keys requested, {len(specs) - len(pending)} already created, {len(pending)} to go.')
+
+devices = args.device or [None]
+if args.discover:
+    devices = discover_usb()
+    print(f'Found {len(devices)} HSMs.')
+
+lock = threading.Lock()
+work = queue.Queue()
+for spec in pending:
+    work.put(spec)
+failures = []
+start = time.monotonic()
+created = 0
+
+
+def record(spec, key, serial, url):
+    global created
+    pub_key = key.get_public_key()
+    filename = f'public_key_{key.id}_{serial}.pem'
+    with open(os.path.join(args.output, filename), 'w') as fd:
+        fd.write(to_pem(pub_key))
+
+    with lock:
+        index['keys'].append({
+            'label': spec['label'],
+            'id': key.id,
+            'domains': spec['domains'],
+            'serial': serial,
+            'device': url,
+            'fingerprint': 'sha256:' + fingerprint(pub_key),
+            'public_key': filename,
+        })
+        tmp = f'{index_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(index, fd, indent=2)
+        os.replace(tmp, index_file)
+
+        created += 1
+        elapsed = time.monotonic() - start
+        rate = created / elapsed
+        eta = (len(pending) - created) / rate if rate else 0
+        print(f'[{len(done) + created}/{len(specs)}] {spec["label"]}: key {key.id} on HSM {serial} '
+              f'({rate:.2f} keys/s, ETA {int(eta // 60)}m{int(eta % 60):02d}s)')
+
+
+KEY_CAPABILITIES = CAPABILITY.SIGN_ECDSA | CAPABILITY.EXPORTABLE_UNDER_WRAP
+
+
+def matches(spec, info):
+    # Only a key this tool would have created for the spec is adopted
+    return ((not spec['id'] or info.id == spec['id'])
+            and info.domains == spec['domains']
+            and info.algorithm == ALGORITHM.EC_P384
+            and info.capabilities == KEY_CAPABILITIES)
+
+
+def worker(url):
+    try:
+        hsm = connect(url)
+        serial = hsm.get_device_info().serial
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+    except exceptions.YubiHsmError as e:
+        print(f'WARNING: Not using HSM {url or "default"}. [{e}]')
+        return
+
+    try:
+        # A run interrupted after a key was generated but before it was
+        # recorded left the key on the HSM; adopt it instead of creating a twin.
+        with lock:
+            infos, _ = ObjectIndex().refresh(session, serial, object_type=OBJECT.ASYMMETRIC_KEY)
+        existing = {}
+        for info in infos:
+            existing.setdefault(info.label, []).append(info)
+
+        while True:
+            try:
+                spec = work.get_nowait()
+            except queue.Empty:
+                break
+            same_label = existing.get(spec['label'], [])
+            adopt = next((info for info in same_label if matches(spec, info)), None)
+            if adopt is None and same_label:
+                # Another key with this label, e.g. in another domain, is not ours to take
+                ids = ', '.join(str(info.id) for info in same_label)
+                with lock:
+                    failures.append((spec['label'], 'conflict'))
+                print(f'FAILED: {spec["label"]} [HSM {serial} has a key labelled {spec["label"]} ({ids}) that does not match the spec.]')
+                continue
+            try:
+                if adopt is None:
+                    key = AsymmetricKey.generate(session, spec['id'], spec['label'], spec['domains'],
+                                                 KEY_CAPABILITIES, ALGORITHM.EC_P384)
+                else:
+                    same_label.remove(adopt)
+                    key = AsymmetricKey(session, adopt.id)
+                record(spec, key, serial, url)
+            except exceptions.YubiHsmDeviceError as e:
+                with lock:
+                    failures.append((spec['label'], e))
+                print(f'FAILED: {spec["label"]} [{e}]')
+    except exceptions.YubiHsmConnectionError as e:
+        print(f'WARNING: Lost HSM {serial}. [{e}]')
+        return
+
+    session.close()
+    hsm.close()
+
+
+threads = [threading.Thread(target=worker, args=(url,)) for url in devices]
+for t in threads:
+    t.start()
+try:
+    for t in threads:
+        t.join()
+except KeyboardInterrupt:
+    print('Interrupted, run again to resume.')
+    os._exit(-4)
+
+missing = work.qsize()
+print(f'Created {created} keys in {time.monotonic() - start:.1f}s. Index written to {index_file}.')
+
+if failures or missing:
+    print(f'ERROR: {len(failures)} keys failed and {missing} were not attempted. Run again to retry.')
+    sys.exit(-5)
+
+sys.exit(0)
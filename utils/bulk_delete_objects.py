@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import argparse
+import fnmatch
+import os
+import sys
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import ERROR, OBJECT
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import MASTER_AUTHKEY_ID
+from hsmtools.objindex import ObjectIndex, add_filter_arguments, filters_from_args
+
+
+def id_range(value):
+    # 2000 or 2000-2999
+    first, _, last = value.partition('-')
+    first = int(first, 0)
+    last = int(last, 0) if last else first
+    if not 0 < first <= last <= 0xffff:
+        raise argparse.ArgumentTypeError(f'invalid ID range: {value}')
+    return first, last
+
+
+parser = argparse.ArgumentParser(
+                    prog='bulk_delete_objects',
+                    description='Delete all objects matching the given filters over one session.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
+parser.add_argument('-i', '--id', type=id_range, action='append', metavar='ID[-ID]', help='Only objects with this ID or in this ID range, e.g. 2000-2999. Can be repeated.')
+parser.add_argument('--label-pattern', metavar='GLOB', help='Only objects whose label matches this shell pattern, e.g. "tenant-42-*".')
+parser.add_argument('-n', '--dry-run', action='store_true', help='Only print the objects that would be deleted.')
+parser.add_argument('-y', '--yes', action='store_true', help='Delete without asking for confirmation.')
+add_filter_arguments(parser)
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('bulk_delete_objects', args)
+
+filters = filters_from_args(args)
+if not filters and not args.id and not args.label_pattern:
+    parser.error('give at least one of -t, -d, -l, --label-pattern, --algorithm or -i to select the objects')
+
+
+def selected(info):
+    if args.id and not any(first <= info.id <= last for first, last in args.id):
+        return False
+    return args.label_pattern is None or fnmatch.fnmatchcase(info.label, args.label_pattern)
+
+
+def protected(info):
+    # Never delete the master authentication key, nor the key of this session
+    return info.object_type == OBJECT.AUTHENTICATION_KEY and info.id in (MASTER_AUTHKEY_ID, args.authkey_id)
+
+
+failures = []
+try:
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+    serial = hsm.get_device_info().serial
+
+    index = ObjectIndex()
+    with metrics.phase('list'):
+        infos, _ = index.refresh(session, serial, **filters)
+    infos = [info for info in infos if selected(info)]
+
+    for info in [info for info in infos if protected(info)]:
+        print(f'Skipping authentication key {info.id}, it is protected.')
+    infos = [info for info in infos if not protected(info)]
+
+    if not infos:
+        print('No objects match.')
+        sys.exit(0)
+
+    print(f'{"ID":>6}  {"type":<22} {"algorithm":<28} {"domains":>7}  label')
+    for info in infos:
+        print(f'{info.id:>6}  {info.object_type.name.lower():<22} {info.algorithm.name.lower():<28} {info.domains:>7}  {info.label}')
+
+    if args.dry_run:
+        print(f'Dry run, {len(infos)} objects would be deleted from HSM {serial}.')
+        sys.exit(0)
+
+    if not args.yes:
+        # Ask once for all objects
+        confirm = input(f'Warning! Are you sure you wish to delete these {len(infos)} objects from HSM {serial}? (y/N)')
+        if confirm != 'y':
+            sys.exit(0)
+
+    start = time.perf_counter()
+    with metrics.phase('delete'):
+        for info in infos:
+            try:
+                session.get_object(info.id, info.object_type).delete()
+            except exceptions.YubiHsmDeviceError as e:
+                # Already gone counts as deleted
+                if e.code != ERROR.OBJECT_NOT_FOUND:
+                    failures.append(info)
+                    print(f'FAILED: {info.object_type.name.lower()} {info.id} [{e}]')
+                    continue
+            print(f'Deleted {info.object_type.name.lower()} {info.id}.')
+
+    # Drop the deleted objects from the index
+    index.refresh(session, serial, **filters)
+    print(f'Deleted {len(infos) - len(failures)} objects in {time.perf_counter() - start:.2f}s.')
+
+    # Clean up:
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to delete objects. [{e}]')
+    sys.exit(-3)
+
+if failures:
+    print(f'ERROR: {len(failures)} objects could not be deleted.')
+    sys.exit(-5)
+
+sys.exit(0)
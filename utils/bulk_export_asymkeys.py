@@ -0,0 +1,109 @@
+import sys
+import os
+import argparse
+import time
+
+from yubihsm.defs import OBJECT
+from yubihsm.defs import ALGORITHM
+from yubihsm.objects import AsymmetricKey, WrapKey
+from yubihsm.defs import CAPABILITY as CAP
+from yubihsm import exceptions
+
+import binascii as bs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.archive import ArchiveWriter
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.objindex import ObjectIndex, add_filter_arguments, filters_from_args
+from hsmtools.pubkeys import PublicKeyCache, fingerprint
+
+parser = argparse.ArgumentParser(
+                    prog='bulk_export_asymkeys',
+                    description='Export all exportable asymmetric keys, or a filtered set, wrapped with one AES-256 key into a single archive.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
+parser.add_argument('-w', '--wrap-id', default=100, type=int, help='ID used for the temporary wrapping key. (Default: 100)')
+parser.add_argument('--domain', default=1, type=int, help='Domain assigned to the wrapping key. (Default: 1)')
+parser.add_argument('-i', '--id', type=int, action='append', help='Only export this key ID. Can be repeated.')
+parser.add_argument('-o', '--output', default='./wrapped_keys.jsonl', help='Archive file to write. (Default: ./wrapped_keys.jsonl)')
+add_filter_arguments(parser, types=False)
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('bulk_export_asymkeys', args)
+
+# Connect to the YubiHSM via the connector using the default password:
+try:
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+    serial = hsm.get_device_info().serial
+
+    with metrics.phase('list'):
+        infos, _ = ObjectIndex().refresh(session, serial, object_type=OBJECT.ASYMMETRIC_KEY, **filters_from_args(args))
+    infos = [i for i in infos if i.capabilities & CAP.EXPORTABLE_UNDER_WRAP and (not args.id or i.id in args.id)]
+    if not infos:
+        print('Error: No exportable keys found.')
+        sys.exit(-1)
+
+    # The wrapping key must be allowed to pass on every capability of the keys it carries
+    delegated = CAP.EXPORTABLE_UNDER_WRAP
+    for info in infos:
+        delegated |= info.capabilities
+
+    aes_key = session.get_pseudo_random(32)
+
+    print(f'Wrapping AES-256 Key: {bs.hexlify(aes_key).decode("ascii")}')
+
+    wrap_key = WrapKey.put(session, args.wrap_id, "Wrapping Key", args.domain,
+                           CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED,
+                           ALGORITHM.AES256_CCM_WRAP, delegated, aes_key)
+
+    print(f'Exporting {len(infos)} asymmetric keys to {args.output}.')
+
+    cache = PublicKeyCache()
+    archive = ArchiveWriter(args.output, serial=serial, delegated_capabilities=int(delegated))
+    start = time.perf_counter()
+    try:
+        with metrics.phase('export'):
+            for info in infos:
+                pub_key, _ = cache.get(AsymmetricKey(session, info.id), serial, info)
+                exported_key = wrap_key.export_wrapped(session.get_object(info.id, OBJECT.ASYMMETRIC_KEY))
+                archive.add(exported_key, id=info.id, label=info.label, algorithm=info.algorithm.name,
+                            domains=info.domains, capabilities=int(info.capabilities),
+                            fingerprint='sha256:' + fingerprint(pub_key))
+        count = archive.close(aes_key)
+    except BaseException:
+        archive.abort()
+        os.remove(args.output)
+        raise
+    finally:
+        # Delete the AES key
+        WrapKey.delete(wrap_key)
+        cache.save()
+
+    elapsed = time.perf_counter() - start
+    print(f'Exported {count} keys in {elapsed:.2f}s ({count / elapsed:.1f} keys/s).')
+
+    # Clean up:
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to export asymmetric keys. [{e}]')
+    sys.exit(-3)
+
+sys.exit(0)
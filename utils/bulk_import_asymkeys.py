@@ -0,0 +1,117 @@
+import sys
+import os
+import argparse
+import time
+
+from yubihsm.defs import ALGORITHM
+from yubihsm.objects import WrapKey
+from yubihsm.defs import CAPABILITY as CAP
+from yubihsm import exceptions
+
+import binascii as bs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import archive
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.pubkeys import fingerprint
+
+parser = argparse.ArgumentParser(
+                    prog='bulk_import_asymkeys',
+                    description='Import the asymmetric keys of an archive written by bulk_export_asymkeys.py.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', help='Password used to unlock the HSM')
+parser.add_argument('-w', '--wrap-id', default=100, type=int, help='ID used for the temporary wrapping key. (Default: 100)')
+parser.add_argument('--domain', default=1, type=int, help='Domain assigned to the wrapping key. (Default: 1)')
+parser.add_argument('--verify-only', action='store_true', help='Only check the integrity of the archive. No HSM is needed.')
+parser.add_argument('filename', type=str, help='Archive to import.')
+parser.add_argument('aes_key', type=str, nargs='?', help='AES-256 wrapping key as a hex string. Optional with --verify-only.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('bulk_import_asymkeys', args)
+
+if not args.verify_only and (args.authkey_password is None or args.aes_key is None):
+    parser.error('the following arguments are required: -p/--authkey_password, aes_key')
+
+aes_key = bs.unhexlify(args.aes_key) if args.aes_key else None
+
+# Check the whole archive before anything is written to the HSM
+try:
+    with metrics.phase('verify'):
+        header = archive.verify(args.filename, aes_key)
+except (OSError, archive.ArchiveError) as e:
+    print(f'ERROR: Archive check failed. [{e}]')
+    sys.exit(-1)
+
+trailer = header['trailer']
+print(f'Archive OK: {trailer["count"]} keys exported from HSM {header["serial"]}.')
+if args.verify_only:
+    for key_id, label in trailer['index']:
+        print(f'  {key_id}: {label}')
+    sys.exit(0)
+
+failures = 0
+
+# Connect to the YubiHSM via the connector using the default password:
+try:
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+
+    # Create the AES-256 wrapping key from the passed in aes_key value
+    wrap_key = WrapKey.put(session, args.wrap_id, "Wrapping Key", args.domain,
+                           CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED,
+                           ALGORITHM.AES256_CCM_WRAP, header['delegated_capabilities'], aes_key)
+
+    start = time.perf_counter()
+    imported = 0
+    try:
+        with metrics.phase('import'):
+            records = archive.read(args.filename)
+            next(records)
+            for metadata, wrapped_key in records:
+                try:
+                    key = wrap_key.import_wrapped(wrapped_key)
+                except exceptions.YubiHsmDeviceError as e:
+                    print(f'FAILED: Key {metadata["id"]} ({metadata["label"]}) [{e}]')
+                    failures += 1
+                    continue
+
+                # Make sure the HSM holds the key that was exported
+                if 'sha256:' + fingerprint(key.get_public_key()) != metadata['fingerprint']:
+                    print(f'FAILED: Key {key.id} ({metadata["label"]}) does not match the exported public key.')
+                    failures += 1
+                    continue
+                imported += 1
+    finally:
+        # Delete the AES key
+        WrapKey.delete(wrap_key)
+
+    elapsed = time.perf_counter() - start
+    print(f'Imported {imported} keys in {elapsed:.2f}s ({imported / elapsed if elapsed > 0 else 0:.1f} keys/s).')
+
+    # Clean up:
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to import asymmetric keys. [{e}]')
+    sys.exit(-3)
+
+if failures:
+    sys.exit(-5)
+
+sys.exit(0)
@@ -0,0 +1,27 @@
+import sys
+import os
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import authcache
+
+parser = argparse.ArgumentParser(
+                    prog='clear_authkey_cache',
+                    description='Remove cached authentication session keys.')
+
+parser.add_argument('id', type=int, nargs='?', help='ID of the authentication key to remove. If not specified, the whole cache is removed.')
+
+args = parser.parse_args()
+
+try:
+    authcache.invalidate(args.id)
+except OSError as e:
+    print(f'ERROR: Failed to clear the cache. [{e}]')
+    sys.exit(-1)
+
+if args.id is None:
+    print(f'Cache cleared. [{authcache.CACHE_FILE}]')
+else:
+    print(f'Cached keys removed. [ID: {args.id}]')
+
+sys.exit(0)
@@ -1,11 +1,16 @@
 import sys
+import os
 import argparse
 
-from yubihsm import YubiHsm
-from yubihsm.defs import CAPABILITY as CAP
-from yubihsm.objects import AuthenticationKey
 from yubihsm import exceptions
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import create_authkey
+
 parser = argparse.ArgumentParser(
                     prog='create_authkey',
                     description='Create a new authentication key.')
@@ -17,49 +22,38 @@ parser.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned
 parser.add_argument('id', type=int, help='ID for the new authentication key.')
 parser.add_argument('label', help='Label for the key.')
 parser.add_argument('password', help='Password to use to unlock the new authentication key.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
-
-admin_caps = CAP.GENERATE_ASYMMETRIC_KEY | CAP.EXPORT_WRAPPED | CAP.GET_PSEUDO_RANDOM | CAP.PUT_WRAP_KEY | CAP.IMPORT_WRAPPED | CAP.DELETE_ASYMMETRIC_KEY | CAP.DELETE_WRAP_KEY | CAP.DELETE_AUTHENTICATION_KEY
-
-admin_delegated_caps = CAP.EXPORTABLE_UNDER_WRAP | CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED 
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('create_authkey', args)
 
 # Connect to the YubiHSM via the connector using the default password:
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey_id, args.authkey_password)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
 
     # Generate a new authentication key
     # put authkey 0 2 DevKey 1 generate-asymmetric-key,export-wrapped,get-pseudo-random,put-wrap-key,import-wrapped,delete-asymmetric-key,decrypt-oaep decrypt-oaep,exportable-under-wrap,export-wrapped,import-wrapped 9gROdJPLi64lPWgTyY81btjPYxYUjad3
     #
-    caps = CAP.SIGN_ECDSA
-
-    delegated_caps = CAP.SIGN_ECDSA
-
     if args.admin:
         print('Setting admin capabilities.')
-        caps = caps | admin_caps
-        delegated_caps = delegated_caps | admin_delegated_caps
 
     print(f'Creating a new authentication key. [ID: {args.id}, Domain: {args.domain}. Label: {args.label}]')
-    key = AuthenticationKey.put_derived(
-            session,     # Session
-            args.id,     # AuthKey ID
-            args.label,  # Label
-            args.domain, # Domain
-            caps,        # Capabilities  
-            delegated_caps,   # Delegated Capabilities
-            args.password
-        )
+    key = create_authkey(session, args.id, args.label, args.domain, args.password, args.admin)
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmAuthenticationError as e:
     print(f'ERROR: Failed to authenticate. [{e}]')
     sys.exit(-1)
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Failed to create authentication key. [{e}]')
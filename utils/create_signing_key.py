@@ -1,66 +1,60 @@
 import sys
+import os
 import argparse
 
-from yubihsm import YubiHsm
 from yubihsm import exceptions
-from yubihsm.defs import CAPABILITY, ALGORITHM
-from yubihsm.objects import AsymmetricKey
 
-from cryptography.hazmat.primitives import serialization
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import create_signing_key, write_public_key
+from hsmtools.signing import KEY_SCHEMES, SCHEMES
 
 parser = argparse.ArgumentParser(
                     prog='create_signing_key',
-                    description='Create a new ecp384 signing key.')
+                    description='Create a new signing key.')
 
 parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
 parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
 parser.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the new authentication key. (Default: 1)')
+parser.add_argument('-a', '--algorithm', default='ecp384', choices=KEY_SCHEMES, help='Algorithm of the key. Sign with the same name in sign.py -A. (Default: ecp384)')
 parser.add_argument('--id', type=int, default=0, help='ID for the new asymmetric key. If not specified, an ID will be generated.')
 parser.add_argument('label', help='Label for the key.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('create_signing_key', args)
+scheme = SCHEMES[args.algorithm]
 
 # Connect to the YubiHSM via the connector using the default password:
-# hsm = YubiHsm.connect('http://localhost:12345')
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey_id, args.authkey_password)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
 
     print('Key generation can take several minutes to complete. Please be patient.')
     # Generate a private key on the YubiHSM for creating signatures:
-    key = AsymmetricKey.generate(  # Generate a new key object in the YubiHSM.
-        session,                   # Secure YubiHsm session to use.
-        args.id,                   # Object ID, 0 to get one assigned.
-        args.label,                # Label for the object.
-        args.domain,               # Domain(s) for the object.
-        CAPABILITY.SIGN_ECDSA | CAPABILITY.EXPORTABLE_UNDER_WRAP,   # Capabilities for the object.
-        ALGORITHM.EC_P384          # Algorithm for the key.
-    )
+    key = create_signing_key(session, args.id, args.label, args.domain, scheme)
 
     print('Key generation complete.')
 
-    # pub_key is a cryptography.io ec.PublicKey, see https://cryptography.io
-    pub_key = key.get_public_key()
-
-    pub_key_str = pub_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    ).decode('ascii')
-
-    print(pub_key_str)
-
     # Write the public key to a file:
-    with open(f'./public_key_{key.id}.pem', 'w') as f:
-        f.write(pub_key_str)
+    print(write_public_key(key.id, key.get_public_key()))
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmAuthenticationError as e:
     print(f'ERROR: Failed to authenticate. [{e}]')
     sys.exit(-1)
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Failed to create signing key. [{e}]')
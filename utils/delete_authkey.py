@@ -1,11 +1,18 @@
 import sys
+import os
 import argparse
 
-from yubihsm import YubiHsm
 from yubihsm.defs import OBJECT
 from yubihsm.objects import AuthenticationKey
 from yubihsm import exceptions
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import MASTER_AUTHKEY_ID
+
 parser = argparse.ArgumentParser(
                     prog='delete_authkey',
                     description='Delete an authentication key.')
@@ -13,16 +20,22 @@ parser = argparse.ArgumentParser(
 parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
 parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
 parser.add_argument('id', type=int, help='ID key to delete.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('delete_authkey', args)
 
 # Connect to the YubiHSM via the connector using the default password:
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey_id, args.authkey_password)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
 
     # Do NOT delete master authentication key
-    if args.id == 1:
+    if args.id == MASTER_AUTHKEY_ID:
         print('Cannot delete master authentication key.')
         sys.exit(-1)
 
@@ -41,13 +54,14 @@ try:
     print('Key deleted.')
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmAuthenticationError as e:
     print(f'ERROR: Failed to authenticate. [{e}]')
     sys.exit(-1)
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Failed to delete authentication key. [{e}]')
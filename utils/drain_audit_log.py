@@ -0,0 +1,161 @@
+import sys
+import os
+import argparse
+import glob
+import json
+import signal
+import threading
+
+from yubihsm.defs import ERROR
+from yubihsm import exceptions
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.auditlog import LAG_WARNING, ChainError, Drainer, LogStore, command_name
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+
+parser = argparse.ArgumentParser(
+                    prog='drain_audit_log',
+                    description='Move new entries of the HSM audit log into a local store and release them on the HSM.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', help='Password used to unlock the HSM')
+parser.add_argument('-s', '--store', default='./audit', help='Directory holding one <serial>.log file per HSM. (Default: ./audit)')
+parser.add_argument('-f', '--follow', action='store_true', help='Keep draining until interrupted.')
+parser.add_argument('-i', '--interval', default=5, type=float, help='Seconds between drains with --follow. (Default: 5)')
+parser.add_argument('--resync', action='store_true', help='Accept a log that does not continue the stored one, e.g. after the HSM was reset. The break is kept in the store.')
+parser.add_argument('--verify', action='store_true', help='Check the hash chain of the stored logs and exit. No HSM is needed.')
+parser.add_argument('--export', metavar='FILE', help='Write the stored logs as JSON lines to FILE (- for stdout) and exit. No HSM is needed.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('drain_audit_log', args)
+
+if args.verify or args.export:
+    paths = sorted(glob.glob(os.path.join(args.store, '*.log')))
+    if not paths:
+        print(f'Error: No stored logs in {args.store}.')
+        sys.exit(-1)
+    stores = [LogStore(args.store, os.path.basename(p)[:-4]) for p in paths]
+
+    failed = False
+    if args.verify:
+        for store in stores:
+            count, breaks = store.verify()
+            print(f'{store.path}: {count} entries, {len(breaks)} breaks in the hash chain.')
+            for previous, following in breaks:
+                print(f'  Entry {following} does not follow entry {previous}.')
+            failed = failed or bool(breaks)
+
+    if args.export:
+        out = sys.stdout if args.export == '-' else open(args.export, 'w')
+        for store in stores:
+            serial = os.path.basename(store.path)[:-4]
+            for entry in store.entries():
+                record = dict(entry._asdict(), serial=serial, command=command_name(entry), digest=entry.digest.hex())
+                out.write(json.dumps(record) + '\n')
+        if out is not sys.stdout:
+            out.close()
+
+    sys.exit(-5 if failed else 0)
+
+if args.authkey_password is None:
+    parser.error('the following arguments are required: -p/--authkey_password')
+
+stopped = threading.Event()
+
+
+def shutdown(signum, frame):
+    stopped.set()
+
+
+signal.signal(signal.SIGTERM, shutdown)
+signal.signal(signal.SIGINT, shutdown)
+
+
+def open_session():
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+    return hsm, session
+
+
+def close(hsm, session):
+    with metrics.phase('close'):
+        try:
+            session.close()
+        except exceptions.YubiHsmError:
+            pass
+        hsm.close()
+
+
+try:
+    hsm, session = open_session()
+    info = hsm.get_device_info()
+    drainer = Drainer(session, LogStore(args.store, info.serial), info.log_size, args.resync)
+    print(f'Draining the audit log into {drainer.store.path}', flush=True)
+
+    while True:
+        try:
+            if session is None:
+                hsm, session = open_session()
+                drainer.session = session
+            with metrics.phase('drain'):
+                report = drainer.drain()
+        except (exceptions.YubiHsmConnectionError, exceptions.YubiHsmDeviceError) as e:
+            # In follow mode a lost connection or a session the HSM dropped
+            # after 30 idle seconds is opened again.
+            if not args.follow or (isinstance(e, exceptions.YubiHsmDeviceError)
+                                   and e.code not in (ERROR.INVALID_SESSION, ERROR.SESSION_FAILED)):
+                raise
+            print(f'WARNING: Lost the HSM session, reconnecting. [{e}]', flush=True)
+            if session is not None:
+                close(hsm, session)
+            session = None
+            # A dropped session is opened again right away, a lost connection after the interval
+            if isinstance(e, exceptions.YubiHsmConnectionError) and stopped.wait(args.interval):
+                break
+            continue
+
+        if args.follow:
+            print(json.dumps(dict(report, total_drained=drainer.drained)), flush=True)
+        else:
+            print(f'Drained {report["drained"]} entries, the HSM log was {report["fill"]:.0%} full '
+                  f'({report["pending"]} of {drainer.log_size} entries).')
+
+        if report['unlogged_boot'] or report['unlogged_auth']:
+            print(f'WARNING: The log was full, {report["unlogged_boot"]} boot and {report["unlogged_auth"]} authentication events were not logged.', flush=True)
+        if report['fill'] >= LAG_WARNING:
+            print(f'WARNING: The HSM log was {report["fill"]:.0%} full. Drain more often, with forced auditing the HSM stops when it is full.', flush=True)
+
+        # Drain again soon when the log filled up during the interval
+        if not args.follow or stopped.wait(args.interval / 4 if report['fill'] >= 0.5 else args.interval):
+            break
+
+    if session is not None:
+        close(hsm, session)
+except ChainError as e:
+    print(f'ERROR: Audit log chain check failed. [{e}]')
+    sys.exit(-5)
+except OSError as e:
+    print(f'ERROR: Failed to write the audit log store. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmInvalidResponseError as e:
+    print(f'ERROR: Audit log chain check failed. [{e}]')
+    sys.exit(-5)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to drain the audit log. [{e}]')
+    sys.exit(-3)
+
+sys.exit(0)
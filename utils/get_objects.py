@@ -1,39 +1,71 @@
 #!/usr/bin/env python
 import argparse
 import sys
+import os
 
-from yubihsm import YubiHsm
 from yubihsm import exceptions
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import print_objects
+from hsmtools.objindex import ObjectIndex, add_filter_arguments, filters_from_args
+
 parser = argparse.ArgumentParser(
                     prog='get_objects',
                     description='Retrieve and print out the HSM objects')
 
 parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. Default is 1')
-parser.add_argument('-p', '--password', required=True, help='Password used to unlock the HSM')
+parser.add_argument('-p', '--password', help='Password used to unlock the HSM')
+parser.add_argument('--offline', action='store_true', help='Answer from the local object index without connecting to the HSM.')
+parser.add_argument('--serial', type=int, help='Serial number of the HSM to show with --offline. Needed when several HSMs are indexed.')
+add_filter_arguments(parser)
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('get_objects', args)
+
+if args.password is None and not args.offline:
+    parser.error('the following arguments are required: -p/--password')
+
+filters = filters_from_args(args)
+index = ObjectIndex()
+
+
+if args.offline:
+    serials = [args.serial] if args.serial is not None else index.serials
+    if len(serials) != 1:
+        print('ERROR: Use --serial to choose one of the indexed HSMs: ' + ', '.join(str(s) for s in serials))
+        sys.exit(-4)
+    with metrics.phase('query'):
+        infos = index.query(serials[0], **filters)
+    print_objects(infos)
+    sys.exit(0)
 
 # Connect to the YubiHSM via the connector using the default password:
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey, args.password)
-
-    objs = session.list_objects()
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey, args.password)
 
-    key = None
+    # Only objects that are new or were replaced since the last run are read from the HSM
+    with metrics.phase('list'):
+        infos, fetched = index.refresh(session, hsm.get_device_info().serial, **filters)
 
-    for obj in objs:
-        print(f'id: {obj.id} type: {obj.object_type}')
-        info = obj.get_info()
-        print(info)
-        print("") # Newline
+    print_objects(infos)
+    print(f'{len(infos)} objects, {fetched} read from the HSM.')
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmAuthenticationError as e:
     print(f'ERROR: Failed to unlock HSM with supplied password. [{e}]')
@@ -1,27 +1,18 @@
 #!/usr/bin/env python
 import argparse
 import sys
+import os
 
-from yubihsm import YubiHsm
-from yubihsm.defs import OBJECT
 from yubihsm import exceptions
 
-from cryptography.hazmat.primitives import serialization
-
-def save_pub_key(key):
-    # pub_key is a cryptography.io ec.PublicKey, see https://cryptography.io
-    pub_key = key.get_public_key()
-    
-    pub_key_str = pub_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo
-    ).decode('ascii')
-
-    print(pub_key_str)
- 
-    # Write the public key to a file:
-    with open(f'./public_key_{key.id}.pem', 'w') as fd:
-        fd.write(pub_key_str)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import public_keys, write_public_key
+from hsmtools.pubkeys import BUNDLE_FORMATS, to_pem, write_bundle
+from hsmtools.objindex import add_filter_arguments, filters_from_args
 
 parser = argparse.ArgumentParser(
                     prog='get_pub_keys',
@@ -29,32 +20,53 @@ parser = argparse.ArgumentParser(
 
 parser.add_argument('-k', '--authkey', default=1, type=int, help='Authentication Key ID to use. Default is 1')
 parser.add_argument('-p', '--password', required=True, help='Password used to unlock the RSA key on the HSM')
+parser.add_argument('-b', '--bundle', help='Also write all keys to this single keyring file.')
+parser.add_argument('-f', '--format', default='pem', choices=BUNDLE_FORMATS, help='Format of the keyring: concatenated PEM or JWKS style JSON. (Default: pem)')
+parser.add_argument('--no-files', action='store_true', help='Do not write a public_key_<id>.pem file per key.')
+add_filter_arguments(parser, types=False)
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('get_pub_keys', args)
 
 # Connect to the YubiHSM via the connector using the default password:
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey, args.password)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey, args.password)
+
+    serial = hsm.get_device_info().serial
 
-    objs = session.list_objects()
+    # Object info comes from the local index and public keys from the local
+    # cache, only new or replaced keys are read from the HSM
+    with metrics.phase('public_keys'):
+        keyring, fetched = public_keys(session, serial, **filters_from_args(args))
 
-    key = None
+    for info, pub_key in keyring:
+        print('Found asymetric key')
+        print(info)
+        # Write the public key to a file:
+        if args.no_files:
+            print(to_pem(pub_key))
+        else:
+            print(write_public_key(info.id, pub_key))
 
-    for obj in objs:
-        # print(f'id: {obj.id} type: {obj.object_type}')
-    
-        if obj.object_type == OBJECT.ASYMMETRIC_KEY:
-            print('Found asymetric key')
-            info = obj.get_info()
-            print(info)
-            save_pub_key(obj)
+    if args.bundle:
+        skipped = write_bundle(args.bundle, [(info.id, info.label, pub_key) for info, pub_key in keyring], args.format)
+        for key_id, reason in skipped:
+            print(f'WARNING: Key {key_id} left out of the keyring. [{reason}]')
+        print(f'Keyring with {len(keyring) - len(skipped)} keys written to {args.bundle}')
+    print(f'{len(keyring)} public keys, {fetched} read from the HSM.')
 
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Wrapping key decryption failed. [{e}]')
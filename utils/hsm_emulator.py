@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import sys
+import os
+import argparse
+
+from yubihsm.defs import COMMAND
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools.emulator import ConnectorServer, SoftwareHsm
+from hsmtools.trace import ReplayLatency, load
+
+def parse_latency(value):
+    # COMMAND=milliseconds, e.g. SIGN_ECDSA=80 or default=2
+    name, _, ms = value.partition('=')
+    try:
+        key = 'default' if name.lower() == 'default' else COMMAND[name.upper()]
+    except KeyError:
+        raise argparse.ArgumentTypeError(f'unknown command: {name}')
+    try:
+        return key, float(ms) / 1000
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected COMMAND=ms, not {value}')
+
+parser = argparse.ArgumentParser(
+                    prog='hsm_emulator',
+                    description='Run a software YubiHSM stand-in behind a yubihsm-connector compatible HTTP API. For testing only.')
+
+parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. (Default: 127.0.0.1)')
+parser.add_argument('--port', default=12345, type=int, help='Port to listen on. (Default: 12345)')
+parser.add_argument('--serial', default=1000000, type=int, help='Serial number reported by the stand-in. (Default: 1000000)')
+parser.add_argument('-l', '--latency', action='append', type=parse_latency, default=[], help='Simulated latency as COMMAND=ms, e.g. SIGN_ECDSA=80. Use default=ms for all other commands. Can be repeated.')
+parser.add_argument('--replay', metavar='TRACE', help='Answer each command after the round trips recorded for it in a trace written with --trace. -l sets commands missing from the trace or overrides it.')
+
+args = parser.parse_args()
+
+latency = dict(args.latency)
+if args.replay:
+    try:
+        records = load(args.replay)
+    except (OSError, ValueError) as e:
+        print(f'ERROR: Failed to read the trace. [{e}]')
+        sys.exit(-1)
+    latency = ReplayLatency(records, latency)
+    print(f'Replaying the round trips of {len(records)} messages from {args.replay}')
+
+server = ConnectorServer(SoftwareHsm(args.serial, latency=latency), args.host, args.port)
+
+print(f'Software HSM listening on {server.url}. Authentication key 1 password: password')
+print(f'Use it with: export YUBIHSM_CONNECTOR={server.url}')
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+
+server.server_close()
+
+sys.exit(0)
@@ -1,15 +1,18 @@
 import sys
+import os
 import argparse
 
-from yubihsm import YubiHsm
-from yubihsm.defs import OBJECT
-from yubihsm.defs import ALGORITHM
-from yubihsm.objects import AsymmetricKey, WrapKey
-from yubihsm.defs import CAPABILITY as CAP
 from yubihsm import exceptions
 
 import binascii as bs
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.keys import import_wrapped
+
 parser = argparse.ArgumentParser(
                     prog='import_asymkey',
                     description='Import an asymmetric key wrapped with AES-256.')
@@ -20,25 +23,19 @@ parser.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned
 # parser.add_argument('id', type=int, help='ID of key to import.')
 parser.add_argument('filename', type=str, help='Filename of the wrapped key to import.')
 parser.add_argument('aes_key', type=str, help='AES-256 wrapping key as a hex string.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
 
 args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('import_asymkey', args)
 
 # Connect to the YubiHSM via the connector using the default password:
 try:
-    hsm = YubiHsm.connect('yhusb://')
-    session = hsm.create_session_derived(args.authkey_id, args.authkey_password)
-
-    # Create the AES-128 wrapping key from the passed in aes_key value
-    wrap_key = WrapKey.put( session, 
-                            100, 
-                            "Wrapping Key", 
-                            args.domain, 
-                            CAP.EXPORT_WRAPPED | CAP.IMPORT_WRAPPED,
-                            ALGORITHM.AES256_CCM_WRAP, 
-                            CAP.SIGN_ECDSA | CAP.EXPORTABLE_UNDER_WRAP,
-                            bs.unhexlify(args.aes_key) )
-    
-    print(wrap_key)
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
 
     print(f'Importing asymmetric key.')
 
@@ -46,21 +43,20 @@ try:
     with open(args.filename, 'br') as fd:
         wrapped_key = fd.read()
 
-    key = wrap_key.import_wrapped(wrapped_key)
+    # Unwrap it with the passed in aes_key value
+    key = import_wrapped(session, args.authkey_id, wrapped_key, args.domain, bs.unhexlify(args.aes_key))
 
     print(f'Import successful. [ID: {key.id}]')
 
-    # Delete the AES key
-    WrapKey.delete(wrap_key)
-
     # Clean up:
-    session.close()
-    hsm.close()
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
 except exceptions.YubiHsmAuthenticationError as e:
     print(f'ERROR: Failed to authenticate. [{e}]')
     sys.exit(-1)
 except exceptions.YubiHsmConnectionError as e:
-    print(f'ERROR: Failed to connect to HSM over USB. [{e}]')
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
     sys.exit(-2)
 except exceptions.YubiHsmDeviceError as e:
     print(f'ERROR: Failed to export asymmetric key. [{e}]')
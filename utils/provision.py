@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import ALGORITHM
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools import metrics as hsm_metrics
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect
+from hsmtools.objindex import ObjectIndex
+from hsmtools.provision import apply, check_passwords, load_spec, plan
+
+MARKS = {'create': '+', 'replace': '~', 'conflict': '!', 'password': '*'}
+
+parser = argparse.ArgumentParser(
+                    prog='provision',
+                    description='Bring the authentication and signing keys of an HSM in line with a spec file, changing only what differs.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the session. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSM')
+parser.add_argument('-n', '--dry-run', action='store_true', help='Only print the changes that would be made.')
+parser.add_argument('--replace', action='store_true', help='Delete and re-create objects that differ from the spec. Replaced signing keys get a new private key.')
+parser.add_argument('--passwords', action='store_true', help='Also check the passwords of existing authentication keys and change the ones that differ. Keys other than the session key are deleted and put again.')
+parser.add_argument('spec', help='JSON file listing the authentication keys and signing keys the HSM should hold.')
+hsm_connection.add_arguments(parser)
+hsm_metrics.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+metrics = hsm_metrics.from_args('provision', args)
+
+try:
+    wanted = load_spec(args.spec)
+except (OSError, ValueError) as e:
+    print(f'ERROR: Failed to read spec. [{e}]')
+    sys.exit(-1)
+
+
+def describe(desired):
+    return f'{desired.object_type.name.lower()} {desired.id} ({desired.label})'
+
+
+def show(value):
+    # Labels as they are, algorithms by name and domains and capabilities as bitmasks
+    if isinstance(value, str):
+        return repr(value)
+    if isinstance(value, ALGORITHM):
+        return value.name.lower()
+    return f'0x{value:x}'
+
+
+conflicts = []
+failures = []
+try:
+    with metrics.phase('connect'):
+        hsm = metrics.instrument(connect())
+    with metrics.phase('session'):
+        session = create_session(hsm, args.authkey_id, args.authkey_password)
+    serial = hsm.get_device_info().serial
+
+    # One listing of the device, reading the info only of objects changed since the last run
+    start = time.perf_counter()
+    index = ObjectIndex()
+    with metrics.phase('list'):
+        infos, fetched = index.refresh(session, serial)
+    try:
+        actions = plan(wanted, infos, args.replace, protected=(args.authkey_id,))
+    except ValueError as e:
+        print(f'ERROR: Failed to read spec. [{e}]')
+        sys.exit(-1)
+    if args.passwords:
+        with metrics.phase('passwords'):
+            actions = check_passwords(hsm, actions)
+    print(f'Read {len(infos)} objects of HSM {serial} in {time.perf_counter() - start:.2f}s ({fetched} changed since the last run).')
+
+    for action in actions:
+        if action.kind == 'ok':
+            continue
+        print(f'{MARKS[action.kind]} {action.kind:<8} {describe(action.desired)}')
+        for name, have, want in action.changes:
+            print(f'      {name}: {show(have)} -> {show(want)}')
+
+    kinds = [a.kind for a in actions]
+    print(f'{kinds.count("create")} to create, {kinds.count("replace")} to replace, {kinds.count("password")} passwords to change, '
+          f'{kinds.count("conflict")} differing, {kinds.count("ok")} up to date.')
+    conflicts = [a for a in actions if a.kind == 'conflict']
+    if conflicts:
+        print('Objects marked ! differ from the spec and are left as they are, use --replace to re-create them.')
+
+    changes = [a for a in actions if a.kind in ('create', 'replace', 'password')]
+    if changes and not args.dry_run:
+        start = time.perf_counter()
+        with metrics.phase('apply'):
+            for action in changes:
+                try:
+                    apply(session, action, args.authkey_id)
+                except exceptions.YubiHsmDeviceError as e:
+                    failures.append(action)
+                    print(f'FAILED: {action.kind} {describe(action.desired)} [{e}]')
+                    continue
+                print(f'Done: {action.kind} {describe(action.desired)}')
+
+        # Record the new objects in the index
+        index.refresh(session, serial)
+        print(f'Applied {len(changes) - len(failures)} changes in {time.perf_counter() - start:.2f}s.')
+
+    # Clean up:
+    with metrics.phase('close'):
+        session.close()
+        hsm.close()
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to provision the HSM. [{e}]')
+    sys.exit(-3)
+
+if conflicts or failures:
+    print(f'ERROR: {len(conflicts) + len(failures)} objects do not match the spec.')
+    sys.exit(-5)
+
+sys.exit(0)
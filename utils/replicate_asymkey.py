@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+import threading
+import time
+
+from yubihsm import exceptions
+from yubihsm.defs import ALGORITHM, ERROR, OBJECT
+from yubihsm.defs import CAPABILITY as CAP
+from yubihsm.objects import AsymmetricKey, WrapKey
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools import connection as hsm_connection
+from hsmtools.authcache import create_session
+from hsmtools.connection import connect, discover_usb
+from hsmtools.pubkeys import fingerprint
+
+WRAP_LABEL = 'Replication Wrap Key'
+
+parser = argparse.ArgumentParser(
+                    prog='replicate_asymkey',
+                    description='Copy an asymmetric key from one HSM to several others, importing into all of them at once.')
+
+parser.add_argument('-k', '--authkey_id', default=1, type=int, help='Authentication Key ID to use for the sessions. (Default: 1)')
+parser.add_argument('-p', '--authkey_password', required=True, help='Password used to unlock the HSMs')
+parser.add_argument('-w', '--wrap-id', default=100, type=int, help='ID used for the temporary wrapping key on every HSM. (Default: 100)')
+parser.add_argument('-d', '--domain', default=1, type=int, help='Domain assigned to the wrapping key. (Default: 1)')
+parser.add_argument('-s', '--source', help='Connector URL of the HSM holding the key. (Default: --connector, YUBIHSM_CONNECTOR, the config file or yhusb://)')
+parser.add_argument('-D', '--device', action='append', default=[], help='Connector URL of an HSM to copy the key to, e.g. yhusb://serial=123. Repeat for several HSMs.')
+parser.add_argument('--discover', action='store_true', help='Copy the key to every other YubiHSM attached over USB.')
+parser.add_argument('id', type=int, help='ID of the key to copy.')
+hsm_connection.add_arguments(parser)
+
+args = parser.parse_args()
+hsm_connection.configure(args)
+
+targets = list(args.device)
+if args.discover:
+    targets += [url for url in discover_usb() if url not in targets]
+if not targets:
+    parser.error('give the HSMs to copy the key to with -D or --discover')
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def put_wrap_key(session, aes_key, delegated):
+    # A wrap key left behind by an interrupted run is replaced, any other object is not touched
+    try:
+        info = session.get_object(args.wrap_id, OBJECT.WRAP_KEY).get_info()
+        if info.label != WRAP_LABEL:
+            raise ValueError(f'Wrap key {args.wrap_id} is in use, choose another ID with -w.')
+        session.get_object(args.wrap_id, OBJECT.WRAP_KEY).delete()
+    except exceptions.YubiHsmDeviceError as e:
+        if e.code != ERROR.OBJECT_NOT_FOUND:
+            raise
+    return WrapKey.put(session, args.wrap_id, WRAP_LABEL, args.domain, CAP.IMPORT_WRAPPED | CAP.EXPORT_WRAPPED,
+                       ALGORITHM.AES256_CCM_WRAP, delegated, aes_key)
+
+
+class Target(object):
+    def __init__(self, url):
+        self.url = url
+        self.serial = None
+        self.hsm = None
+        self.session = None
+        self.status = 'failed'
+        self.error = None
+        self.timing = {}
+
+    def close(self):
+        try:
+            if self.session:
+                self.session.close()
+        except exceptions.YubiHsmError:
+            pass
+        if self.hsm:
+            self.hsm.close()
+
+    def check(self):
+        """Open a session and see whether the key is there already."""
+        start = time.perf_counter()
+        self.hsm = connect(self.url)
+        self.serial = self.hsm.get_device_info().serial
+        self.session = create_session(self.hsm, args.authkey_id, args.authkey_password)
+        self.timing['connect_ms'] = ms(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            existing = fingerprint(AsymmetricKey(self.session, args.id).get_public_key())
+        except exceptions.YubiHsmDeviceError as e:
+            if e.code != ERROR.OBJECT_NOT_FOUND:
+                raise
+            existing = None
+        self.timing['check_ms'] = ms(time.perf_counter() - start)
+
+        if existing == source_fp:
+            self.status = 'present'
+        elif existing is not None:
+            self.error = f'HSM {self.serial} holds a different key with ID {args.id}.'
+        else:
+            self.status = 'missing'
+
+    def replicate(self, aes_key, delegated, wrapped):
+        start = time.perf_counter()
+        wrap_key = put_wrap_key(self.session, aes_key, delegated)
+        try:
+            key = wrap_key.import_wrapped(wrapped)
+        finally:
+            wrap_key.delete()
+        self.timing['import_ms'] = ms(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        replica_fp = fingerprint(key.get_public_key())
+        self.timing['verify_ms'] = ms(time.perf_counter() - start)
+        if replica_fp != source_fp:
+            self.error = f'The copy on HSM {self.serial} has a different public key.'
+            return
+        self.status = 'imported'
+
+    def run(self, step, *step_args):
+        try:
+            step(self, *step_args)
+        except Exception as e:
+            # Runs in its own thread, so anything raised is recorded for the summary
+            self.status = 'failed'
+            self.error = str(e) or e.__class__.__name__
+
+
+def in_parallel(step, items, *step_args):
+    threads = [threading.Thread(target=item.run, args=(step,) + step_args) for item in items]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+devices = [Target(url) for url in targets]
+start = time.perf_counter()
+try:
+    # Read the key from the source HSM
+    hsm = connect(args.source)
+    source_serial = hsm.get_device_info().serial
+    session = create_session(hsm, args.authkey_id, args.authkey_password)
+    info = session.get_object(args.id, OBJECT.ASYMMETRIC_KEY).get_info()
+    if not info.capabilities & CAP.EXPORTABLE_UNDER_WRAP:
+        print(f'Error: Key {args.id} can not be exported.')
+        sys.exit(-1)
+    source_fp = fingerprint(AsymmetricKey(session, args.id).get_public_key())
+    print(f'Copying key {args.id} ({info.algorithm.name}, {info.label}) from HSM {source_serial}. Fingerprint sha256:{source_fp}')
+
+    # Open all targets at once and leave out the ones that have the key
+    in_parallel(Target.check, devices)
+    for d in devices:
+        if d.serial == source_serial and d.status != 'failed':
+            d.status = 'source'
+    missing = [d for d in devices if d.status == 'missing']
+
+    if missing:
+        # Export once, under a wrap key that is put on every HSM
+        aes_key = session.get_pseudo_random(32)
+        delegated = info.capabilities | CAP.EXPORTABLE_UNDER_WRAP
+        t = time.perf_counter()
+        wrap_key = put_wrap_key(session, aes_key, delegated)
+        try:
+            wrapped = wrap_key.export_wrapped(session.get_object(args.id, OBJECT.ASYMMETRIC_KEY))
+        finally:
+            wrap_key.delete()
+        print(f'Exported key {args.id} in {ms(time.perf_counter() - t)} ms.')
+
+        in_parallel(Target.replicate, missing, aes_key, delegated, wrapped)
+
+    session.close()
+    hsm.close()
+except exceptions.YubiHsmAuthenticationError as e:
+    print(f'ERROR: Failed to authenticate. [{e}]')
+    sys.exit(-1)
+except exceptions.YubiHsmConnectionError as e:
+    print(f'ERROR: Failed to connect to HSM. [{e}]')
+    sys.exit(-2)
+except exceptions.YubiHsmDeviceError as e:
+    print(f'ERROR: Failed to export asymmetric key. [{e}]')
+    sys.exit(-3)
+except ValueError as e:
+    print(f'ERROR: [{e}]')
+    sys.exit(-4)
+finally:
+    for d in devices:
+        d.close()
+
+for d in devices:
+    timing = ', '.join(f'{name[:-3]} {value} ms' for name, value in d.timing.items())
+    print(f'{d.status.upper()}: HSM {d.serial or d.url}' + (f' ({timing})' if timing else '') + (f' [{d.error}]' if d.error else ''))
+
+statuses = [d.status for d in devices]
+print(f'Key {args.id} copied to {statuses.count("imported")} HSMs, already on {statuses.count("present")}, '
+      f'failed on {statuses.count("failed")} in {time.perf_counter() - start:.2f}s.')
+
+if 'failed' in statuses:
+    sys.exit(-5)
+
+sys.exit(0)
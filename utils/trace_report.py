@@ -0,0 +1,75 @@
+import sys
+import os
+import argparse
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hsmtools.trace import command_of, load_runs
+
+parser = argparse.ArgumentParser(
+                    prog='trace_report',
+                    description='Summarize a trace written with --trace: time spent waiting for the HSM per command and on the host.')
+
+parser.add_argument('trace', help='Trace file to summarize.')
+parser.add_argument('--compare', metavar='TRACE', help='Earlier trace of the same workload, e.g. the production run that was replayed.')
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def summarize(path):
+    runs = load_runs(path)
+    commands = collections.defaultdict(list)
+    errors = collections.Counter()
+    wall = hsm = 0.0
+    for _, records in runs:
+        if not records:
+            continue
+        for record in records:
+            commands[command_of(record)].append(record['ms'])
+            if 'error' in record:
+                errors[command_of(record)] += 1
+        # From the first message sent to the last answer received
+        wall += max(r['t'] * 1000 + r['ms'] for r in records) - records[0]['t'] * 1000
+        hsm += sum(r['ms'] for r in records)
+    return {'runs': len(runs), 'commands': commands, 'errors': errors, 'wall_ms': wall, 'hsm_ms': hsm}
+
+
+def print_summary(path, summary):
+    print(f'{path}: {summary["runs"]} program runs')
+    print(f'  {"command":<28} {"count":>7} {"errors":>7} {"total ms":>11} {"p50 ms":>9} {"p99 ms":>9}')
+    for name, times in sorted(summary['commands'].items(), key=lambda item: -sum(item[1])):
+        times = sorted(times)
+        print(f'  {name:<28} {len(times):>7} {summary["errors"][name]:>7} {sum(times):>11.1f} '
+              f'{percentile(times, 0.50):>9.2f} {percentile(times, 0.99):>9.2f}')
+    # Messages sent from several threads overlap, then the host time is not meaningful
+    host = summary['wall_ms'] - summary['hsm_ms']
+    print(f'  wall {summary["wall_ms"]:.1f} ms, waiting for the HSM {summary["hsm_ms"]:.1f} ms, '
+          f'host {max(host, 0):.1f} ms between messages')
+
+
+args = parser.parse_args()
+
+try:
+    summary = summarize(args.trace)
+    baseline = summarize(args.compare) if args.compare else None
+except (OSError, ValueError, KeyError) as e:
+    print(f'ERROR: Failed to read the trace. [{e}]')
+    sys.exit(-1)
+
+print_summary(args.trace, summary)
+
+if baseline:
+    print()
+    print_summary(args.compare, baseline)
+    print()
+    for name in ('wall_ms', 'hsm_ms'):
+        old, new = baseline[name], summary[name]
+        change = f'{(new - old) / old * 100:+.1f}%' if old else ''
+        print(f'{name[:-3]:<6} {old:>11.1f} ms -> {new:>11.1f} ms {change}')
+    old_host = baseline['wall_ms'] - baseline['hsm_ms']
+    new_host = summary['wall_ms'] - summary['hsm_ms']
+    print(f'{"host":<6} {old_host:>11.1f} ms -> {new_host:>11.1f} ms')
+
+sys.exit(0)
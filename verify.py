@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from hsmtools import verify
+from hsmtools.pubkeys import load_bundle
+from hsmtools.signing import DEFAULT_SCHEME, SCHEMES, collect_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='verify',
+                        description='Verify the .sig files written by sign.py and sign_batch.py in parallel. No HSM is needed.')
+
+    parser.add_argument('-c', '--chunk-size', default=4, type=int, help='Size in MiB of the chunks used to hash each file. (Default: 4)')
+    parser.add_argument('-m', '--manifest', action='store_true', help='Treat source as a manifest file listing one file per line.')
+    parser.add_argument('-i', '--id', type=int, help='Only accept signatures made by this key ID from the keyring.')
+    parser.add_argument('-A', '--algorithm', default=DEFAULT_SCHEME, choices=SCHEMES, help=f'Signature algorithm the files were signed with. (Default: {DEFAULT_SCHEME})')
+    parser.add_argument('-j', '--jobs', default=os.cpu_count() or 1, type=int, help='Number of worker processes. (Default: number of CPUs)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only report files that failed.')
+    parser.add_argument('public_key', help='PEM file of the signing key or keyring bundle, as written by utils/get_pub_keys.py.')
+    parser.add_argument('source', help='Directory, glob pattern (quote it) or manifest file of the signed files.')
+
+    args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error('argument -c/--chunk-size: must be at least 1')
+
+    try:
+        keys = load_bundle(args.public_key)
+        files = collect_files(args.source, args.manifest)
+    except (OSError, ValueError) as e:
+        print(f'ERROR: [{e}]')
+        return -1
+
+    if args.id is not None and args.id not in keys:
+        print(f'ERROR: Key {args.id} is not in {args.public_key}.')
+        return -1
+
+    if not files:
+        print('Error: No files found.')
+        return -1
+
+    start = time.perf_counter()
+    passed = failed = 0
+    with multiprocessing.Pool(args.jobs, verify.init_worker, (args.public_key, args.id, args.chunk_size * 1024 * 1024, args.algorithm)) as pool:
+        # Results are reported as soon as each file is done, not in input order.
+        for filename, ok, detail in pool.imap_unordered(verify.verify_file, files, chunksize=16):
+            if ok:
+                passed += 1
+                if not args.quiet:
+                    # A plain PEM file holds a single key without a key ID
+                    print(f'OK: {filename}' + (f' (key {detail})' if detail is not None else ''))
+            else:
+                failed += 1
+                print(f'FAILED: {filename} [{detail}]')
+
+    elapsed = time.perf_counter() - start
+    print(f'Verified {passed + failed} files in {elapsed:.2f}s ({(passed + failed) / elapsed:.1f} files/s): '
+          f'{passed} passed, {failed} failed.')
+
+    if failed:
+        return -5
+
+    return 0
+
+
+# Workers started with spawn (the default on Windows and macOS) import this
+# file again, only the main process may run it.
+if __name__ == '__main__':
+    sys.exit(main())
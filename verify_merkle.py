@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
+
+from hsmtools import merkle
+from hsmtools.pubkeys import load_bundle
+from hsmtools.signing import hash_file
+
+parser = argparse.ArgumentParser(
+                    prog='verify_merkle',
+                    description='Verify a file against a Merkle root signed by sign_merkle.py. No HSM is needed.')
+
+parser.add_argument('-p', '--proof', help='Proof file to use. (Default: <filename>.proof)')
+parser.add_argument('public_key', help='PEM file of the signing key or keyring bundle, as written by utils/get_pub_keys.py.')
+parser.add_argument('filename', help='File to verify.')
+
+args = parser.parse_args()
+
+try:
+    keys = load_bundle(args.public_key)
+    digest, _ = hash_file(args.filename)
+except (OSError, ValueError) as e:
+    print(f'ERROR: [{e}]')
+    sys.exit(-1)
+
+proof_file = args.proof or args.filename + '.proof'
+try:
+    proof = merkle.load_proof(proof_file)
+except OSError as e:
+    print(f'ERROR: [{e}]')
+    sys.exit(-1)
+except ValueError as e:
+    print(f'ERROR: {proof_file} is not a valid proof. [{e}]')
+    sys.exit(-1)
+
+# A plain PEM file holds a single key without a key ID
+public_key = keys.get(proof['key_id'], keys.get(None))
+if public_key is None:
+    print(f'ERROR: Key {proof["key_id"]} is not in {args.public_key}.')
+    sys.exit(-1)
+
+# sign_merkle.py signs the root with ECDSA
+if not isinstance(public_key, ec.EllipticCurvePublicKey):
+    print(f'ERROR: Key {proof["key_id"]} in {args.public_key} is not an EC key, the root is signed with ECDSA.')
+    sys.exit(-1)
+
+if digest != proof['digest']:
+    print(f'FAILED: {args.filename} does not match the digest in the proof.')
+    sys.exit(-3)
+
+leaf = merkle.leaf_hash(proof['path'], digest)
+root = merkle.root_from_proof(leaf, proof['proof'])
+
+if root != proof['root']:
+    print(f'FAILED: {args.filename} is not included in the signed root.')
+    sys.exit(-3)
+
+try:
+    public_key.verify(proof['signature'], root, ec.ECDSA(Prehashed(hashes.SHA256())))
+except InvalidSignature:
+    print('FAILED: The root signature is not valid for this public key.')
+    sys.exit(-3)
+
+print(f'OK: {args.filename} ({proof["path"]}) is included in root {proof["root"].hex()} signed by key {proof["key_id"]}.')
+
+sys.exit(0)